@@ -0,0 +1,53 @@
+import tempfile, time
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from ann_vector_store import IVFVectorStore
+
+"""
+Benchmark used by `python app.py --benchmark-ann`. It fills an IVF store with clustered random vectors (a stand in for
+embeddings, which are clustered by topic too) and reports recall@k against exact search along with the query latency
+for a range of nprobe values, so ANN_NPROBE can be tuned for the size of the knowledge base.
+"""
+BENCHMARK_NPROBES = [1, 2, 4, 8, 16, 32, 64]
+
+
+# Random unit vectors grouped around a number of topics
+def clustered_vectors(count, dim, topics, rng):
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    vectors = centers[rng.integers(topics, size=count)] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+# Runs every query against the store and returns the result ids and the mean latency in milliseconds
+def _run_queries(store, queries, k):
+    results = []
+    start = time.perf_counter()
+    for q in queries:
+        results.append(store.query(VectorStoreQuery(query_embedding=q.tolist(), similarity_top_k=k)).ids)
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def benchmark_ann(count=200000, dim=384, num_queries=200, k=10, topics=500, nprobes=BENCHMARK_NPROBES, batch=10000):
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(count, dim, topics, rng)
+    with tempfile.TemporaryDirectory() as persist_dir:
+        store = IVFVectorStore(persist_dir)
+        start = time.perf_counter()
+        for offset in range(0, count, batch):
+            store.add([TextNode(id_=str(offset + i), text="", embedding=vector.tolist())
+                       for i, vector in enumerate(vectors[offset:offset + batch])])
+        print(f"Inserted {count} vectors of dimension {dim} in {time.perf_counter() - start:.1f}s, "
+              f"{len(store._centroids)} clusters\n")
+        queries = clustered_vectors(num_queries, dim, topics, rng)
+        # Exact results come from the same store with the clusters hidden
+        centroids, store._centroids = store._centroids, None
+        exact, exact_ms = _run_queries(store, queries, k)
+        store._centroids = centroids
+        print(f"{'nprobe':>8}{'recall@' + str(k):>12}{'ms/query':>12}{'speedup':>10}")
+        print(f"{'exact':>8}{1.0:>12.3f}{exact_ms:>12.2f}{1.0:>10.1f}")
+        for nprobe in nprobes:
+            store.nprobe = nprobe
+            approx, approx_ms = _run_queries(store, queries, k)
+            recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)])
+            print(f"{nprobe:>8}{recall:>12.3f}{approx_ms:>12.2f}{exact_ms / approx_ms:>10.1f}")
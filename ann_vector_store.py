@@ -0,0 +1,110 @@
+import math, os
+import numpy as np
+from typing import Any
+from llama_index.core.bridge.pydantic import PrivateAttr
+from local_vector_store import MemmapVectorStore, top_k_indices
+from config import (ANN_NLIST, ANN_NPROBE, ANN_MAX_LISTS, ANN_MIN_TRAIN_SIZE, ANN_RETRAIN_GROWTH,
+                    ANN_TRAIN_ITERATIONS, ANN_TRAIN_SAMPLE_PER_LIST, LOCAL_VECTOR_QUERY_CHUNK)
+
+
+"""
+Approximate nearest neighbour version of the built in local vector store, using an inverted file (IVF) index. The
+vectors are clustered with spherical k-means and every row remembers its closest cluster, so a query only scores the
+rows in the `nprobe` clusters closest to it instead of the whole matrix. New rows are assigned to the existing clusters
+as they are inserted, and the clusters are retrained when the store has grown enough that they no longer fit the data.
+Small stores, and queries restricted to node ids, fall back to exact search.
+"""
+class IVFVectorStore(MemmapVectorStore):
+    nlist: int = ANN_NLIST
+    nprobe: int = ANN_NPROBE
+
+    _centroids: Any = PrivateAttr(default=None)
+    _assignments: Any = PrivateAttr(default=None)
+    _trained_count: int = PrivateAttr(default=0)
+
+    def __init__(self, persist_dir, nlist=ANN_NLIST, nprobe=ANN_NPROBE, **kwargs):
+        super().__init__(persist_dir, nlist=nlist, nprobe=nprobe, **kwargs)
+
+    @classmethod
+    def class_name(cls):
+        return "IVFVectorStore"
+
+    @property
+    def _ivf_path(self):
+        return os.path.join(self.persist_dir, "ivf.npz")
+
+    def _load(self):
+        super()._load()
+        self._assignments = np.zeros(max(self._capacity, 1024), dtype=np.int32)
+        if os.path.exists(self._ivf_path):
+            saved = np.load(self._ivf_path)
+            self._centroids = saved["centroids"]
+            self._assignments[:self._count] = saved["assignments"][:self._count]
+            self._trained_count = int(saved["trained_count"])
+
+    def add(self, nodes, **add_kwargs):
+        with self._lock:
+            ids = super().add(nodes, **add_kwargs)
+            if len(self._assignments) < self._capacity:
+                assignments = np.zeros(self._capacity, dtype=np.int32)
+                assignments[:len(self._assignments)] = self._assignments
+                self._assignments = assignments
+            if self._count >= max(ANN_MIN_TRAIN_SIZE, self._trained_count * ANN_RETRAIN_GROWTH):
+                self.train()
+            elif self._centroids is not None:
+                self._assign(self._count - len(ids), self._count)
+        return ids
+
+    def _remove_row(self, row):
+        last = self._count - 1
+        if row != last:
+            self._assignments[row] = self._assignments[last]
+        super()._remove_row(row)
+
+    # Assigns rows start..end to their closest cluster
+    def _assign(self, start, end):
+        for chunk in range(start, end, LOCAL_VECTOR_QUERY_CHUNK):
+            chunk_end = min(chunk + LOCAL_VECTOR_QUERY_CHUNK, end)
+            block = np.asarray(self._vectors[chunk:chunk_end], dtype=np.float32)
+            self._assignments[chunk:chunk_end] = np.argmax(block @ self._centroids.T, axis=1)
+
+    # Clusters a sample of the stored vectors with spherical k-means and reassigns every row to the new clusters
+    def train(self):
+        with self._lock:
+            nlist = self.nlist or int(min(ANN_MAX_LISTS, max(16, 4 * math.sqrt(self._count))))
+            nlist = min(nlist, self._count)
+            rng = np.random.default_rng(0)
+            sample_size = min(self._count, nlist * ANN_TRAIN_SAMPLE_PER_LIST)
+            sample_rows = np.sort(rng.choice(self._count, size=sample_size, replace=False))
+            sample = np.asarray(self._vectors[sample_rows], dtype=np.float32)
+            centroids = sample[rng.choice(sample_size, size=nlist, replace=False)]
+            for _ in range(ANN_TRAIN_ITERATIONS):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                # Clusters that lost all their vectors keep their old centroid
+                empty = np.bincount(labels, minlength=nlist) == 0
+                sums[empty] = centroids[empty]
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                centroids = sums / np.where(norms == 0, 1.0, norms)
+            self._centroids = centroids
+            self._assign(0, self._count)
+            self._trained_count = self._count
+
+    # Only the rows in the clusters closest to the query are scored
+    def _candidate_rows(self, query, q):
+        if query.node_ids or self._centroids is None:
+            return super()._candidate_rows(query, q)
+        probes = top_k_indices(self._centroids @ q, min(self.nprobe, len(self._centroids)))
+        probed = np.zeros(len(self._centroids), dtype=bool)
+        probed[probes] = True
+        return np.flatnonzero(probed[self._assignments[:self._count]])
+
+    def persist(self, persist_path=None, fs=None):
+        with self._lock:
+            super().persist(persist_path, fs)
+            if self._centroids is not None:
+                tmp_path = self._ivf_path + ".tmp.npz"
+                np.savez(tmp_path, centroids=self._centroids, assignments=self._assignments[:self._count],
+                         trained_count=self._trained_count)
+                os.replace(tmp_path, self._ivf_path)
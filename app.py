@@ -1,4 +1,15 @@
 # This file is used to launch the program if the user wants to launch it using python argument versus gradio
-from chatrag import demo
+# Run `python app.py --profile-startup` to print an import time breakdown instead of launching the app
+# Run `python app.py --benchmark-ann` to print the recall and latency of the Local ANN vector store against exact search
+import sys
 
-demo.launch(inbrowser=True, share=True)
\ No newline at end of file
+if "--profile-startup" in sys.argv:
+    from startup_profile import profile_startup
+    profile_startup()
+elif "--benchmark-ann" in sys.argv:
+    from ann_benchmark import benchmark_ann
+    benchmark_ann()
+else:
+    from chatrag import demo
+
+    demo.launch(inbrowser=True, share=True)
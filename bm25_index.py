@@ -0,0 +1,209 @@
+import asyncio, json, math, os, re, threading, weakref
+from collections import Counter
+from heapq import nlargest
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+from config import BM25_K1, BM25_B, HYBRID_SEARCH, HYBRID_CANDIDATES, RRF_K
+
+WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+SUBWORD_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+_sparse_indexes = weakref.WeakKeyDictionary()
+
+
+# Lowercased words, plus the parts of snake_case and camelCase identifiers so both the whole name and its parts match
+def tokenize(text):
+    tokens = []
+    for word in WORD_PATTERN.findall(text):
+        tokens.append(word.lower())
+        parts = SUBWORD_PATTERN.findall(word)
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts)
+    return tokens
+
+
+"""
+Local BM25 inverted index over the same nodes as the vector index. Nodes are added as they are inserted by the ingest
+pipeline and removed with the documents they came from, so it never has to be rebuilt. Dense retrieval misses exact
+identifiers in code, which is exactly what BM25 is good at.
+"""
+class BM25Index:
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._node_terms = {}
+        self._node_lengths = {}
+        self._ref_doc_nodes = {}
+        self._total_length = 0
+
+    def _add(self, node_id, ref_doc_id, term_counts):
+        self._remove_node(node_id)
+        for term, count in term_counts.items():
+            self._postings.setdefault(term, {})[node_id] = count
+        length = sum(term_counts.values())
+        self._node_terms[node_id] = (ref_doc_id, term_counts)
+        self._node_lengths[node_id] = length
+        self._ref_doc_nodes.setdefault(ref_doc_id, set()).add(node_id)
+        self._total_length += length
+
+    def _remove_node(self, node_id):
+        if node_id not in self._node_terms:
+            return
+        ref_doc_id, term_counts = self._node_terms.pop(node_id)
+        for term in term_counts:
+            postings = self._postings[term]
+            del postings[node_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._node_lengths.pop(node_id)
+        self._ref_doc_nodes.get(ref_doc_id, set()).discard(node_id)
+
+    def add_nodes(self, nodes):
+        with self._lock:
+            for node in nodes:
+                term_counts = Counter(tokenize(node.get_content(metadata_mode=MetadataMode.EMBED)))
+                self._add(node.node_id, node.ref_doc_id or node.node_id, dict(term_counts))
+
+    # Removes every node that came from the document
+    def delete_ref_doc(self, ref_doc_id):
+        with self._lock:
+            for node_id in self._ref_doc_nodes.pop(ref_doc_id, set()):
+                self._remove_node(node_id)
+
+    # Returns the (node id, score) pairs of the top k nodes for the query
+    def search(self, query, k):
+        with self._lock:
+            total = len(self._node_lengths)
+            if not total:
+                return []
+            avg_length = self._total_length / total
+            scores = Counter()
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for node_id, count in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._node_lengths[node_id] / avg_length)
+                    scores[node_id] += idf * count * (self.k1 + 1) / (count + norm)
+            return nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def __len__(self):
+        return len(self._node_lengths)
+
+    def save(self, path):
+        with self._lock:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"k1": self.k1, "b": self.b, "nodes": self._node_terms}, f)
+            os.replace(tmp_path, path)
+
+    # Loads a saved index, or returns None if there isn't one at the path
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            saved = json.load(f)
+        bm25 = cls(saved["k1"], saved["b"])
+        for node_id, (ref_doc_id, term_counts) in saved["nodes"].items():
+            bm25._add(node_id, ref_doc_id, term_counts)
+        return bm25
+
+
+# Attaches a BM25 index to a vector index so the ingest pipeline keeps it up to date and retrieval fuses it in
+def attach_sparse_index(index, bm25):
+    _sparse_indexes[index] = bm25
+
+
+def sparse_index(index):
+    return _sparse_indexes.get(index)
+
+
+# Removes a document from the vector index and its BM25 index
+def delete_ref_doc(index, ref_doc_id):
+    index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+    bm25 = sparse_index(index)
+    if bm25 is not None:
+        bm25.delete_ref_doc(ref_doc_id)
+
+
+# Merges ranked lists of node ids by reciprocal rank fusion and returns (node id, fused score) pairs, best first
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    scores = Counter()
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking):
+            scores[node_id] += 1.0 / (k + rank + 1)
+    return scores.most_common()
+
+
+"""
+Retriever that runs dense retrieval and BM25 over a few more candidates than it returns and fuses the two rankings by
+reciprocal rank fusion. Nodes that both find rise to the top, so a small top k still catches exact identifier matches.
+Nodes only BM25 found are read from the docstore, or from the vector store if it keeps the text itself.
+"""
+class HybridRetriever(BaseRetriever):
+    def __init__(self, index, bm25, similarity_top_k=2, candidates=HYBRID_CANDIDATES, **kwargs):
+        super().__init__()
+        self._index = index
+        self._bm25 = bm25
+        self._similarity_top_k = similarity_top_k
+        self._candidates = max(candidates, similarity_top_k)
+        self._dense = index.as_retriever(similarity_top_k=self._candidates, **kwargs)
+
+    def _fuse(self, query_bundle, dense_nodes):
+        sparse_hits = self._bm25.search(query_bundle.query_str, self._candidates)
+        nodes = {n.node.node_id: n for n in dense_nodes}
+        fused = reciprocal_rank_fusion([[n.node.node_id for n in dense_nodes],
+                                        [node_id for node_id, _ in sparse_hits]])[:self._similarity_top_k]
+        missing = [node_id for node_id, _ in fused if node_id not in nodes]
+        for node in self._get_nodes(missing):
+            nodes[node.node_id] = NodeWithScore(node=node)
+        return [NodeWithScore(node=nodes[node_id].node, score=score) for node_id, score in fused if node_id in nodes]
+
+    def _get_nodes(self, node_ids):
+        found = {}
+        for node_id in node_ids:
+            node = self._index.docstore.get_node(node_id, raise_error=False)
+            if node is not None:
+                found[node_id] = node
+        missing = [node_id for node_id in node_ids if node_id not in found]
+        if missing and self._index.vector_store.stores_text:
+            try:
+                found.update((node.node_id, node) for node in self._index.vector_store.get_nodes(node_ids=missing))
+            except NotImplementedError:
+                pass
+        return list(found.values())
+
+    def _retrieve(self, query_bundle):
+        return self._fuse(query_bundle, self._dense.retrieve(query_bundle))
+
+    async def _aretrieve(self, query_bundle):
+        if not native_async_store(self._index.vector_store):
+            return await asyncio.to_thread(self._retrieve, query_bundle)
+        dense_nodes = await self._dense.aretrieve(query_bundle)
+        # Scoring BM25 and reading nodes from the docstore block, so they stay off the event loop
+        return await asyncio.to_thread(self._fuse, query_bundle, dense_nodes)
+
+
+# Whether the vector store has its own aquery. The default one just runs the blocking query, which for the in memory
+# store is a cosine scan over every vector, on the event loop.
+def native_async_store(vector_store):
+    return type(vector_store).aquery is not BasePydanticVectorStore.aquery
+
+
+# Retrieves through the retrievers async path if the index's vector store supports it, otherwise in a worker thread
+async def aretrieve(retriever, index, query_bundle):
+    if native_async_store(index.vector_store):
+        return await retriever.aretrieve(query_bundle)
+    return await asyncio.to_thread(retriever.retrieve, query_bundle)
+
+
+# Hybrid retriever for the index if it has a BM25 index and hybrid search is on, otherwise a plain dense retriever
+def build_retriever(index, similarity_top_k=2, **kwargs):
+    bm25 = sparse_index(index)
+    if HYBRID_SEARCH and bm25 is not None:
+        return HybridRetriever(index, bm25, similarity_top_k=similarity_top_k, **kwargs)
+    return index.as_retriever(similarity_top_k=similarity_top_k, **kwargs)
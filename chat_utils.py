@@ -1,65 +1,182 @@
-from llama_index.core import SimpleDirectoryReader, StorageContext
-from llama_parse import LlamaParse
-from llama_index.vector_stores.neo4jvector import Neo4jVectorStore
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.vector_stores.milvus import MilvusVectorStore
-from llama_index.readers.github import GithubClient, GithubRepositoryReader
-from utils import (setup_index_and_chat_engine, set_embedding_model, set_chat_memory,
+from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
+from utils import (setup_index, setup_chat_engine, set_embedding_model, set_chat_memory, clear_gpu_memory,
+                   chat_memory_limit,
                    set_ollama_llm, set_huggingface_llm, set_nvidia_model, set_openai_model, set_anth_model)
-import torch, os, glob, gc, dotenv, chromadb
+from summary_memory import SummaryChatMemory
+from doc_loader import list_local_files, iter_parsed_files
+from ingest_pipeline import run_ingest_pipeline
+from retrieval_cache import bump_index_version
+from bm25_index import BM25Index, attach_sparse_index, sparse_index, delete_ref_doc
+from doc_manifest import DocumentManifest
+from github_sync import repo_doc_id, github_repo_sync
+from git_source import LocalGitRepo
+import gradio as gr
+import os, subprocess, threading, dotenv
 dotenv.load_dotenv()
 
-DIRECTORY_PATH = "data"
 Neo4j_DB_PATH = "Databases/Neo4j"
 Chroma_DB_PATH = "Databases/ChromaDB"
 Milvus_DB_PATH = "Databases/MilvusDB"
-EMBED_MODEL = set_embedding_model()
+Local_Index_PATH = "Databases/LocalIndex"
+Local_Vector_PATH = "Databases/LocalVectorStore"
+Local_ANN_PATH = "Databases/LocalANN"
+DEFAULT_CHROMA_COLLECTION = "chatrag"
+_embed_model = None
+_embed_model_lock = threading.Lock()
+_chroma_client = None
+_chroma_stores = {}
+_chroma_lock = threading.Lock()
+_local_stores = {}
+_local_lock = threading.Lock()
+
+
+"""
+Returns the cached embedding model, loading it on first use. Loading is behind a lock so concurrent callers and the
+warm up thread never load the model twice. Chats without any data never call this so they skip the load entirely.
+"""
+def get_embed_model():
+    global _embed_model
+    if _embed_model is None:
+        with _embed_model_lock:
+            if _embed_model is None:
+                from embed_cache import CachedEmbedding
+                _embed_model = CachedEmbedding(set_embedding_model())
+    return _embed_model
+
+# Starts loading the embedding model in the background so it is ready by the time the first index gets built
+def warm_up_embed_model():
+    thread = threading.Thread(target=get_embed_model, name="embed-model-warmup", daemon=True)
+    thread.start()
+    return thread
 
 # TODO Add free parsing options for advanced docs, Llama Parse only lets you parse 1000 free docs a day
-# TODO Figure out why multiprocessing of docs causes program to reload in a loop
-# Local Document Loading Function
-def load_local_docs():
-    parser = LlamaParse(api_key=os.getenv("LLAMA_CLOUD_API_KEY"))
-    all_files = glob.glob(os.path.join(DIRECTORY_PATH, "**", "*"), recursive=True)
-    all_files = [f for f in all_files if os.path.isfile(f)]
-    documents = []
-    supported_extensions = [".pdf", ".docx", ".xlsx", ".csv", ".xml", ".html"]
-    for file in all_files:
-        file_extension = os.path.splitext(file)[1].lower()
-        if "LLAMA_CLOUD_API_KEY" in os.environ and file_extension in supported_extensions:
-            file_extractor = {file_extension: parser}
-            documents.extend(
-                SimpleDirectoryReader(input_files=[file], file_extractor=file_extractor).load_data())
-        else:
-            documents.extend(SimpleDirectoryReader(input_files=[file]).load_data())
-    return documents
-
-# GitHub Repo Reader setup function. Sets all initial parameters and handles data load of the repository
-def load_github_repo(owner, repo, branch):
-    if "GITHUB_PAT" in os.environ:
-        github_client = GithubClient(github_token=os.getenv("GITHUB_PAT"), verbose=True)
-        owner=owner
-        repo=repo
-        branch=branch
-        documents= GithubRepositoryReader(
-            github_client=github_client,
-            owner=owner,
-            repo=repo,
-            use_parser=False,
-            verbose=False,
-            filter_file_extensions=([".png", ".jpg", ".jpeg", ".gif", ".svg"],
-                                    GithubRepositoryReader.FilterType.EXCLUDE)
-        ).load_data(branch=branch)
-        return documents
-    else:
-        print("Couldn't find your GitHub Personal Access Token in the environment file. Make sure you enter your "
-              "GitHub Personal Access Token in the .env file.")
+# Streams local documents as their files finish parsing. Given a dict, the ids of every files documents are added to it.
+def iter_local_docs(files=None, parsed=None):
+    for file, file_docs in iter_parsed_files(list_local_files() if files is None else files):
+        if parsed is not None:
+            parsed[file] = [doc.doc_id for doc in file_docs]
+        yield from file_docs
+
+"""
+Brings the index up to date with the local data directory using the manifest. Only new or modified files are parsed
+and inserted, documents from modified or deleted files are removed, and untouched files are skipped entirely. Files are
+only recorded in the manifest once their documents are in the index. If embedding or inserting fails, whatever made it
+in is removed again so the next sync picks the files up from scratch.
+"""
+def sync_local_docs(index, manifest):
+    changes = manifest.diff(list_local_files())
+    for file in changes.removed + changes.modified:
+        for doc_id in manifest.doc_ids(file):
+            delete_ref_doc(index, doc_id)
+        manifest.forget(file)
+    if changes.removed or changes.modified:
+        bump_index_version(index)
+    parsed = {}
+    try:
+        run_ingest_pipeline(iter_local_docs(changes.added + changes.modified, parsed), index, get_embed_model())
+    except BaseException:
+        for doc_ids in parsed.values():
+            for doc_id in doc_ids:
+                delete_ref_doc(index, doc_id)
+        bump_index_version(index)
+        raise
+    for file, doc_ids in parsed.items():
+        manifest.record(file, doc_ids)
+    return changes
+
+
+"""
+Brings the documents from a repository source (GitHub or a local git repository) in the index in line with the settings
+the user selected. The manifest keeps the commit the index was synced at and the blob SHA of every file under `key`. If
+the head hasn't moved nothing is read, otherwise only files whose blob changed are replaced. Different settings (or
+none) replace all of the previous repositories documents.
+"""
+def sync_repository(index, manifest, key, settings, open_source):
+    if manifest.meta.get(key) != settings or f"{key}_files" not in manifest.meta:
+        name = manifest.meta.get(f"{key}_name")
+        for path in manifest.meta.get(f"{key}_files", {}):
+            delete_ref_doc(index, repo_doc_id(name, path))
+        # Manifests saved before commits were tracked only have the document ids
+        for doc_id in manifest.meta.pop(f"{key}_doc_ids", []):
+            delete_ref_doc(index, doc_id)
+        bump_index_version(index)
+        manifest.meta.update({key: settings, f"{key}_name": None, f"{key}_commit": None, f"{key}_files": {}})
+    if not settings:
+        return
+    source = open_source()
+    if source is None:
+        return
+    ref = settings[-1]
+    commit = source.head(ref)
+    if commit == manifest.meta[f"{key}_commit"]:
+        return
+    files = source.tree(commit)
+    old_files = manifest.meta[f"{key}_files"]
+    changed = {path: sha for path, sha in files.items() if old_files.get(path) != sha}
+    for path in old_files:
+        if path not in files or path in changed:
+            delete_ref_doc(index, repo_doc_id(source.name, path))
+    bump_index_version(index)
+    run_ingest_pipeline(source.documents(ref, changed), index, get_embed_model())
+    manifest.meta.update({f"{key}_name": source.name, f"{key}_commit": commit, f"{key}_files": files})
+
+
+# Syncs the GitHub repository, only downloading the files that changed since the last sync and aren't cached yet
+def sync_github_repo(index, manifest, owner, repo, branch):
+    github = [owner, repo, branch] if owner and repo and branch else None
+    sync_repository(index, manifest, "github", github, lambda: github_repo_sync(owner, repo))
+
+
+# Syncs a git repository on disk at a branch, tag or commit (HEAD by default). Works offline. If git can't read the
+# repository the rest of the index is still built and the user is warned.
+def sync_local_repo(index, manifest, path, ref):
+    local_repo = [os.path.abspath(os.path.expanduser(path)), ref or "HEAD"] if path else None
+    try:
+        sync_repository(index, manifest, "local_repo", local_repo, lambda: LocalGitRepo(path))
+    except (subprocess.CalledProcessError, OSError) as e:
+        error = e.stderr.decode(errors="replace").strip() if getattr(e, "stderr", None) else e
+        gr.Warning(f"Couldn't read the git repository at {path} at {ref or 'HEAD'}: {error}")
+
+
+"""
+Returns the Chroma vector store for a collection. The persistent client and each collections vector store are created
+once and reused across engine resets, and get_or_create_collection replaces scanning every collection on each load.
+"""
+def get_chroma_vector_store(collection_name):
+    global _chroma_client
+    collection_name = collection_name or DEFAULT_CHROMA_COLLECTION
+    with _chroma_lock:
+        if collection_name not in _chroma_stores:
+            import chromadb
+            from llama_index.vector_stores.chroma import ChromaVectorStore
+            if _chroma_client is None:
+                _chroma_client = chromadb.PersistentClient(path=Chroma_DB_PATH)
+            chroma_collection = _chroma_client.get_or_create_collection(collection_name)
+            _chroma_stores[collection_name] = ChromaVectorStore(chroma_collection=chroma_collection,
+                                                                persist_dir=Chroma_DB_PATH)
+        return _chroma_stores[collection_name]
+
+
+# Returns the built in exact or ANN vector store for a collection, opened once and reused across engine resets
+def get_local_vector_store(collection_name, ann=False):
+    collection_name = collection_name or DEFAULT_CHROMA_COLLECTION
+    with _local_lock:
+        if (collection_name, ann) not in _local_stores:
+            if ann:
+                from ann_vector_store import IVFVectorStore
+                store = IVFVectorStore(os.path.join(Local_ANN_PATH, collection_name))
+            else:
+                from local_vector_store import MemmapVectorStore
+                store = MemmapVectorStore(os.path.join(Local_Vector_PATH, collection_name))
+            _local_stores[collection_name, ann] = store
+        return _local_stores[collection_name, ann]
 
 
 # TODO Finish and Test Vector Store implementation
-# Setting up different vector stores
+# Setting up different vector stores. Each vector store integration is only imported when it is selected.
 def setup_vector_store(vector_store, username, password, url, collection_name):
     if vector_store == "Neo4j":
+        from llama_index.vector_stores.neo4jvector import Neo4jVectorStore
         username = username
         password = password
         url = url
@@ -74,47 +191,126 @@ def setup_vector_store(vector_store, username, password, url, collection_name):
         storage_context = StorageContext.from_defaults(vector_store=neo4j_vector_store)
         return storage_context
     elif vector_store == "ChromaDB":
-        chroma_client = chromadb.EphemeralClient()
-        # Check to see if collection exists already
-        chroma_collection = ""
-        for c in chroma_client.list_collections():
-            if c == collection_name:
-                chroma_collection = chroma_client.get_collection(collection_name)
-            else:
-                chroma_collection = chroma_client.create_collection(collection_name)
-        chroma_vector_store = ChromaVectorStore(chroma_collection,
-                                                persist_dir=Chroma_DB_PATH)
-        storage_context = StorageContext.from_defaults(vector_store=chroma_vector_store)
+        storage_context = StorageContext.from_defaults(vector_store=get_chroma_vector_store(collection_name))
         return storage_context
     elif vector_store == "Milvus":
+        from llama_index.vector_stores.milvus import MilvusVectorStore
         milvus_vector_store = MilvusVectorStore(collection_name=collection_name,
                                                 dim=1536,
                                                 overwrite=False)
         storage_context = StorageContext.from_defaults(vector_store=milvus_vector_store)
         return storage_context
+    elif vector_store in ("Local", "Local ANN"):
+        local_vector_store = get_local_vector_store(collection_name, ann=vector_store == "Local ANN")
+        storage_context = StorageContext.from_defaults(vector_store=local_vector_store)
+        return storage_context
     else:
         storage_context = None
         return storage_context
 
-# Calls setup chat engine function with model and data personalization's user inputs from front end
-def create_chat_engine(model_provider, model, temperature, max_tokens, custom_prompt, top_p,
-                       context_window, quantization, owner, repo, branch, vector_store, username, password, url,
-                       collection_name):
+"""
+Returns the manifest for the index the settings point to. The default local index, Chroma collections and the built in
+local vector store collections are persisted under Databases, so their manifests are kept next to them. Other vector
+stores get an in memory manifest and are rebuilt every time.
+"""
+def index_manifest(vector_store, collection_name):
+    if not vector_store:
+        return DocumentManifest(os.path.join(Local_Index_PATH, "manifest.json"))
+    if vector_store == "ChromaDB":
+        collection_name = collection_name or DEFAULT_CHROMA_COLLECTION
+        return DocumentManifest(os.path.join(Chroma_DB_PATH, "manifests", f"{collection_name}.json"))
+    if vector_store in ("Local", "Local ANN"):
+        collection_name = collection_name or DEFAULT_CHROMA_COLLECTION
+        local_path = Local_ANN_PATH if vector_store == "Local ANN" else Local_Vector_PATH
+        return DocumentManifest(os.path.join(local_path, collection_name, "manifest.json"))
+    return DocumentManifest()
+
+
+"""
+Loads the persisted index the manifest belongs to, or returns None if there isn't a usable one. Vector stores that don't
+keep the node text (the default and built in local stores) have their docstore loaded from next to the manifest.
+"""
+def load_persisted_index(manifest, storage_context, embed_model):
+    if not manifest.exists() or manifest.meta.get("embed_model") != embed_model.model_name:
+        return None
+    if storage_context is None or not storage_context.vector_store.stores_text:
+        persist_dir = os.path.dirname(manifest.path)
+        vector_store = storage_context.vector_store if storage_context is not None else None
+        return load_index_from_storage(StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store),
+                                       embed_model=embed_model)
+    return VectorStoreIndex.from_vector_store(storage_context.vector_store, embed_model=embed_model)
+
+
+# The BM25 index is saved next to the manifest, named after it so Chroma collections sharing a directory don't collide
+def sparse_index_path(manifest):
+    return os.path.splitext(manifest.path)[0] + ".bm25.json"
+
+
+"""
+Loads the BM25 index saved with a persisted index. If there isn't one it is built from the nodes in the docstore, which
+is empty for vector stores that keep the text themselves, so those start from whatever gets synced.
+"""
+def load_sparse_index(index, manifest):
+    bm25 = BM25Index.load(sparse_index_path(manifest))
+    if bm25 is None:
+        bm25 = BM25Index()
+        bm25.add_nodes(index.docstore.docs.values())
+    return bm25
+
+
+"""
+Saves the index, its BM25 index and its manifest so the next start can load them instead of re-embedding the corpus.
+Vector stores that keep their own data (like a persistent Chroma collection) only need the manifest and BM25 index.
+"""
+def save_index(index, manifest):
+    if not manifest.path:
+        return
+    if not index.vector_store.stores_text:
+        index.storage_context.persist(persist_dir=os.path.dirname(manifest.path))
+    bm25 = sparse_index(index)
+    if bm25 is not None:
+        bm25.save(sparse_index_path(manifest))
+    manifest.save()
+
+
+"""
+Loads all of the knowledge base data and builds the vector index. Only called when the data or database changes. If a
+persisted index for the same settings exists it is loaded and only the files and repositories that changed since it was
+saved are synced, otherwise an empty index is created and everything is synced into it.
+Returns None when there is no data, repository or database to chat with so the embedding model isn't loaded.
+"""
+def create_index(owner, repo, branch, vector_store, username, password, url, collection_name, manifest=None,
+                 local_repo=None, local_ref=None):
     # Clearing GPU Memory
-    torch.cuda.empty_cache()
-    gc.collect()
-    # Loading local Documents and GitHub Repos if applicable
-    documents = load_local_docs()
-    if owner and repo and branch:
-        documents.extend(load_github_repo(owner, repo, branch))
+    clear_gpu_memory()
+    if manifest is None:
+        manifest = DocumentManifest()
+    if not list_local_files() and not (owner and repo and branch) and not vector_store and not local_repo:
+        return None
     # Loading Storage Context if any is set by a vector store
     if vector_store is not None or "":
         storage_context = setup_vector_store(vector_store, username, password, url, collection_name)
     else:
         storage_context = None
-    # Loading Embedding Model from global parameter
-    embed_model = EMBED_MODEL
-    # Loading LLM based off users input
+    # Loading Embedding Model, this is where it gets loaded the first time
+    embed_model = get_embed_model()
+    index = load_persisted_index(manifest, storage_context, embed_model)
+    if index is None:
+        manifest.clear()
+        manifest.meta["embed_model"] = embed_model.model_name
+        index = setup_index(docs=[], embed_model=embed_model, storage_context=storage_context)
+        attach_sparse_index(index, BM25Index())
+    else:
+        attach_sparse_index(index, load_sparse_index(index, manifest))
+    # Loading local Documents and GitHub Repos if applicable
+    sync_local_docs(index, manifest)
+    sync_github_repo(index, manifest, owner, repo, branch)
+    sync_local_repo(index, manifest, local_repo, local_ref)
+    save_index(index, manifest)
+    return index
+
+# Loading LLM based off users input. The LLM client is shared by every chat session.
+def create_llm(model_provider, model, temperature, max_tokens, top_p, context_window, quantization):
     llm_setters = {
         "Ollama": lambda: set_ollama_llm(model, temperature, max_tokens),
         "HuggingFace": lambda: set_huggingface_llm(model, temperature, max_tokens, top_p, context_window, quantization),
@@ -123,10 +319,24 @@ def create_chat_engine(model_provider, model, temperature, max_tokens, custom_pr
         "Anthropic": lambda: set_anth_model(model, temperature, max_tokens)
     }
     try:
-        llm = llm_setters[model_provider]()
+        return llm_setters[model_provider]()
     except KeyError:
         raise ValueError(f"Unsupported model provider: {model_provider}")
+
+"""
+Calls setup chat engine function with the LLM and custom prompt on top of an existing index, or without retrieval if the
+index is None. Pass in the previous memory to keep the conversation going when only model parameters change. With a
+prompt token budget the memory is capped at the history's share of it, so history and retrieved context never crowd
+out the answer.
+"""
+def create_chat_engine(index, llm, model, custom_prompt, memory=None, prompt_budget=None):
     # Setting model memory
-    memory = set_chat_memory(model)
-    return setup_index_and_chat_engine(docs=documents, llm=llm, embed_model=embed_model,
-                                       memory=memory, custom_prompt=custom_prompt, storage_context=storage_context)
+    if memory is None:
+        memory = set_chat_memory(model)
+    # The chat engine caps the limit at the history's share of the prompt budget, starting again from the model's own
+    memory.token_limit = chat_memory_limit(model)
+    if isinstance(memory, SummaryChatMemory):
+        # The summarizing memory writes its summaries with the current LLM
+        memory.llm = llm
+    return setup_chat_engine(index=index, llm=llm, memory=memory, custom_prompt=custom_prompt,
+                             prompt_budget=prompt_budget)
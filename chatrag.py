@@ -1,11 +1,16 @@
 import os
 import gradio as gr
 from gradio_utils import GradioUtils
-from model_utils import ModelManager
+from chat_utils import warm_up_embed_model
+from doc_loader import start_parse_pool
 import dotenv
 dotenv.load_dotenv()
+# Started before Gradio or any other thread is running, see start_parse_pool
+start_parse_pool()
+if os.getenv("EMBED_MODEL_WARMUP") == "1":
+    warm_up_embed_model()
 gradioUtils = GradioUtils()
-modelUtils = ModelManager()
+modelUtils = gradioUtils.model_manager
 
 Neo4j_DB_PATH = "Databases/Neo4j"
 Chroma_DB_PATH = "Databases/ChromaDB"
@@ -53,7 +58,7 @@ with gr.Blocks(title="Chat RAG", fill_width=True, css=css) as demo:
             # TODO Finish Database Backend Implementation
             with gr.Tab("Chat With a Database(Coming Soon)"):
                 db_selector = gr.Radio(label="Database", value="ChromaDB",
-                                       choices=["ChromaDB", "Milvus", "Neo4j"])
+                                       choices=["ChromaDB", "Milvus", "Neo4j", "Local", "Local ANN"])
                 @gr.render(inputs=db_selector)
                 def render_db_components(provider):
                     if provider == "ChromaDB":
@@ -108,6 +113,22 @@ with gr.Blocks(title="Chat RAG", fill_width=True, css=css) as demo:
                             load_db.click(modelUtils.setup_database,
                                           inputs=[db_selector, None, None, None, collection_name])
                             remove_db.click(modelUtils.remove_database)
+                    elif provider in ("Local", "Local ANN"):
+                        with gr.Row():
+                            collection_name = gr.Textbox(label="Local Collection Name", interactive=True,
+                                                         placeholder="Enter Database Collection Name Here..")
+                        with gr.Row():
+                            load_db = gr.Button("Load Database to Model",
+                                                  interactive=True,
+                                                  size="sm",
+                                                  elem_id="button")
+                            remove_db = gr.Button("Remove Database from Model",
+                                                  interactive=True,
+                                                  size="sm",
+                                                  elem_id="button")
+                            load_db.click(modelUtils.setup_database,
+                                          inputs=[db_selector, None, None, None, collection_name])
+                            remove_db.click(modelUtils.remove_database)
                     elif provider == "Neo4j":
                         with gr.Row():
                             dbfiles = gr.Files(interactive=True,
@@ -160,6 +181,22 @@ with gr.Blocks(title="Chat RAG", fill_width=True, css=css) as demo:
                                            size="sm",
                                            interactive=True,
                                            elem_id="button")
+            with gr.Tab("Chat With a Local Git Repository"):
+                localRepoPath = gr.Textbox(label="Local Repository Path:",
+                                           placeholder="Enter the Path to a Git Working Tree or Bare Repository Here....",
+                                           interactive=True)
+                localRepoRef = gr.Textbox(label="Branch, Tag or Commit:",
+                                          placeholder="HEAD",
+                                          interactive=True)
+                with gr.Row():
+                    getLocalRepo = gr.Button(value="Load Local Repository to Model",
+                                             size="sm",
+                                             interactive=True,
+                                             elem_id="button")
+                    removeLocalRepo = gr.Button(value="Reset Info and Remove Local Repository from Model",
+                                                size="sm",
+                                                interactive=True,
+                                                elem_id="button")
 
             choices = ["Ollama"]
             if "HUGGINGFACE_HUB_TOKEN" in os.environ:
@@ -170,8 +207,9 @@ with gr.Blocks(title="Chat RAG", fill_width=True, css=css) as demo:
                 choices.append("OpenAI")
             if "ANTHROPIC_API_KEY" in os.environ:
                 choices.append("Anthropic")
+            # New tabs open on the provider that is in use instead of switching everyone back to the default
             model_provider = gr.Radio(label="Select Model Provider",
-                                      value="Ollama",
+                                      value=lambda: modelUtils.provider,
                                       choices=choices,
                                       interactive=True,
                                       info="Choose your model provider.")
@@ -342,14 +380,17 @@ with gr.Blocks(title="Chat RAG", fill_width=True, css=css) as demo:
                                              inputs=[anth_temperature])
                     anth_max_tokens.release(gradioUtils.update_max_tokens,
                                             inputs=[anth_max_tokens])
-                gradioUtils.update_model_provider(provider)
 
 # ----------------------------------Button Functionality For RAG Chat-----------------------------------------------
+        # Only a user picking a provider changes the shared model, not the provider components rendering for a new tab
+        model_provider.input(gradioUtils.update_model_provider,
+                             inputs=[model_provider])
         msg.submit(gradioUtils.stream_response,
                    inputs=[msg],
                    outputs=[msg, chatbot],
                    show_progress="full",
-                   scroll_to_output=True)
+                   scroll_to_output=True,
+                   concurrency_limit=None)
     # --------------------Buttons in Left Column--------------------------------
         clear.click(gradioUtils.clear_chat_history,
                     outputs=chatbot)
@@ -358,10 +399,13 @@ with gr.Blocks(title="Chat RAG", fill_width=True, css=css) as demo:
     # --------------------Buttons in Right Column--------------------------------
         files.upload(gradioUtils.handle_doc_upload, inputs=files,
                      show_progress="full")
-        upload.click(lambda: gradioUtils.model_manager.reset_chat_engine())
+        upload.click(lambda: gradioUtils.model_manager.sync_local_data())
         clear_db.click(gradioUtils.delete_db,
                        show_progress="full")
         getRepo.click(gradioUtils.set_github_info, inputs=[repoOwnerUsername, repoName, repoBranch])
         removeRepo.click(modelUtils.reset_github_info, outputs=[repoOwnerUsername, repoName, repoBranch])
+        getLocalRepo.click(gradioUtils.set_local_repo, inputs=[localRepoPath, localRepoRef])
+        removeLocalRepo.click(modelUtils.reset_local_repo, outputs=[localRepoPath, localRepoRef])
+    demo.unload(gradioUtils.end_session)
 
 demo.launch(inbrowser=True) # , share=True
\ No newline at end of file
@@ -0,0 +1,188 @@
+import ast, os, re
+from dataclasses import dataclass, field
+from typing import Any
+from llama_index.core import Settings
+from llama_index.core.node_parser import NodeParser
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from config import CODE_CHUNK_MAX_CHARS, CODE_CHUNK_MIN_CHARS
+
+PYTHON_EXTENSIONS = {".py": "python", ".pyi": "python"}
+BRACE_EXTENSIONS = {".js": "javascript", ".jsx": "javascript", ".mjs": "javascript", ".ts": "typescript",
+                    ".tsx": "typescript", ".c": "c", ".h": "c", ".cc": "cpp", ".cpp": "cpp", ".cxx": "cpp",
+                    ".hpp": "cpp", ".cs": "csharp", ".java": "java", ".kt": "kotlin", ".scala": "scala", ".go": "go",
+                    ".rs": "rust", ".swift": "swift", ".dart": "dart", ".php": "php"}
+
+# Comment and decorator lines right above a definition belong to it rather than to whatever came before
+LEADING_LINE = re.compile(r"^\s*(#|//|/\*|\*|@)")
+# Strings and line comments are blanked out before counting braces
+STRING_OR_COMMENT = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`|//.*')
+MODIFIERS = (r"(?:(?:export|default|public|private|protected|internal|static|async|abstract|final|inline|virtual|"
+             r"override|extern|unsafe|open|data|sealed|pub(?:\([\w:]+\))?)\s+)*")
+# Top level definitions in brace languages: keyword definitions, Go funcs, JS arrow functions and C style functions
+DECLARATION = re.compile(
+    r"^\s*" + MODIFIERS +
+    r"(?:(?:function\*?|class|interface|struct|union|enum|trait|impl|fn|fun|namespace|module|type|object|mixin|"
+    r"extension)\s+(?P<name>[A-Za-z_$][\w$]*)"
+    r"|func\s+(?:\([^)]*\)\s*)?(?P<go_name>\w+)"
+    r"|(?:let|var|const)\s+(?P<arrow_name>[A-Za-z_$][\w$]*)\s*(?::[^=]+)?=\s*(?:async\s+)?"
+    r"(?:function\b|\([^)]*\)\s*(?::[^=]+)?=>|[A-Za-z_$][\w$]*\s*=>)"
+    r"|(?:[\w:<>,\[\]]+[\s*&]+)+(?P<c_name>[A-Za-z_~][\w:~]*)\s*\([^;]*$)")
+
+
+# Lines start..end (end exclusive) of a source file and the symbols defined in them
+@dataclass
+class Segment:
+    start: int
+    end: int
+    symbols: list = field(default_factory=list)
+
+
+# Moves the start of a definition up over the comments and decorators directly above it
+def _with_leading_lines(lines, start, floor):
+    while start > floor and LEADING_LINE.match(lines[start - 1]):
+        start -= 1
+    return start
+
+
+# Splits on newlines only, the way the ast module numbers lines (str.splitlines also splits on form feeds and others)
+def split_lines(text):
+    lines = [line + "\n" for line in text.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+
+# First line of a statement, including its decorators
+def _first_line(stmt):
+    return min([stmt.lineno] + [d.lineno for d in getattr(stmt, "decorator_list", [])]) - 1
+
+
+# Splits Python source on top level functions and classes, going down into classes that are too big for one chunk
+def python_segments(lines, body, start, end, prefix="", max_chars=CODE_CHUNK_MAX_CHARS):
+    segments = []
+    cursor = start
+    owner = [prefix.rstrip(".")] if prefix else []
+    for stmt in body:
+        if not isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        first = _with_leading_lines(lines, _first_line(stmt), cursor)
+        if first > cursor:
+            segments.append(Segment(cursor, first, owner))
+        name = prefix + stmt.name
+        if isinstance(stmt, ast.ClassDef) and sum(map(len, lines[first:stmt.end_lineno])) > max_chars:
+            body_start = _first_line(stmt.body[0])
+            segments.append(Segment(first, body_start, [name]))
+            segments.extend(python_segments(lines, stmt.body, body_start, stmt.end_lineno, name + ".", max_chars))
+        else:
+            segments.append(Segment(first, stmt.end_lineno, [name]))
+        cursor = stmt.end_lineno
+    if cursor < end:
+        segments.append(Segment(cursor, end, owner))
+    return segments
+
+
+"""
+Splits brace delimited source (JavaScript, C and C++, Java, Go, Rust and similar) on top level definitions. Braces are
+counted outside of strings and line comments, and a new segment starts at every definition found at depth zero.
+This is a heuristic rather than a parser, but it never drops lines, so a missed boundary only makes a chunk bigger.
+"""
+def brace_segments(lines):
+    segments = [Segment(0, 0)]
+    depth = 0
+    opened = False
+    for i, line in enumerate(lines):
+        if depth == 0:
+            match = DECLARATION.match(line)
+            if match:
+                start = _with_leading_lines(lines, i, segments[-1].start)
+                segments[-1].end = start
+                name = next(group for group in match.group("name", "go_name", "arrow_name", "c_name") if group)
+                segments.append(Segment(start, start, [name]))
+                opened = False
+            elif segments[-1].symbols and opened:
+                # The definition closed on the previous line so whatever follows it gets its own segment
+                segments[-1].end = i
+                segments.append(Segment(i, i))
+                opened = False
+        code = STRING_OR_COMMENT.sub("", line)
+        opened = opened or "{" in code
+        depth = max(0, depth + code.count("{") - code.count("}"))
+    segments[-1].end = len(lines)
+    return [segment for segment in segments if segment.end > segment.start]
+
+
+# Merges small neighbouring segments and splits segments that are over the size cap on line boundaries
+def pack_segments(lines, segments, max_chars=CODE_CHUNK_MAX_CHARS, min_chars=CODE_CHUNK_MIN_CHARS):
+    chunks = []
+    current, current_size = None, 0
+    for segment in segments:
+        size = sum(map(len, lines[segment.start:segment.end]))
+        if current is not None and (current_size < min_chars or size < min_chars) and current_size + size <= max_chars:
+            current = Segment(current.start, segment.end, current.symbols + segment.symbols)
+            current_size += size
+            continue
+        if current is not None:
+            chunks.append(current)
+        current, current_size = segment, size
+        if size > max_chars:
+            piece_start, piece_size = segment.start, 0
+            for i in range(segment.start, segment.end):
+                if piece_size and piece_size + len(lines[i]) > max_chars:
+                    chunks.append(Segment(piece_start, i, segment.symbols))
+                    piece_start, piece_size = i, 0
+                piece_size += len(lines[i])
+            current, current_size = Segment(piece_start, segment.end, segment.symbols), piece_size
+    if current is not None:
+        chunks.append(current)
+    return chunks
+
+
+"""
+Node parser for the knowledge base that splits source files on function and class boundaries instead of mid function,
+dispatched by file extension. Python is split with the ast module and brace languages by scanning for top level
+definitions. Every chunk gets the language, the symbols it defines and its line numbers as metadata, and the symbols
+are embedded with the code. Everything else, and code that doesn't parse, goes to the regular text node parser.
+"""
+class CodeNodeParser(NodeParser):
+    text_parser: Any = None
+    max_chars: int = CODE_CHUNK_MAX_CHARS
+    min_chars: int = CODE_CHUNK_MIN_CHARS
+
+    @classmethod
+    def class_name(cls):
+        return "CodeNodeParser"
+
+    # Returns the language and line segments for a document, or None if it should be split as text
+    def _segments(self, document):
+        path = document.metadata.get("file_path") or document.metadata.get("file_name") or ""
+        extension = os.path.splitext(path)[1].lower()
+        text = document.get_content()
+        lines = split_lines(text)
+        if extension in PYTHON_EXTENSIONS:
+            try:
+                body = ast.parse(text).body
+            except (SyntaxError, ValueError):
+                return None
+            return PYTHON_EXTENSIONS[extension], lines, python_segments(lines, body, 0, len(lines),
+                                                                      max_chars=self.max_chars)
+        if extension in BRACE_EXTENSIONS:
+            return BRACE_EXTENSIONS[extension], lines, brace_segments(lines)
+        return None
+
+    def _parse_nodes(self, nodes, show_progress=False, **kwargs):
+        parsed = []
+        for document in nodes:
+            result = self._segments(document)
+            if result is None:
+                parsed.extend((self.text_parser or Settings.node_parser)._parse_nodes([document], show_progress))
+                continue
+            language, lines, segments = result
+            chunks = [chunk for chunk in pack_segments(lines, segments, self.max_chars, self.min_chars)
+                      if "".join(lines[chunk.start:chunk.end]).strip()]
+            texts = ["".join(lines[chunk.start:chunk.end]) for chunk in chunks]
+            for node, chunk in zip(build_nodes_from_splits(texts, document, id_func=self.id_func), chunks):
+                node.metadata = {**node.metadata, "language": language,
+                                 "symbols": ", ".join(dict.fromkeys(chunk.symbols)),
+                                 "start_line": chunk.start + 1, "end_line": chunk.end}
+                node.excluded_embed_metadata_keys = [*node.excluded_embed_metadata_keys, "start_line", "end_line"]
+                parsed.append(node)
+        return parsed
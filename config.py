@@ -2,6 +2,9 @@
 Standard config file that stores repetitive variables and lists so they don't take up room in the main files.
 """
 
+import os, dotenv
+dotenv.load_dotenv()
+
 OLLAMA_MODEL_LIST = {
             "Codestral 22B": "codestral:latest",
             "Mistral-Nemo 12B": "mistral-nemo:latest",
@@ -37,3 +40,113 @@ ANTH_MODEL_LIST = {
             "Claude 3 Sonnet": "claude-3-sonnet-20240229",
             "Claude 3 Haiku": "claude-3-haiku-20240307"
         }
+
+# Embedding cache settings. Embeddings are stored per embedding model under this path.
+EMBED_CACHE_PATH = "Databases/EmbedCache"
+EMBED_CACHE_MAX_ENTRIES = 500000
+
+# Number of worker processes used to parse local documents. Defaults to one less than the number of cpu cores. The pool
+# is started once with the app and only used for syncs of at least INGEST_POOL_MIN_FILES files, smaller ones are parsed
+# in process.
+INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+INGEST_POOL_MIN_FILES = 16
+
+# Ingest pipeline settings. Nodes are embedded in batches of EMBED_BATCH_SIZE and each stage queue holds at most
+# INGEST_QUEUE_SIZE items so memory stays bounded.
+EMBED_BATCH_SIZE = 64
+INGEST_QUEUE_SIZE = 256
+
+# Memory budget for HuggingFace models kept loaded in the model pool. Least recently used models are dropped past this.
+HF_POOL_MEMORY_BUDGET_GB = float(os.getenv("HF_POOL_MEMORY_BUDGET_GB", "24"))
+
+# Chat sessions that haven't been used for this many seconds are evicted along with their memory and history
+SESSION_IDLE_TIMEOUT = 60 * 60
+
+# Streamed tokens are sent to the chat window at most every STREAM_FLUSH_INTERVAL seconds, or sooner once
+# STREAM_FLUSH_CHARS characters have built up
+STREAM_FLUSH_INTERVAL = 0.03
+STREAM_FLUSH_CHARS = 256
+
+# Shared HTTP connection pool settings for the remote model providers. Timeouts are in seconds.
+HTTP_POOL_MAX_CONNECTIONS = 20
+HTTP_POOL_KEEPALIVE_CONNECTIONS = 10
+HTTP_POOL_KEEPALIVE_EXPIRY = 120
+HTTP_TIMEOUT = 120.0
+HTTP_CONNECT_TIMEOUT = 10.0
+HTTP_MAX_RETRIES = 3
+HTTP_RETRY_BACKOFF = 0.5
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+# Answer cache in front of the chat engine. RESPONSE_CACHE_MODE is "off", "exact" or "semantic". In semantic mode a
+# question reuses a cached answer when its embedding similarity to a cached question is at least
+# RESPONSE_CACHE_SIMILARITY. Entries expire after RESPONSE_CACHE_TTL seconds.
+RESPONSE_CACHE_MODE = os.getenv("RESPONSE_CACHE_MODE", "off")
+RESPONSE_CACHE_TTL = 60 * 60
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+RESPONSE_CACHE_SIMILARITY = 0.95
+RESPONSE_CACHE_REPLAY_CHARS = 64
+
+# Number of recent retrieval results and query embeddings kept in memory for repeated queries
+RETRIEVAL_CACHE_MAX_ENTRIES = 1024
+QUERY_EMBED_CACHE_MAX_ENTRIES = 1024
+
+# Built in memory mapped vector store. float16 halves the file size and memory use at a small cost in precision, and
+# queries score this many rows per matrix product
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float32")
+LOCAL_VECTOR_QUERY_CHUNK = 65536
+
+# Built in IVF approximate nearest neighbour store. Queries score the vectors in the ANN_NPROBE closest of the
+# ANN_NLIST clusters (0 picks about 4 * sqrt(n) clusters), so raising ANN_NPROBE trades latency for recall. Below
+# ANN_MIN_TRAIN_SIZE vectors exact search is used, and the clusters are retrained whenever the store has grown
+# ANN_RETRAIN_GROWTH times since they were last trained.
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_MAX_LISTS = 1024
+ANN_MIN_TRAIN_SIZE = 10000
+ANN_RETRAIN_GROWTH = 4
+ANN_TRAIN_ITERATIONS = 10
+ANN_TRAIN_SAMPLE_PER_LIST = 32
+
+# Hybrid retrieval fuses dense and BM25 results by reciprocal rank fusion. Each side returns HYBRID_CANDIDATES nodes
+# before they are fused down to the retrieval top k.
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = 10
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# GitHub repositories are synced through the REST API at GITHUB_API_URL (point it at a GitHub Enterprise server or a
+# local fake for testing). Trees and file contents are cached on disk by commit and blob SHA, and changed files are
+# fetched GITHUB_FETCH_WORKERS at a time.
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_CACHE_PATH = "Databases/GitHubCache"
+GITHUB_FETCH_WORKERS = 8
+GITHUB_EXCLUDED_EXTENSIONS = [".png", ".jpg", ".jpeg", ".gif", ".svg"]
+
+# Source files are split on function and class boundaries. Chunks are capped at CODE_CHUNK_MAX_CHARS and pieces smaller
+# than CODE_CHUNK_MIN_CHARS are merged with their neighbours.
+CODE_CHUNK_MAX_CHARS = 3000
+CODE_CHUNK_MIN_CHARS = 400
+
+# CONTEXT mode retrieves this many candidate chunks and packs as many as fit in the prompt token budget. Chat history
+# can use up to CONTEXT_MEMORY_SHARE of the budget left after the system prompt before retrieved context is cut back.
+CONTEXT_CANDIDATES = 8
+CONTEXT_MEMORY_SHARE = 0.5
+# Max output tokens can reserve at most this share of the context window for the answer, the prompt always keeps the
+# rest. Otherwise a max tokens setting as big as the context window would leave no room for the prompt at all.
+MAX_OUTPUT_SHARE = 0.5
+
+# Chat memory. "summary" keeps the last SUMMARY_MEMORY_RECENT_TURNS turns word for word and folds older turns into a
+# rolling summary in the background, so the history sent with each question stays within a fixed token budget per model.
+# "buffer" sends as much of the raw history as fits in the models context.
+CHAT_MEMORY_MODE = os.getenv("CHAT_MEMORY_MODE", "summary")
+SUMMARY_MEMORY_RECENT_TURNS = 4
+SUMMARY_MEMORY_TOKEN_LIMIT = int(os.getenv("SUMMARY_MEMORY_TOKEN_LIMIT", "4000"))
+SUMMARY_MEMORY_MODEL_LIMITS = {
+    "gemma2:latest": 2000,
+    "google/gemma-2-9b-it": 2000,
+    "codegemma:latest": 2000,
+    "google/codegemma-7b": 2000,
+}
+# Long messages (like big code answers) are cut to this many characters before they are summarized
+SUMMARY_MESSAGE_MAX_CHARS = 4000
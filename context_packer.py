@@ -0,0 +1,74 @@
+import hashlib
+from typing import Any, Optional
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utils import get_tokenizer
+from config import CONTEXT_MEMORY_SHARE
+
+
+"""
+Returns a function that turns text into tokens with the active models tokenizer where one is available locally:
+the HuggingFace models own tokenizer and tiktoken for OpenAI models. Other providers don't ship their tokenizers, so
+they are counted with the default tiktoken tokenizer, which is close enough to budget with.
+"""
+def model_tokenizer(llm):
+    tokenizer = getattr(llm, "_tokenizer", None)
+    if tokenizer is not None:
+        return lambda text: tokenizer.encode(text, add_special_tokens=False)
+    if type(llm).__name__ == "OpenAI":
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(llm.model).encode
+        except KeyError:
+            pass
+    return get_tokenizer()
+
+
+"""
+Node postprocessor that packs retrieved chunks into the part of the prompt token budget that is left for context. The
+system prompt and context template are reserved up front, the chat history can use up to a share of the rest (the chat
+engine caps the memory at history_limit) and the current query is counted as it comes in. Chunks are then added highest
+score first, skipping duplicates and chunks that don't fit, so the prompt never overflows small context models and large
+ones only get as much context as was retrieved.
+"""
+class ContextPacker(BaseNodePostprocessor):
+    tokenizer_fn: Any
+    prompt_budget: int
+    reserved_tokens: int = 0
+    memory: Optional[Any] = None
+    memory_share: float = CONTEXT_MEMORY_SHARE
+
+    @classmethod
+    def class_name(cls):
+        return "ContextPacker"
+
+    def _count(self, text):
+        return len(self.tokenizer_fn(text))
+
+    # Most tokens the chat history may take, the memory's token limit is capped at this
+    def history_limit(self):
+        return int(max(0, self.prompt_budget - self.reserved_tokens) * self.memory_share)
+
+    # Tokens for context once the system prompt, the chat history and the query are reserved. Nodes are packed before
+    # the query is added to the memory, so the history counted here is exactly what gets sent along with them.
+    def context_budget(self, query=""):
+        available = self.prompt_budget - self.reserved_tokens - self._count(query)
+        if self.memory is not None:
+            available -= self._count(" ".join(str(m.content or "") for m in self.memory.get()))
+        return max(0, available)
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        remaining = self.context_budget(query_bundle.query_str if query_bundle is not None else "")
+        packed, seen = [], set()
+        for node in sorted(nodes, key=lambda n: n.score if n.score is not None else float("-inf"), reverse=True):
+            text = node.node.get_content(metadata_mode=MetadataMode.LLM).strip()
+            key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            if node.node.node_id in seen or key in seen:
+                continue
+            seen.update((node.node.node_id, key))
+            # Chunks are joined with a blank line, which costs a token or two
+            tokens = self._count(text) + 2
+            if tokens <= remaining:
+                packed.append(node)
+                remaining -= tokens
+        return packed
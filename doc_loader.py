@@ -0,0 +1,77 @@
+"""
+Lightweight document loading module. It is kept separate from chat_utils on purpose: worker processes only import this
+file, so they never load the embedding model, the LLM integrations or the Gradio app.
+"""
+import atexit, contextlib, glob, multiprocessing, os, sys, types
+from llama_index.core import SimpleDirectoryReader
+from config import INGEST_WORKERS, INGEST_POOL_MIN_FILES
+
+DIRECTORY_PATH = "data"
+LLAMA_PARSE_EXTENSIONS = [".pdf", ".docx", ".xlsx", ".csv", ".xml", ".html"]
+_parse_pool = None
+
+
+# Lists every file in the local data directory
+def list_local_files(directory=DIRECTORY_PATH):
+    all_files = glob.glob(os.path.join(directory, "**", "*"), recursive=True)
+    return sorted(f for f in all_files if os.path.isfile(f))
+
+
+# Loads a single local file, using Llama Parse for advanced file types if the user has an API key
+def load_local_file(file, parser=None):
+    file_extension = os.path.splitext(file)[1].lower()
+    if "LLAMA_CLOUD_API_KEY" in os.environ and file_extension in LLAMA_PARSE_EXTENSIONS:
+        if parser is None:
+            from llama_parse import LlamaParse
+            parser = LlamaParse(api_key=os.getenv("LLAMA_CLOUD_API_KEY"))
+        file_extractor = {file_extension: parser}
+        return SimpleDirectoryReader(input_files=[file], file_extractor=file_extractor,
+                                     filename_as_id=True).load_data()
+    return SimpleDirectoryReader(input_files=[file], filename_as_id=True).load_data()
+
+
+# Worker entry point. Returns the file with its documents so results can be matched up when they finish out of order.
+def _load_file_worker(file):
+    return file, load_local_file(file)
+
+
+"""
+Spawned processes normally re-import the parents __main__ module. For us that is app.py or chatrag.py, which launch the
+Gradio demo at import time and made the app reload in a loop. Hiding __main__ while the workers start means they only
+import this module.
+"""
+@contextlib.contextmanager
+def _hidden_main():
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main_module
+
+
+"""
+Starts the pool of worker processes that parses local files and keeps it for the life of the app. Call it from the main
+thread at startup, before the app starts any other threads, since __main__ is swapped out for the whole process while
+the workers spawn. Without a pool every file is parsed in process.
+"""
+def start_parse_pool(workers=INGEST_WORKERS):
+    global _parse_pool
+    if _parse_pool is None and workers > 1:
+        with _hidden_main():
+            _parse_pool = multiprocessing.get_context("spawn").Pool(workers)
+        atexit.register(_parse_pool.terminate)
+    return _parse_pool
+
+
+"""
+Parses the files across the worker pool and yields (file, documents) as each one finishes, so the indexer can start on
+the first files while the rest are still being parsed. Batches smaller than min_files are loaded in process since
+handing them to the pool would cost more than it saves.
+"""
+def iter_parsed_files(files, min_files=INGEST_POOL_MIN_FILES):
+    if _parse_pool is None or len(files) < min_files:
+        for file in files:
+            yield _load_file_worker(file)
+        return
+    yield from _parse_pool.imap_unordered(_load_file_worker, files)
@@ -0,0 +1,88 @@
+import hashlib, json, os
+from dataclasses import dataclass, field
+
+# Hashes a file in chunks so large PDFs don't have to be read into memory all at once
+def hash_file(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# Result of comparing the files on disk against the manifest
+@dataclass
+class ManifestChanges:
+    added: list = field(default_factory=list)
+    modified: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.modified or self.removed)
+
+
+"""
+Keeps track of every local file that has been loaded into the index, with its mtime, size, content hash and the ids of
+the documents it produced. Comparing it against the data directory tells us which files need to be parsed again and
+which documents need to be removed from the index, so uploads only cost as much as the files that changed.
+"""
+class DocumentManifest:
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        # Anything else the index was built from, like the GitHub repository and embedding model
+        self.meta = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.entries, self.meta = saved["files"], saved["meta"]
+
+    # True if the manifest was loaded from (or already saved to) disk
+    def exists(self):
+        return bool(self.path) and os.path.exists(self.path)
+
+    # Compares the given files against the manifest. Files are only hashed when their mtime or size changed.
+    def diff(self, files):
+        changes = ManifestChanges()
+        for file in files:
+            entry = self.entries.get(file)
+            if entry is None:
+                changes.added.append(file)
+                continue
+            stat = os.stat(file)
+            if stat.st_mtime == entry["mtime"] and stat.st_size == entry["size"]:
+                continue
+            if hash_file(file) != entry["sha256"]:
+                changes.modified.append(file)
+            else:
+                # File was touched but the contents are the same so just remember the new mtime
+                entry["mtime"] = stat.st_mtime
+        current = set(files)
+        changes.removed = [file for file in self.entries if file not in current]
+        return changes
+
+    # Records a file and the ids of the documents it was parsed into
+    def record(self, file, doc_ids):
+        stat = os.stat(file)
+        self.entries[file] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": hash_file(file),
+                              "doc_ids": list(doc_ids)}
+
+    def doc_ids(self, file):
+        return self.entries.get(file, {}).get("doc_ids", [])
+
+    def forget(self, file):
+        self.entries.pop(file, None)
+
+    def clear(self):
+        self.entries = {}
+        self.meta = {}
+
+    # Writes the manifest to disk if it was given a path
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"files": self.entries, "meta": self.meta}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,184 @@
+import asyncio, hashlib, os, sqlite3, threading, time
+import numpy as np
+from collections import OrderedDict
+from typing import List
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from config import EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES, QUERY_EMBED_CACHE_MAX_ENTRIES
+
+"""
+On disk embedding cache. Vectors live in a memory mapped float32 file and a small SQLite table maps the hash of
+(embedding model name, chunk text) to a row in that file. Chunks that were embedded before are read straight back
+from disk across restarts and engine resets. When the cache is full the least recently used rows get reused.
+"""
+class EmbeddingCache:
+    def __init__(self, model_name, cache_dir=EMBED_CACHE_PATH, max_entries=EMBED_CACHE_MAX_ENTRIES):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._dim = None
+        model_dir = os.path.join(cache_dir, hashlib.sha256(model_name.encode()).hexdigest()[:16])
+        os.makedirs(model_dir, exist_ok=True)
+        self._vector_path = os.path.join(model_dir, "vectors.f32")
+        self._db = sqlite3.connect(os.path.join(model_dir, "index.sqlite"), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries "
+                         "(key TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._db.commit()
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        if row is not None:
+            self._open_vectors(int(row[0]))
+
+    # Hashes the chunk text together with the model name so different models never share vectors
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    # Opens (or creates) the memory mapped vector file once the embedding dimension is known
+    def _open_vectors(self, dim):
+        mode = "r+" if os.path.exists(self._vector_path) else "w+"
+        self._vectors = np.memmap(self._vector_path, dtype=np.float32, mode=mode, shape=(self.max_entries, dim))
+        self._dim = dim
+
+    # Returns the cached embeddings for each text, or None where the text hasn't been embedded yet
+    def get_many(self, texts):
+        keys = [self._key(t) for t in texts]
+        results = [None] * len(texts)
+        with self._lock:
+            if self._vectors is None:
+                self.misses += len(texts)
+                return results
+            found = {}
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._db.execute(f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})",
+                                        batch).fetchall()
+                found.update(rows)
+            for i, key in enumerate(keys):
+                slot = found.get(key)
+                if slot is not None:
+                    results[i] = self._vectors[slot].tolist()
+            now = time.time()
+            self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+            self._db.commit()
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return results
+
+    # Stores new embeddings, evicting the least recently used rows if the cache is full
+    def put_many(self, texts, embeddings):
+        if not texts:
+            return
+        with self._lock:
+            if self._vectors is None:
+                dim = len(embeddings[0])
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dim', ?)", (str(dim),))
+                self._open_vectors(dim)
+            now = time.time()
+            for text, embedding in zip(texts, embeddings):
+                key = self._key(text)
+                row = self._db.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    slot = row[0]
+                else:
+                    slot = self._free_slot()
+                self._vectors[slot] = np.asarray(embedding, dtype=np.float32)
+                self._db.execute("INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                                 (key, slot, now))
+            self._vectors.flush()
+            self._db.commit()
+
+    # Slots 0..count-1 are always in use, so the next free one is the row count until the cache fills up
+    def _free_slot(self):
+        count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count < self.max_entries:
+            return count
+        key, slot = self._db.execute("SELECT key, slot FROM entries ORDER BY last_used LIMIT 1").fetchone()
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        return slot
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    # Hit and miss counters so users can see how much embedding work the cache is saving
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self),
+                "hit_rate": self.hits / total if total else 0.0}
+
+
+"""
+Embedding model wrapper that checks the embedding cache before sending document chunks to the real embedding model.
+Query embeddings use a different prompt than document embeddings, so they only go in a small in memory LRU.
+"""
+class CachedEmbedding(BaseEmbedding):
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+    _query_cache: OrderedDict = PrivateAttr()
+    _query_lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, embed_model, cache=None, **kwargs):
+        super().__init__(model_name=embed_model.model_name, embed_batch_size=embed_model.embed_batch_size, **kwargs)
+        self._embed_model = embed_model
+        self._cache = cache if cache is not None else EmbeddingCache(embed_model.model_name)
+        self._query_cache = OrderedDict()
+        self._query_lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls):
+        return "CachedEmbedding"
+
+    @property
+    def cache(self):
+        return self._cache
+
+    # Recent query embeddings are kept in a small in memory LRU so repeated questions aren't embedded again
+    def _cached_query_embedding(self, query):
+        with self._query_lock:
+            embedding = self._query_cache.get(query)
+            if embedding is not None:
+                self._query_cache.move_to_end(query)
+            return embedding
+
+    def _store_query_embedding(self, query, embedding):
+        with self._query_lock:
+            self._query_cache[query] = embedding
+            while len(self._query_cache) > QUERY_EMBED_CACHE_MAX_ENTRIES:
+                self._query_cache.popitem(last=False)
+
+    def _get_query_embedding(self, query):
+        embedding = self._cached_query_embedding(query)
+        if embedding is None:
+            embedding = self._embed_model.get_query_embedding(query)
+            self._store_query_embedding(query, embedding)
+        return embedding
+
+    # The local embedding model runs on the calling thread even through its async methods, so misses are embedded in a
+    # worker thread instead of stalling every other chat on the event loop
+    async def _aget_query_embedding(self, query):
+        embedding = self._cached_query_embedding(query)
+        if embedding is None:
+            embedding = await asyncio.to_thread(self._embed_model.get_query_embedding, query)
+            self._store_query_embedding(query, embedding)
+        return embedding
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text):
+        return await asyncio.to_thread(self._get_text_embedding, text)
+
+    # Only the chunks that missed the cache get embedded, then they are written back to the cache
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self._cache.get_many(texts)
+        missing = [i for i, e in enumerate(embeddings) if e is None]
+        if missing:
+            new_embeddings = self._embed_model.get_text_embedding_batch([texts[i] for i in missing])
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+            self._cache.put_many([texts[i] for i in missing], new_embeddings)
+        return embeddings
@@ -0,0 +1,78 @@
+import contextlib, os, subprocess, threading
+from github_sync import filter_repo_files, repo_document
+
+# Symlinks and submodules show up in the tree but have no file contents to index
+SYMLINK_MODE = "120000"
+
+
+"""
+Ingestion source for a git repository that is already on disk, either a working tree or a bare repository, so it works
+offline and for internal repositories. Files are read from the object database at a commit rather than the working
+tree: `git ls-tree` lists them with their blob SHAs and a single `git cat-file --batch` process streams their contents,
+which is much faster than one request per file. It has the same interface as GitHubRepoSync so both sync the same way.
+"""
+class LocalGitRepo:
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.name = self.path
+
+    def _git(self, *args):
+        result = subprocess.run(["git", "-C", self.path, *args], capture_output=True, check=True)
+        return result.stdout
+
+    # Commit SHA the branch, tag or commit points to. Raises CalledProcessError if the path isn't a git repository or
+    # the ref doesn't exist.
+    def head(self, ref):
+        return self._git("rev-parse", "--verify", f"{ref}^{{commit}}").decode().strip()
+
+    # {path: blob sha} for the commit, without the excluded file types
+    def tree(self, commit):
+        files = {}
+        for entry in self._git("ls-tree", "-r", "-z", "--full-tree", commit).split(b"\0"):
+            if not entry:
+                continue
+            info, path = entry.split(b"\t", 1)
+            mode, object_type, sha = info.decode().split()
+            if object_type == "blob" and mode != SYMLINK_MODE:
+                files[path.decode("utf-8", errors="surrogateescape")] = sha
+        return filter_repo_files(files)
+
+    # Streams the contents of each blob, in order, through one `git cat-file --batch` process. Missing blobs give None.
+    def read_blobs(self, shas):
+        process = subprocess.Popen(["git", "-C", self.path, "cat-file", "--batch"],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        # Requests are written from a thread so a full stdout pipe can never block the writer and the reader together
+        def write_requests():
+            try:
+                for sha in shas:
+                    process.stdin.write(f"{sha}\n".encode())
+            except BrokenPipeError:
+                # The reader stopped early and closed its end
+                pass
+            finally:
+                with contextlib.suppress(BrokenPipeError):
+                    process.stdin.close()
+        writer = threading.Thread(target=write_requests, daemon=True)
+        writer.start()
+        try:
+            for sha in shas:
+                header = process.stdout.readline().split()
+                if len(header) < 3 or header[1] == b"missing":
+                    yield None
+                    continue
+                content = process.stdout.read(int(header[2]))
+                process.stdout.read(1)
+                yield content
+        finally:
+            process.stdout.close()
+            writer.join()
+            process.wait()
+
+    # Documents for the given {path: blob sha} files
+    def documents(self, ref, files):
+        paths = sorted(files)
+        for path, content in zip(paths, self.read_blobs([files[p] for p in paths])):
+            document = repo_document(self.name, path, content, repository=self.path, ref=ref) if content is not None else None
+            if document is not None:
+                yield document
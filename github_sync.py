@@ -0,0 +1,166 @@
+import base64, json, os
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from llama_index.core import Document
+from http_pool import HTTP_CLIENT_POOL
+from config import GITHUB_API_URL, GITHUB_CACHE_PATH, GITHUB_FETCH_WORKERS, GITHUB_EXCLUDED_EXTENSIONS
+
+
+"""
+Minimal GitHub REST API client covering the three calls a sync needs: the head commit of a branch, the recursive file
+tree of a commit and the contents of a blob. Pass in a base_url and an httpx client with a mock transport to run syncs
+against a fake API.
+"""
+class GitHubAPI:
+    def __init__(self, token=None, base_url=GITHUB_API_URL, client=None):
+        self.base_url = base_url.rstrip("/")
+        self.client = client or HTTP_CLIENT_POOL.http_client("GitHub")
+        self.headers = {"Accept": "application/vnd.github+json"}
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+
+    def _get(self, path, **params):
+        response = self.client.get(f"{self.base_url}{path}", headers=self.headers, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def branch_head(self, owner, repo, branch):
+        return self._get(f"/repos/{owner}/{repo}/branches/{branch}")["commit"]["sha"]
+
+    """
+    Returns {path: blob sha} for every file in the commit. The recursive tree is truncated for very large repositories,
+    and syncing a partial tree would delete the missing files from the index, so the tree is then walked one directory
+    at a time instead.
+    """
+    def tree(self, owner, repo, commit):
+        tree = self._get(f"/repos/{owner}/{repo}/git/trees/{commit}", recursive=1)
+        if tree.get("truncated"):
+            print(f"The file tree of {owner}/{repo} at {commit} was truncated by the GitHub API, "
+                  f"walking it one directory at a time.")
+            return self._walk_tree(owner, repo, commit)
+        return {entry["path"]: entry["sha"] for entry in tree["tree"] if entry["type"] == "blob"}
+
+    def _walk_tree(self, owner, repo, sha, prefix=""):
+        tree = self._get(f"/repos/{owner}/{repo}/git/trees/{sha}")
+        if tree.get("truncated"):
+            raise ValueError(f"The directory {prefix or '/'} of {owner}/{repo} has too many entries for the GitHub API "
+                             f"to list, so it can't be synced.")
+        files = {}
+        for entry in tree["tree"]:
+            path = prefix + entry["path"]
+            if entry["type"] == "blob":
+                files[path] = entry["sha"]
+            elif entry["type"] == "tree":
+                files.update(self._walk_tree(owner, repo, entry["sha"], path + "/"))
+        return files
+
+    def blob(self, owner, repo, sha):
+        return base64.b64decode(self._get(f"/repos/{owner}/{repo}/git/blobs/{sha}")["content"])
+
+
+# Drops the file types the reader can't use, like images
+def filter_repo_files(files, excluded_extensions=GITHUB_EXCLUDED_EXTENSIONS):
+    return {path: sha for path, sha in files.items() if os.path.splitext(path)[1].lower() not in excluded_extensions}
+
+
+# Documents from the same repository path always get the same id, so a changed file replaces the old document
+def repo_doc_id(repo_name, path):
+    return f"{repo_name}/{path}"
+
+
+# Builds the document for a repository file, or returns None for binary files that aren't utf-8 text
+def repo_document(repo_name, path, content, **metadata):
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    return Document(text=text, id_=repo_doc_id(repo_name, path),
+                    metadata={"file_path": path, "file_name": os.path.basename(path), **metadata})
+
+
+"""
+Local cache of a GitHub repository keyed by owner/repo/branch and commit. Blobs are stored by their SHA and trees by the
+commit SHA, and both are immutable, so anything fetched once is never downloaded again. The last head seen for each
+branch is kept too, so a repository that was synced before can still be loaded while offline.
+"""
+class GitHubRepoSync:
+    def __init__(self, api, owner, repo, cache_dir=GITHUB_CACHE_PATH, workers=GITHUB_FETCH_WORKERS):
+        self.api = api
+        self.owner = owner
+        self.repo = repo
+        self.name = f"{owner}/{repo}"
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self._repo_dir = os.path.join(cache_dir, "repos", owner, repo)
+
+    def _blob_path(self, sha):
+        return os.path.join(self.cache_dir, "blobs", sha[:2], sha)
+
+    @staticmethod
+    def _write(path, data, mode="wb"):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    # Head commit of the branch from the API, falling back to the last one seen if the API can't be reached
+    def head(self, branch):
+        heads_path = os.path.join(self._repo_dir, "heads.json")
+        heads = {}
+        if os.path.exists(heads_path):
+            with open(heads_path) as f:
+                heads = json.load(f)
+        try:
+            commit = self.api.branch_head(self.owner, self.repo, branch)
+        except httpx.HTTPError as e:
+            if branch not in heads:
+                raise
+            print(f"Couldn't reach GitHub ({e}), using the cached {self.name}/{branch} at {heads[branch]}.")
+            return heads[branch]
+        if heads.get(branch) != commit:
+            heads[branch] = commit
+            self._write(heads_path, json.dumps(heads), "w")
+        return commit
+
+    # {path: blob sha} for the commit, without the excluded file types
+    def tree(self, commit):
+        tree_path = os.path.join(self._repo_dir, "trees", f"{commit}.json")
+        if os.path.exists(tree_path):
+            with open(tree_path) as f:
+                return json.load(f)
+        files = filter_repo_files(self.api.tree(self.owner, self.repo, commit))
+        self._write(tree_path, json.dumps(files), "w")
+        return files
+
+    def _fetch_blob(self, sha):
+        self._write(self._blob_path(sha), self.api.blob(self.owner, self.repo, sha))
+
+    # Downloads the blobs that aren't cached yet, several at a time over the pooled keep alive connections
+    def fetch_blobs(self, shas):
+        missing = sorted({sha for sha in shas if not os.path.exists(self._blob_path(sha))})
+        if not missing:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self._fetch_blob, missing))
+        return len(missing)
+
+    # Documents for the given {path: blob sha} files. Everything not cached yet is fetched up front.
+    def documents(self, branch, files):
+        fetched = self.fetch_blobs(files.values())
+        print(f"Fetched {fetched} of {len(files)} changed files from {self.name}/{branch}, the rest were cached.")
+        for path, sha in sorted(files.items()):
+            with open(self._blob_path(sha), "rb") as f:
+                document = repo_document(self.name, path, f.read(),
+                                         url=f"https://github.com/{self.name}/blob/{branch}/{path}")
+            if document is not None:
+                yield document
+
+
+# Repository sync for the token in the environment, or None if there isn't one
+def github_repo_sync(owner, repo):
+    if "GITHUB_PAT" not in os.environ:
+        print("Couldn't find your GitHub Personal Access Token in the environment file. Make sure you enter your "
+              "GitHub Personal Access Token in the .env file.")
+        return None
+    return GitHubRepoSync(GitHubAPI(token=os.getenv("GITHUB_PAT")), owner, repo)
@@ -1,43 +1,78 @@
-import os, shutil
+import os, shutil, time
 import gradio as gr
-from model_utils import ModelManager, ModelParamUpdates
+from model_utils import ModelManager
+from config import STREAM_FLUSH_INTERVAL, STREAM_FLUSH_CHARS
+
+
+"""
+Groups streamed tokens into flush windows. Tokens are buffered in a list (constant cost per token) and joined into one
+chunk once the flush interval has passed or enough characters have built up, so the UI is updated a bounded number of
+times per second instead of once per token.
+"""
+async def coalesce_tokens(token_gen, interval=STREAM_FLUSH_INTERVAL, max_chars=STREAM_FLUSH_CHARS):
+    buffer, buffered_chars = [], 0
+    last_flush = time.monotonic()
+    async for token in token_gen:
+        buffer.append(token)
+        buffered_chars += len(token)
+        now = time.monotonic()
+        if now - last_flush >= interval or buffered_chars >= max_chars:
+            yield "".join(buffer)
+            buffer, buffered_chars = [], 0
+            last_flush = now
+    if buffer:
+        yield "".join(buffer)
 
 """
 Main gradio class that is the connector function between the front and backend. This function serves many purposes
 from updating model parameters and calling the appropriate function to handing the response streaming after calling the 
 process input function.
 This class also handles chat memory, deleting the knowledge base, and handing the document uploads from the main gradio 
-file asset.  
+file asset. Chat history and memory are kept per browser session so concurrent users don't see each other's chats.
 """
 class GradioUtils:
     def __init__(self):
         self.model_manager = ModelManager()
-        self.model_param_updater = ModelParamUpdates(self.model_manager)
-        self.chat_history = []
-
-    # This function gets the users query, send it to the chat engine to be processed and then streams the response back
-    def stream_response(self, message: str):
-        streaming_response = self.model_manager.process_input(message)
-        full_response = ""
-        for tokens in streaming_response.response_gen:
-            full_response += tokens
-            yield "", self.chat_history + [(message, full_response)]
-        self.chat_history.append((message, full_response))
-
-    # This function clears the chat history dictionary
-    def clear_chat_history(self):
-        self.chat_history.clear()
+        self.model_param_updater = self.model_manager.model_param_updates
+
+    # Gets the chat session for the browser session that sent the request
+    def get_session(self, request: gr.Request):
+        return self.model_manager.sessions.get(request.session_hash)
 
     """
-    This function clears the chat history and reset the chat engine to clear the model memory to give the user a 
-    fresh chat with no context
+    This function gets the users query, send it to the chat engine to be processed and then streams the response back.
+    The new message is added to the history once and only its response is updated in place, so nothing gets copied per
+    token and Gradio only has to send the new text of the last message to the browser. This runs on the event loop so
+    many chats can stream at once.
     """
-    def clear_his_and_mem(self):
-        self.clear_chat_history()
-        self.model_manager.reset_chat_engine()
+    async def stream_response(self, message: str, request: gr.Request):
+        session = self.get_session(request)
+        async with session.lock:
+            token_gen = await self.model_manager.aprocess_input(message, session)
+            entry = [message, ""]
+            session.chat_history.append(entry)
+            parts = []
+            async for chunk in coalesce_tokens(token_gen):
+                parts.append(chunk)
+                entry[1] = "".join(parts)
+                yield "", session.chat_history
+
+    # This function clears the sessions chat history
+    def clear_chat_history(self, request: gr.Request):
+        self.get_session(request).chat_history = []
 
     """
-    This function deletes the data file to remove the uploaded data and resets the chat engine to remove it from the
+    This function clears the sessions chat history and memory to give the user a fresh chat with no context
+    """
+    def clear_his_and_mem(self, request: gr.Request):
+        self.get_session(request).reset()
+
+    # Removes the sessions chat state when the user closes the tab
+    def end_session(self, request: gr.Request):
+        self.model_manager.sessions.remove(request.session_hash)
+
+    """
+    This function deletes the data file to remove the uploaded data and syncs the index to remove it from the
     models' context. It also sends the warning message to the front end to alert the user of the changes made.
     """
     def delete_db(self):
@@ -46,14 +81,14 @@ class GradioUtils:
         if os.path.exists("data"):
             shutil.rmtree("data")
             os.makedirs("data")
-        self.model_manager.reset_chat_engine()
+        self.model_manager.sync_local_data()
 
     """
-    This function clears the chat history, updates the model provider based off users selection and then sends a
-    #warning message about model loading and downloading wait times if the user requested to use a huggingface model.
+    This function updates the model provider based off users selection and then sends a warning message about model
+    loading and downloading wait times if the user requested to use a huggingface model. Sessions start a fresh chat
+    history the next time they send a message to the new model.
     """
     def update_model_provider(self, provider):
-        self.clear_chat_history()
         self.model_manager.update_model_provider(provider)
         if self.model_manager.provider == "HuggingFace":
             gr.Warning(
@@ -62,7 +97,6 @@ class GradioUtils:
 
     # This function sends the users model selection through to the model manager
     def update_model(self, display_name):
-        self.clear_chat_history()
         self.model_manager.update_model(display_name)
 
     # This function sends the users quantization selection through to the model parameter updater function
@@ -93,6 +127,10 @@ class GradioUtils:
     def set_github_info(self, owner, repo, branch):
         self.model_manager.set_github_info(owner, repo, branch)
 
+    # This function sends the users local git repository path and ref through to the model manager function
+    def set_local_repo(self, path, ref):
+        self.model_manager.set_local_repo(path, ref)
+
     """
     This function handles the document uploading and sending the user a message about what to do for the model 
     to see the files.
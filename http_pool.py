@@ -0,0 +1,125 @@
+import asyncio, threading, time
+import httpx
+from config import (HTTP_POOL_MAX_CONNECTIONS, HTTP_POOL_KEEPALIVE_CONNECTIONS, HTTP_POOL_KEEPALIVE_EXPIRY,
+                    HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT, HTTP_MAX_RETRIES, HTTP_RETRY_BACKOFF)
+
+"""
+Shared connection pools for the remote model providers. Every LLM instance for a provider reuses the same keep alive
+clients, so rebuilding the chat engine after a slider change doesn't throw away the open TCP/TLS connections and the
+first token of the next answer doesn't pay for a new handshake.
+"""
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# Seconds to wait before the given retry attempt, doubling each time
+def _backoff(attempt, backoff=HTTP_RETRY_BACKOFF):
+    return backoff * (2 ** attempt)
+
+
+"""
+Transport that retries connection errors and rate limit or server errors with exponential backoff. Responses are
+checked before the body is read, so streamed answers are only retried if the server refused them up front.
+"""
+class RetryTransport(httpx.BaseTransport):
+    def __init__(self, transport, max_retries=HTTP_MAX_RETRIES, backoff=HTTP_RETRY_BACKOFF):
+        self.transport = transport
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def handle_request(self, request):
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.transport.handle_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+                if last_attempt:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    return response
+                response.close()
+            time.sleep(_backoff(attempt, self.backoff))
+
+    def close(self):
+        self.transport.close()
+
+
+# Async version of RetryTransport for the async clients used by astream_chat
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport, max_retries=HTTP_MAX_RETRIES, backoff=HTTP_RETRY_BACKOFF):
+        self.transport = transport
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    async def handle_async_request(self, request):
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await self.transport.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+                if last_attempt:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(_backoff(attempt, self.backoff))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+# Connection pool size and keep alive settings. They live on the transport since that is what owns the connections.
+def pool_limits():
+    return httpx.Limits(max_connections=HTTP_POOL_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_POOL_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY)
+
+def pool_timeout(timeout=HTTP_TIMEOUT):
+    return httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT)
+
+# Sync transport with the pool limits and retries, also used by provider SDKs that build their own httpx client
+def retry_transport():
+    return RetryTransport(httpx.HTTPTransport(limits=pool_limits()))
+
+def async_retry_transport():
+    return AsyncRetryTransport(httpx.AsyncHTTPTransport(limits=pool_limits()))
+
+
+"""
+Registry of pooled clients, one set per provider. Clients are created the first time a provider is used and then kept
+for the life of the process. get_client can also cache provider SDK clients built on top of the pooled http clients.
+"""
+class HTTPClientPool:
+    def __init__(self):
+        self._clients = {}
+        # Reentrant so a factory can ask the pool for the http client it wraps
+        self._lock = threading.RLock()
+
+    # Returns the cached client for the key, building it with factory() the first time
+    def get_client(self, key, factory):
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = factory()
+            return self._clients[key]
+
+    # Pooled sync httpx client with keep alive and retries for a provider
+    def http_client(self, provider, timeout=HTTP_TIMEOUT):
+        return self.get_client(("http", provider, timeout), lambda: httpx.Client(
+            transport=retry_transport(), timeout=pool_timeout(timeout)))
+
+    # Pooled async httpx client with keep alive and retries for a provider
+    def async_http_client(self, provider, timeout=HTTP_TIMEOUT):
+        return self.get_client(("async_http", provider, timeout), lambda: httpx.AsyncClient(
+            transport=async_retry_transport(), timeout=pool_timeout(timeout)))
+
+    # Closes every sync client. Async clients are left to close with the event loop.
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                if hasattr(client, "close") and not asyncio.iscoroutinefunction(client.close):
+                    client.close()
+            self._clients.clear()
+
+
+HTTP_CLIENT_POOL = HTTPClientPool()
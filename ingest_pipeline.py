@@ -0,0 +1,111 @@
+import queue, threading
+from llama_index.core import Settings
+from llama_index.core.schema import MetadataMode
+from retrieval_cache import bump_index_version
+from bm25_index import sparse_index
+from code_parser import CodeNodeParser
+from config import EMBED_BATCH_SIZE, INGEST_QUEUE_SIZE
+
+_DONE = object()
+
+
+# Puts an item on a stage queue, giving up if the pipeline was stopped while the queue was full
+def _put(out_queue, item, stop):
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+"""
+Runs one pipeline stage in a thread, pushing whatever it produces onto a bounded queue. Errors are passed along. If the
+pipeline is stopped the stage quits and closes its generator, so whatever the generator holds is cleaned up by its own
+finally block.
+"""
+def _run_stage(produce, out_queue, stop):
+    def target():
+        items = produce()
+        try:
+            for item in items:
+                if not _put(out_queue, item, stop):
+                    return
+        except BaseException as e:
+            _put(out_queue, e, stop)
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+            _put(out_queue, _DONE, stop)
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+# Reads from a stage queue until the stage is done or the pipeline is stopped, re-raising any error the stage hit
+def _drain(in_queue, stop):
+    while not stop.is_set():
+        try:
+            item = in_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+"""
+Streams documents into an index in overlapped stages. Reading documents, splitting them into nodes and embedding the
+nodes each run on their own side of a bounded queue, so parsing keeps going while a batch is being embedded and only a
+few batches worth of documents and nodes are ever held in memory, no matter how big the knowledge base is.
+Returns the number of nodes inserted.
+"""
+def run_ingest_pipeline(documents, index, embed_model, node_parser=None, batch_size=EMBED_BATCH_SIZE,
+                        queue_size=INGEST_QUEUE_SIZE):
+    # Source files are split on function and class boundaries, everything else by the regular text node parser
+    node_parser = node_parser or CodeNodeParser(text_parser=Settings.node_parser)
+    doc_queue = queue.Queue(maxsize=queue_size)
+    node_queue = queue.Queue(maxsize=queue_size)
+
+    stop = threading.Event()
+
+    def split_docs():
+        for doc in _drain(doc_queue, stop):
+            yield from node_parser.get_nodes_from_documents([doc])
+
+    stages = [_run_stage(lambda: iter(documents), doc_queue, stop), _run_stage(split_docs, node_queue, stop)]
+
+    inserted = 0
+    batch = []
+    # If embedding or inserting fails the stages are stopped instead of being left blocked on full queues
+    try:
+        for node in _drain(node_queue, stop):
+            batch.append(node)
+            if len(batch) >= batch_size:
+                inserted += _embed_and_insert(batch, index, embed_model)
+                batch = []
+        if batch:
+            inserted += _embed_and_insert(batch, index, embed_model)
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
+    if inserted:
+        bump_index_version(index)
+    return inserted
+
+
+# Embeds a batch of nodes in one call to the embedding model and adds them to the index and its BM25 index
+def _embed_and_insert(nodes, index, embed_model):
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    for node, embedding in zip(nodes, embed_model.get_text_embedding_batch(texts)):
+        node.embedding = embedding
+    index.insert_nodes(nodes)
+    bm25 = sparse_index(index)
+    if bm25 is not None:
+        bm25.add_nodes(nodes)
+    return len(nodes)
@@ -0,0 +1,194 @@
+import asyncio, json, os, threading
+import numpy as np
+from typing import Any, List
+from llama_index.core.vector_stores.types import BasePydanticVectorStore, VectorStoreQuery, VectorStoreQueryResult
+from llama_index.core.bridge.pydantic import PrivateAttr
+from config import LOCAL_VECTOR_DTYPE, LOCAL_VECTOR_QUERY_CHUNK
+
+
+# Returns the indices of the k largest scores, sorted from highest to lowest
+def top_k_indices(scores, k):
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates])]
+
+
+"""
+Built in vector store for single machine setups that don't want to run Milvus, Neo4j or Chroma. Embeddings are kept
+normalized in a float32 (or float16) matrix backed by a memory mapped file, so loading it is just mapping the file, and
+queries are an exact cosine search done as batched matrix products with argpartition for the top k. Deleting a node
+moves the last row into its place so both appends and deletes are O(1) per node. Node text lives in the index docstore,
+which is persisted next to the vectors.
+"""
+class MemmapVectorStore(BasePydanticVectorStore):
+    stores_text: bool = False
+    persist_dir: str
+    dtype: str = LOCAL_VECTOR_DTYPE
+
+    _lock: Any = PrivateAttr()
+    _vectors: Any = PrivateAttr(default=None)
+    _dim: int = PrivateAttr(default=0)
+    _capacity: int = PrivateAttr(default=0)
+    _count: int = PrivateAttr(default=0)
+    _node_ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[str] = PrivateAttr(default_factory=list)
+    _rows: dict = PrivateAttr(default_factory=dict)
+    _ref_doc_nodes: dict = PrivateAttr(default_factory=dict)
+
+    def __init__(self, persist_dir, dtype=LOCAL_VECTOR_DTYPE, **kwargs):
+        super().__init__(persist_dir=persist_dir, dtype=dtype, **kwargs)
+        self._lock = threading.RLock()
+        os.makedirs(persist_dir, exist_ok=True)
+        self._load()
+
+    @classmethod
+    def class_name(cls):
+        return "MemmapVectorStore"
+
+    @property
+    def client(self):
+        return None
+
+    @property
+    def _vector_path(self):
+        return os.path.join(self.persist_dir, "vectors.bin")
+
+    @property
+    def _ids_path(self):
+        return os.path.join(self.persist_dir, "ids.json")
+
+    # Maps the saved vectors and reads the ids. Only the ids are actually read, the vectors are paged in on demand.
+    def _load(self):
+        if not os.path.exists(self._ids_path):
+            return
+        with open(self._ids_path) as f:
+            saved = json.load(f)
+        self._dim, self._capacity, self._count = saved["dim"], saved["capacity"], saved["count"]
+        self._node_ids, self._ref_doc_ids = saved["node_ids"], saved["ref_doc_ids"]
+        for row, (node_id, ref_doc_id) in enumerate(zip(self._node_ids, self._ref_doc_ids)):
+            self._rows[node_id] = row
+            self._ref_doc_nodes.setdefault(ref_doc_id, set()).add(node_id)
+        if self._capacity:
+            self._vectors = np.memmap(self._vector_path, dtype=self.dtype, mode="r+",
+                                      shape=(self._capacity, self._dim))
+
+    # Grows the backing file so it can hold `needed` more rows, doubling the capacity each time it runs out
+    def _ensure_capacity(self, needed, dim):
+        if self._vectors is None:
+            self._dim = dim
+            self._capacity = max(1024, needed)
+            self._vectors = np.memmap(self._vector_path, dtype=self.dtype, mode="w+",
+                                      shape=(self._capacity, self._dim))
+            return
+        if dim != self._dim:
+            raise ValueError(f"Embedding dimension {dim} doesn't match the local vector store dimension {self._dim}.")
+        if self._count + needed <= self._capacity:
+            return
+        self._vectors.flush()
+        self._vectors = None
+        self._capacity = max(self._capacity * 2, self._count + needed)
+        with open(self._vector_path, "r+b") as f:
+            f.truncate(self._capacity * self._dim * np.dtype(self.dtype).itemsize)
+        self._vectors = np.memmap(self._vector_path, dtype=self.dtype, mode="r+", shape=(self._capacity, self._dim))
+
+    # Appends the nodes embeddings as normalized rows
+    def add(self, nodes, **add_kwargs):
+        if not nodes:
+            return []
+        embeddings = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.where(norms == 0, 1.0, norms)
+        with self._lock:
+            self._ensure_capacity(len(nodes), embeddings.shape[1])
+            start = self._count
+            self._vectors[start:start + len(nodes)] = embeddings.astype(self.dtype)
+            for offset, node in enumerate(nodes):
+                ref_doc_id = node.ref_doc_id or node.node_id
+                self._rows[node.node_id] = start + offset
+                self._node_ids.append(node.node_id)
+                self._ref_doc_ids.append(ref_doc_id)
+                self._ref_doc_nodes.setdefault(ref_doc_id, set()).add(node.node_id)
+            self._count += len(nodes)
+        return [node.node_id for node in nodes]
+
+    # Deletes every node that came from the document
+    def delete(self, ref_doc_id, **delete_kwargs):
+        with self._lock:
+            for node_id in self._ref_doc_nodes.pop(ref_doc_id, set()):
+                self._remove_row(self._rows.pop(node_id))
+
+    # Moves the last row into the deleted rows place so the matrix stays dense
+    def _remove_row(self, row):
+        last = self._count - 1
+        if row != last:
+            self._vectors[row] = self._vectors[last]
+            self._node_ids[row] = self._node_ids[last]
+            self._ref_doc_ids[row] = self._ref_doc_ids[last]
+            self._rows[self._node_ids[row]] = row
+        self._node_ids.pop()
+        self._ref_doc_ids.pop()
+        self._count -= 1
+
+    # Rows a query has to score, None meaning every row. Restricting the query to node ids only scores those nodes.
+    def _candidate_rows(self, query, q):
+        if query.node_ids:
+            return np.array([self._rows[n] for n in query.node_ids if n in self._rows], dtype=np.int64)
+        return None
+
+    # Exact cosine top k over the rows, done in chunks so float16 storage and huge stores never need one big float32 copy
+    def _search(self, q, k, rows=None):
+        total = self._count if rows is None else len(rows)
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, total, LOCAL_VECTOR_QUERY_CHUNK):
+            end = min(start + LOCAL_VECTOR_QUERY_CHUNK, total)
+            if rows is None:
+                block_rows, block = np.arange(start, end), self._vectors[start:end]
+            else:
+                block_rows, block = rows[start:end], self._vectors[rows[start:end]]
+            scores = np.asarray(block, dtype=np.float32) @ q
+            top = top_k_indices(scores, k)
+            best_rows = np.concatenate([best_rows, block_rows[top]])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            keep = top_k_indices(best_scores, k)
+            best_rows, best_scores = best_rows[keep], best_scores[keep]
+        return best_rows, best_scores
+
+    def query(self, query: VectorStoreQuery, **kwargs):
+        if query.filters is not None:
+            raise ValueError("Metadata filters aren't supported by the local vector store.")
+        q = np.asarray(query.query_embedding, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        with self._lock:
+            if self._count == 0:
+                return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+            k = min(query.similarity_top_k, self._count)
+            best_rows, best_scores = self._search(q, k, self._candidate_rows(query, q))
+            ids = [self._node_ids[row] for row in best_rows]
+        return VectorStoreQueryResult(nodes=None, similarities=best_scores.tolist(), ids=ids)
+
+    # Scoring the matrix is CPU bound, so async queries run it in a worker thread rather than on the event loop
+    async def aquery(self, query: VectorStoreQuery, **kwargs):
+        return await asyncio.to_thread(self.query, query, **kwargs)
+
+    # Flushes the vectors and writes the ids. Called by StorageContext.persist, which passes its own path we don't need.
+    def persist(self, persist_path=None, fs=None):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            tmp_path = self._ids_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"dim": self._dim, "capacity": self._capacity, "count": self._count,
+                           "node_ids": self._node_ids, "ref_doc_ids": self._ref_doc_ids}, f)
+            os.replace(tmp_path, self._ids_path)
+
+    def __len__(self):
+        return self._count
+
+    # StorageContext.from_defaults checks `if vector_store`, so an empty store must still be truthy or it gets replaced
+    def __bool__(self):
+        return True
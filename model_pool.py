@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+from config import HF_POOL_MEMORY_BUDGET_GB
+
+
+"""
+Keeps loaded HuggingFace weights resident, keyed by (model name, quantization, context window). Generation settings like
+temperature, top p and max new tokens aren't part of the key, so changing them reuses the loaded model and switching
+back to a recently used model is instant. Least recently used models are dropped before a new one is loaded whenever
+the new one wouldn't fit in the memory budget next to them, so the old and new weights are never resident together
+unless the budget has room for both.
+"""
+class HFModelPool:
+    def __init__(self, memory_budget_gb=HF_POOL_MEMORY_BUDGET_GB):
+        self.memory_budget = int(memory_budget_gb * 1024 ** 3)
+        self._entries = OrderedDict()
+        # Footprint of every model loaded so far, used to estimate how much room a reload needs
+        self._sizes = {}
+        # Keys that are being loaded, so a second request for the same model waits for the first instead of loading it
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    """
+    Returns the (model, tokenizer) pair for the key, loading it with loader() if it isn't resident already. Loading a
+    model can take minutes, so it happens outside the lock and other models can still be fetched in the meantime.
+    """
+    def get(self, model_name, quantization, context_window, loader):
+        key = (model_name, quantization, context_window)
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key]["model"], self._entries[key]["tokenizer"]
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Event()
+                    evicted = self._evict(self._estimated_size(key))
+                    break
+            loading.wait()
+        try:
+            if evicted:
+                from utils import clear_gpu_memory
+                clear_gpu_memory()
+            model, tokenizer = loader()
+            size = _memory_footprint(model)
+            with self._lock:
+                self._entries[key] = {"model": model, "tokenizer": tokenizer, "bytes": size}
+                self._sizes[key] = size
+                # The estimate can be short the first time a model is loaded, so trim the rest back into the budget
+                trimmed = self._evict(0, keep=key)
+            if trimmed:
+                from utils import clear_gpu_memory
+                clear_gpu_memory()
+            return model, tokenizer
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+
+    # Room a model needs: its own size if it was loaded before, otherwise the size of the biggest model loaded so far
+    def _estimated_size(self, key):
+        return self._sizes.get(key, max(self._sizes.values(), default=0))
+
+    # Drops least recently used models until a model of the given size fits in the memory budget next to the rest
+    def _evict(self, needed, keep=None):
+        evicted = False
+        while self.memory_used() + needed > self.memory_budget:
+            oldest = next((k for k in self._entries if k != keep), None)
+            if oldest is None:
+                break
+            del self._entries[oldest]
+            evicted = True
+        return evicted
+
+    def memory_used(self):
+        return sum(entry["bytes"] for entry in self._entries.values())
+
+    def keys(self):
+        return list(self._entries)
+
+    # Removes every model from the pool, used when the user wants all of the memory back
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Size of the loaded weights in bytes, falling back to counting parameters for models without get_memory_footprint
+def _memory_footprint(model):
+    if hasattr(model, "get_memory_footprint"):
+        return model.get_memory_footprint()
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+HF_MODEL_POOL = HFModelPool()
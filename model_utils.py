@@ -1,14 +1,51 @@
-import torch, gc
+import asyncio, os, subprocess, threading
 import gradio as gr
-from chat_utils import create_chat_engine
+from llama_index.core.llms import ChatMessage
+from utils import clear_gpu_memory, memory_snapshot, prompt_token_budget
+from chat_utils import (create_index, create_llm, create_chat_engine, sync_local_docs, save_index, index_manifest,
+                        get_embed_model)
+from session_utils import SessionRegistry
+from response_cache import ResponseCache, ResponseCacheKey, normalize_query, history_hash, replay_answer
+from retrieval_cache import CachedRetriever
+from config import RESPONSE_CACHE_MODE, CONTEXT_CANDIDATES
+from doc_manifest import DocumentManifest
+from git_source import LocalGitRepo
+from summary_memory import SummaryChatMemory
 from config import HF_MODEL_LIST, OLLAMA_MODEL_LIST, NV_MODEL_LIST, OA_MODEL_LIST, ANTH_MODEL_LIST
 
 
-# TODO needs to be optimized doesnt fully do its job.
-# Clears gpu memory so a new model can be load.
-def reset_gpu_memory():
-    torch.cuda.empty_cache()
-    gc.collect()
+"""
+Clears gpu and process memory so a new model can be loaded and reports how much was actually released. This only helps
+once every reference to the old chat engine and model has been dropped, see ModelManager.teardown_chat_engine, so pass
+in the snapshot taken before they were dropped or the report misses what dropping them freed.
+"""
+def reset_gpu_memory(before=None):
+    before = before or memory_snapshot()
+    clear_gpu_memory()
+    after = memory_snapshot()
+    print(format_memory_report(before, after))
+    return before, after
+
+
+# Formats the before and after memory numbers in MB
+def format_memory_report(before, after):
+    def mb(value):
+        return value / 1024 ** 2
+    report = f"Memory reclaimed: RSS {mb(before['rss']):.0f} MB -> {mb(after['rss']):.0f} MB"
+    if before["cuda_reserved"] or after["cuda_reserved"]:
+        report += (f", CUDA allocated {mb(before['cuda_allocated']):.0f} MB -> {mb(after['cuda_allocated']):.0f} MB"
+                   f", CUDA reserved {mb(before['cuda_reserved']):.0f} MB -> {mb(after['cuda_reserved']):.0f} MB")
+    return report
+
+
+# Async generator that pulls each item of a blocking generator in a worker thread so it doesn't block the event loop
+async def iterate_in_thread(gen):
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next, gen, done)
+        if item is done:
+            return
+        yield item
 
 
 """
@@ -27,9 +64,24 @@ class ModelManager:
         self.branch = None
         self.repo = None
         self.owner = None
+        self.local_repo = None
+        self.local_ref = None
+        self.index = None
+        self.index_loaded = False
+        self.manifest = DocumentManifest()
+        self.llm = None
         self.chat_engine = None
+        self.engine_version = 0
+        self.sessions = SessionRegistry()
+        # Guards building, swapping and tearing down the shared index and engine. Chats build it from worker threads, so
+        # without it concurrent first messages or a chat during a reset would build the index twice.
+        self._engine_lock = threading.RLock()
+        self.response_cache = ResponseCache() if RESPONSE_CACHE_MODE in ("exact", "semantic") else None
         self.provider = "Ollama"
         self.selected_model = "codestral:latest"
+        # Providers whose LLM clients stream over the network natively with astream_chat. HuggingFace models generate
+        # locally, so they are streamed from a worker thread instead of blocking the event loop.
+        self.async_providers = {"Ollama", "NVIDIA NIM", "OpenAI", "Anthropic"}
         self.model_display_names = {
             "Ollama": OLLAMA_MODEL_LIST,
             "HuggingFace": HF_MODEL_LIST,
@@ -38,44 +90,127 @@ class ModelManager:
             "Anthropic": ANTH_MODEL_LIST
         }
 
-    # Creates the initial chat engine
-    def create_initial_chat_engine(self):
-        return create_chat_engine(self.provider, self.selected_model,
+    # Creates the vector index from the local documents, GitHub and local repository and database settings
+    def create_initial_index(self):
+        self.manifest = index_manifest(self.vector_store, self.collection_name)
+        return create_index(self.owner, self.repo, self.branch, self.vector_store, self.username,
+                            self.password, self.url, self.collection_name, self.manifest,
+                            self.local_repo, self.local_ref)
+
+    """
+    Creates the initial chat engine on top of the index, building the index first if it hasn't been loaded yet. The
+    LLM is kept on the class so every chat session can share it.
+    """
+    def create_initial_chat_engine(self, memory=None):
+        with self._engine_lock:
+            if not self.index_loaded:
+                self.index = self.create_initial_index()
+                self.index_loaded = True
+            self.llm = create_llm(self.provider, self.selected_model,
                                   self.model_param_updates.temperature,
                                   self.model_param_updates.max_tokens,
-                                  self.model_param_updates.custom_prompt,
                                   self.model_param_updates.top_p,
                                   self.model_param_updates.context_window,
-                                  self.model_param_updates.quantization,
-                                  self.owner, self.repo, self.branch, self.vector_store, self.username,
-                                  self.password, self.url, self.collection_name)
+                                  self.model_param_updates.quantization)
+            self.engine_version += 1
+            return create_chat_engine(self.index, self.llm, self.selected_model,
+                                      self.model_param_updates.custom_prompt, memory, self.prompt_budget())
 
-    # Processes the query from the user and sends it to the chat engine for processing
-    def process_input(self, message):
-        if self.chat_engine is None:
-            self.chat_engine = self.create_initial_chat_engine()
-        return self.chat_engine.stream_chat(message)
+    # Prompt tokens the selected model has left after max_tokens. HuggingFace models are also capped by the context
+    # window they were loaded with.
+    def prompt_budget(self):
+        params = self.model_param_updates
+        context_window = params.context_window if self.provider == "HuggingFace" else None
+        return prompt_token_budget(self.selected_model, params.max_tokens, context_window)
+
+    """
+    Returns the chat engine for a chat session. It shares the index and LLM with every other session but uses the
+    sessions own memory, and is only rebuilt when the shared engine changed since the session last used it.
+    """
+    def session_chat_engine(self, session):
+        with self._engine_lock:
+            if self.chat_engine is None:
+                self.chat_engine = self.create_initial_chat_engine()
+            session.sync_model(self.selected_model)
+            if session.chat_engine is None or session.engine_version != self.engine_version:
+                session.chat_engine = create_chat_engine(self.index, self.llm, self.selected_model,
+                                                         self.model_param_updates.custom_prompt, session.memory,
+                                                         self.prompt_budget())
+                session.engine_version = self.engine_version
+            return session.chat_engine
+
+    """
+    Processes the query from the user with the sessions chat engine and returns an async generator of response tokens.
+    Retrieval, embedding of the query and the LLM call all run on the event loop through astream_chat, so concurrent
+    chats with remote providers don't each need a thread. Building the engine the first time can load the index, so that
+    part runs in a thread.
+    """
+    async def aprocess_input(self, message, session):
+        chat_engine = await asyncio.to_thread(self.session_chat_engine, session)
+        if self.response_cache is None:
+            return await self.astream_chat(chat_engine, message)
+        cache_key = await self.response_cache_key(message, session)
+        answer = self.response_cache.lookup(cache_key)
+        if answer is not None:
+            # Keep the conversation going as if the model had answered
+            session.memory.put(ChatMessage(role="user", content=message))
+            session.memory.put(ChatMessage(role="assistant", content=answer))
+            return replay_answer(answer)
+        return self.response_cache.record(cache_key, await self.astream_chat(chat_engine, message))
+
+    # Starts streaming an answer from the chat engine and returns an async generator of its tokens
+    async def astream_chat(self, chat_engine, message):
+        if self.provider in self.async_providers:
+            streaming_response = await chat_engine.astream_chat(message)
+            return streaming_response.async_response_gen()
+        streaming_response = await asyncio.to_thread(chat_engine.stream_chat, message)
+        return iterate_in_thread(streaming_response.response_gen)
+
+    """
+    Builds the response cache key for a query: the normalized query, the ids of the nodes retrieval returns for it, the
+    model and generation parameters and the conversation so far. Semantic mode also embeds the query, which is skipped
+    when there is no index so chats without data still never load the embedding model.
+    """
+    async def response_cache_key(self, message, session):
+        node_ids, embedding = (), None
+        if self.index is not None:
+            nodes = await CachedRetriever(self.index, similarity_top_k=CONTEXT_CANDIDATES).aretrieve(message)
+            node_ids = tuple(sorted(node.node.node_id for node in nodes))
+            if self.response_cache.semantic:
+                embedding = await get_embed_model().aget_query_embedding(message)
+        params = self.model_param_updates
+        model = (self.provider, self.selected_model, params.temperature, params.top_p, params.max_tokens,
+                 params.context_window, params.quantization, params.custom_prompt)
+        return ResponseCacheKey(query=normalize_query(message), node_ids=node_ids, model=model,
+                                history=history_hash(session.memory.get_all()), embedding=embedding)
 
     # Updates the model provider and sends it to the chat engine based off the selection of the user
     def update_model_provider(self, provider):
-        reset_gpu_memory()
-        self.provider = provider
-        default_models = {
-            "Ollama": "codestral:latest",
-            "HuggingFace": "",
-            "NVIDIA NIM": "mistralai/codestral-22b-instruct-v0.1",
-            "OpenAI": "gpt-4o",
-            "Anthropic": "claude-3-5-sonnet-20240620"
-        }
-        self.selected_model = default_models.get(provider, "codestral:latest")
-        gr.Info(f"Model provider updated to {provider}.", duration=10)
-        self.reset_chat_engine()
+        # Picking the provider that is already in use shouldn't reset everyone's model
+        if provider == self.provider and self.chat_engine is not None:
+            return
+        with self._engine_lock:
+            # Leaving HuggingFace means none of the pooled local models are needed anymore
+            if self.provider == "HuggingFace" and provider != "HuggingFace":
+                from model_pool import HF_MODEL_POOL
+                self.teardown_chat_engine()
+                HF_MODEL_POOL.clear()
+            self.provider = provider
+            default_models = {
+                "Ollama": "codestral:latest",
+                "HuggingFace": "",
+                "NVIDIA NIM": "mistralai/codestral-22b-instruct-v0.1",
+                "OpenAI": "gpt-4o",
+                "Anthropic": "claude-3-5-sonnet-20240620"
+            }
+            self.selected_model = default_models.get(provider, "codestral:latest")
+            gr.Info(f"Model provider updated to {provider}.", duration=10)
+            self.update_chat_engine(keep_memory=False)
 
     # Updates the model and sends it to the chat engine based off the selection of the user
     def update_model(self, display_name):
-        reset_gpu_memory()
         self.selected_model = self.model_display_names[self.provider].get(display_name, self.selected_model)
-        self.reset_chat_engine()
+        self.update_chat_engine(keep_memory=False)
         gr.Info(f"Model updated to {display_name}.", duration=10)
 
     # Sets GitHub info to add its data to the context of the model
@@ -94,6 +229,32 @@ class ModelManager:
         self.reset_chat_engine()
         return self.owner, self.repo, self.branch
 
+    """
+    Sets a git repository on disk (working tree or bare) to add its files at the ref to the context of the model. The
+    path and ref are checked with git first, so a bad setting is never kept and the current index isn't dropped for it.
+    """
+    def set_local_repo(self, path, ref):
+        if path:
+            if not os.path.isdir(os.path.expanduser(path)):
+                gr.Warning(f"Couldn't find a repository at {path}.")
+                return
+            try:
+                LocalGitRepo(path).head(ref or "HEAD")
+            except (subprocess.CalledProcessError, OSError):
+                gr.Warning(f"{path} isn't a git repository or doesn't have {ref or 'HEAD'}.")
+                return
+        self.local_repo, self.local_ref = path, ref
+        if path:
+            gr.Info(f"Local repository set to {path} at {ref or 'HEAD'}.")
+        self.reset_chat_engine()
+
+    # Resets the local repository to remove its files from the context of the model
+    def reset_local_repo(self):
+        self.local_repo = self.local_ref = ""
+        self.reset_chat_engine()
+        gr.Info("Local repository cleared and its files removed from the models context!")
+        return self.local_repo, self.local_ref
+
     # Sets database parameters and adds it to the models context
     def setup_database(self, vector_store, username, password, url, collection_name):
         self.vector_store, self.username, self.password, self.url, self.collection_name = vector_store, username, password, url, collection_name
@@ -108,10 +269,58 @@ class ModelManager:
         gr.Info("Database connection removed.", duration=10)
         return self.username, self.password, self.url
 
-    # Resets chat engine so the new parameters and new data can be loaded or removed into or from  the model
+    # Resets chat engine so the new data can be loaded or removed into or from the model. This rebuilds the index.
     def reset_chat_engine(self):
-        reset_gpu_memory()
-        self.chat_engine = self.create_initial_chat_engine()
+        with self._engine_lock:
+            self.teardown_chat_engine(drop_index=True)
+            self.chat_engine = self.create_initial_chat_engine()
+
+    """
+    Drops every reference this class holds to the current chat engine, its model and optionally the index, then frees
+    and measures the memory. This has to happen before the next engine is built, otherwise the old and new models are
+    both resident at the same time.
+    """
+    def teardown_chat_engine(self, drop_index=False):
+        with self._engine_lock:
+            before = memory_snapshot()
+            # The shared engines memory can be carried over to the next engine, so it mustn't hold on to the old LLM
+            if self.chat_engine is not None and isinstance(self.chat_engine.memory, SummaryChatMemory):
+                self.chat_engine.memory.llm = None
+            self.chat_engine = self.llm = None
+            self.sessions.drop_engines()
+            if drop_index:
+                self.index = None
+                self.index_loaded = False
+            return reset_gpu_memory(before)
+
+    """
+    Syncs the local data directory into the existing index so only new, modified or deleted files cost anything. Falls
+    back to building the whole index if there isn't one yet.
+    """
+    def sync_local_data(self):
+        with self._engine_lock:
+            if self.index is None:
+                self.reset_chat_engine()
+                return
+            changes = sync_local_docs(self.index, self.manifest)
+            save_index(self.index, self.manifest)
+            gr.Info(f"Knowledge base updated: {len(changes.added)} added, {len(changes.modified)} modified and "
+                    f"{len(changes.removed)} removed files.", duration=10)
+
+    """
+    Swaps the model, its parameters or the system prompt on top of the existing index without re-reading or
+    re-embedding any data. The chat memory is carried over unless the model changed.
+    """
+    def update_chat_engine(self, keep_memory=True):
+        with self._engine_lock:
+            memory = self.chat_engine.memory if keep_memory and self.chat_engine is not None else None
+            self.teardown_chat_engine()
+            self.chat_engine = self.create_initial_chat_engine(memory)
+
+    # Clears the chat engines memory without rebuilding anything
+    def clear_chat_memory(self):
+        if self.chat_engine is not None:
+            self.chat_engine.reset()
 
 
 """
@@ -129,59 +338,53 @@ class ModelParamUpdates:
         self.quantization = "4 Bit"
         self.custom_prompt = None
 
-    # Updates model quantization and sends a message to the user about the change. Also reset the gpu memory.
+    # Updates model quantization and sends a message to the user about the change.
     def update_quant(self, quantization):
-        reset_gpu_memory()
         self.quantization = quantization
         gr.Info(f"Quantization updated to {quantization}.", duration=10)
-        self.model_manager.reset_chat_engine()
+        self.model_manager.update_chat_engine()
 
-    # Updates model temperature parameter, send user a message about the change, and resets gpu memory.
+    # Updates model temperature parameter, send user a message about the change.
     def update_model_temp(self, temperature):
-        reset_gpu_memory()
         self.temperature = temperature
         gr.Info(f"Model temperature updated to {temperature}.", duration=10)
         gr.Warning("Changing this value can affect the randomness "
                    "and diversity of generated responses. Use with caution!",
                    duration=10)
-        self.model_manager.reset_chat_engine()
+        self.model_manager.update_chat_engine()
 
-    # Updates model top p parameter, send user a message about the change, and resets gpu memory.
+    # Updates model top p parameter, send user a message about the change.
     def update_top_p(self, top_p):
-        reset_gpu_memory()
         self.top_p = top_p
         gr.Info(f"Top P updated to {top_p}.", duration=10)
         gr.Warning("Changing this value can affect the randomness "
                    "and diversity of generated responses. Use with caution!",
                    duration=10)
-        self.model_manager.reset_chat_engine()
+        self.model_manager.update_chat_engine()
 
-    # Updates model context window parameter, send user a message about the change, and resets gpu memory.
+    # Updates model context window parameter, send user a message about the change.
     def update_context_window(self, context_window):
-        reset_gpu_memory()
         self.context_window = context_window
         gr.Info(f"Context Window updated to {context_window}.", duration=10)
         gr.Warning("Changing this value can affect the amount of the context the model can see and use "
                    "to answer your question.",
                    duration=10)
-        self.model_manager.reset_chat_engine()
+        self.model_manager.update_chat_engine()
 
-    # Updates the max output tokens a model can respond with send user a message about the change, and resets gpu memory.
+    # Updates the max output tokens a model can respond with send user a message about the change.
     def update_max_tokens(self, max_tokens):
-        reset_gpu_memory()
         self.max_tokens = max_tokens
         gr.Info(f"Max Tokens set to {max_tokens}.", duration=10)
         gr.Warning("Please note that reducing the maximum number of tokens may"
                    " cause incomplete or unexpected responses from the model if a user's question requires more tokens"
                    " for an accurate answer.",
                    duration=10)
-        self.model_manager.reset_chat_engine()
+        self.model_manager.update_chat_engine()
 
-    # Updates the chat engines system prompt, send user a message about the change, and resets gpu memory.
+    # Updates the chat engines system prompt, send user a message about the change.
     def update_chat_prompt(self, custom_prompt):
-        reset_gpu_memory()
         self.custom_prompt = custom_prompt
         gr.Warning("Caution: Changing the chat prompt may significantly alter the model's responses and could "
                    "potentially cause misleading or incorrect information to be generated. Please ensure that "
                    "the modified prompt is appropriate for your intended use case.", duration=10)
-        self.model_manager.reset_chat_engine()
+        self.model_manager.update_chat_engine()
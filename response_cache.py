@@ -0,0 +1,131 @@
+import asyncio, hashlib, re, threading, time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import numpy as np
+from config import (RESPONSE_CACHE_MODE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES,
+                    RESPONSE_CACHE_SIMILARITY, RESPONSE_CACHE_REPLAY_CHARS)
+
+
+# Lower cases the query, collapses whitespace and drops trailing punctuation so trivial differences still match
+def normalize_query(query):
+    return re.sub(r"\s+", " ", query.strip().lower()).rstrip("?!. ")
+
+
+# Hashes the conversation so far so answers are only reused in the same conversational context
+def history_hash(messages):
+    sha = hashlib.sha256()
+    for message in messages:
+        sha.update(f"{message.role}:{message.content}\0".encode("utf-8"))
+    return sha.hexdigest()
+
+
+"""
+Everything an answer depends on. The bucket holds what has to match exactly (retrieved nodes, model, generation
+parameters and conversation), and the query is matched exactly or, in semantic mode, by embedding similarity.
+"""
+@dataclass
+class ResponseCacheKey:
+    query: str
+    node_ids: tuple
+    model: tuple
+    history: str
+    embedding: list = field(default=None, compare=False)
+
+    @property
+    def bucket(self):
+        return self.node_ids, self.model, self.history
+
+    @property
+    def exact(self):
+        return self.query, self.bucket
+
+
+"""
+Answer cache in front of the chat engine. Entries expire after the TTL and the least recently used ones are evicted once
+the cache is full. In "semantic" mode a query also matches a cached one in the same bucket when the cosine similarity
+of their embeddings is above the threshold, so near duplicate questions get the cached answer too.
+"""
+class ResponseCache:
+    def __init__(self, mode=RESPONSE_CACHE_MODE, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 similarity=RESPONSE_CACHE_SIMILARITY):
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def semantic(self):
+        return self.mode == "semantic"
+
+    # Returns the cached answer for the key or None
+    def lookup(self, key):
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key.exact)
+            if entry is None and self.semantic and key.embedding is not None:
+                entry = self._nearest(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry["key"].exact)
+            self.hits += 1
+            return entry["answer"]
+
+    # Finds the most similar cached query in the same bucket that clears the similarity threshold
+    def _nearest(self, key):
+        query = np.asarray(key.embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        best, best_score = None, self.similarity
+        for entry in self._entries.values():
+            if entry["embedding"] is None or entry["key"].bucket != key.bucket:
+                continue
+            score = float(np.dot(query, entry["embedding"]))
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    # Stores an answer, evicting the least recently used entries past the size limit
+    def store(self, key, answer):
+        embedding = None
+        if key.embedding is not None:
+            embedding = np.asarray(key.embedding, dtype=np.float32)
+            embedding /= np.linalg.norm(embedding) or 1.0
+        with self._lock:
+            self._entries[key.exact] = {"key": key, "answer": answer, "embedding": embedding,
+                                        "created": time.monotonic()}
+            self._entries.move_to_end(key.exact)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        for exact in [k for k, entry in self._entries.items() if entry["created"] < cutoff]:
+            del self._entries[exact]
+
+    # Wraps a token stream so the full answer gets cached once the stream finishes
+    async def record(self, key, token_gen):
+        parts = []
+        async for token in token_gen:
+            parts.append(token)
+            yield token
+        self.store(key, "".join(parts))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0}
+
+
+# Replays a cached answer as a stream so it goes through the same streaming path as a fresh answer
+async def replay_answer(answer, chunk_chars=RESPONSE_CACHE_REPLAY_CHARS):
+    for start in range(0, len(answer), chunk_chars):
+        yield answer[start:start + chunk_chars]
+        await asyncio.sleep(0)
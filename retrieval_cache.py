@@ -0,0 +1,94 @@
+import itertools, threading, weakref
+from collections import OrderedDict
+from llama_index.core.retrievers import BaseRetriever
+from bm25_index import build_retriever, aretrieve
+from config import RETRIEVAL_CACHE_MAX_ENTRIES
+
+# Every index gets a version number that is unique across the whole process, so a new index can never reuse old results
+_version_counter = itertools.count(1)
+_index_versions = weakref.WeakKeyDictionary()
+_version_lock = threading.Lock()
+
+
+def index_version(index):
+    with _version_lock:
+        if index not in _index_versions:
+            _index_versions[index] = next(_version_counter)
+        return _index_versions[index]
+
+
+# Called whenever documents are added to or removed from the index so cached retrieval results stop matching
+def bump_index_version(index):
+    with _version_lock:
+        _index_versions[index] = next(_version_counter)
+
+
+"""
+LRU cache of retrieval results keyed by (index version, query text, top k). Since the index version changes on every
+insert or delete, results are invalidated automatically when the knowledge base changes.
+"""
+class RetrievalCache:
+    def __init__(self, max_entries=RETRIEVAL_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            nodes = self._entries.get(key)
+            if nodes is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(nodes)
+
+    def put(self, key, nodes):
+        with self._lock:
+            self._entries[key] = list(nodes)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0}
+
+
+RETRIEVAL_CACHE = RetrievalCache()
+
+
+"""
+Retriever for the CONTEXT chat mode that checks the retrieval cache before embedding the query and searching the
+index (hybrid dense and BM25 search when the index has a BM25 index). Repeated queries against an unchanged index become
+a dictionary lookup.
+"""
+class CachedRetriever(BaseRetriever):
+    def __init__(self, index, similarity_top_k=2, cache=RETRIEVAL_CACHE, **kwargs):
+        super().__init__()
+        self._index = index
+        self._similarity_top_k = similarity_top_k
+        self._retriever = build_retriever(index, similarity_top_k=similarity_top_k, **kwargs)
+        self._cache = cache
+
+    def _key(self, query_bundle):
+        return index_version(self._index), query_bundle.query_str, self._similarity_top_k
+
+    def _retrieve(self, query_bundle):
+        key = self._key(query_bundle)
+        nodes = self._cache.get(key)
+        if nodes is None:
+            nodes = self._retriever.retrieve(query_bundle)
+            self._cache.put(key, nodes)
+        return nodes
+
+    async def _aretrieve(self, query_bundle):
+        key = self._key(query_bundle)
+        nodes = self._cache.get(key)
+        if nodes is None:
+            nodes = await aretrieve(self._retriever, self._index, query_bundle)
+            self._cache.put(key, nodes)
+        return nodes
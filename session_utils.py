@@ -0,0 +1,82 @@
+import asyncio, threading, time
+from utils import set_chat_memory
+from summary_memory import SummaryChatMemory
+from config import SESSION_IDLE_TIMEOUT
+
+
+"""
+Chat state for a single browser session. Each session gets its own memory, chat history and lightweight chat engine,
+while the index, embedding model and LLM client are shared read only by every session through the ModelManager.
+"""
+class ChatSession:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.chat_history = []
+        self.memory = None
+        self.model = None
+        self.chat_engine = None
+        self.engine_version = None
+        self.last_active = time.monotonic()
+        # Async lock so one session can't run two chats at once without blocking the event loop for everyone else
+        self.lock = asyncio.Lock()
+
+    # Starts a fresh memory and history when the selected model changed since this session last chatted
+    def sync_model(self, model):
+        if self.model != model:
+            self.model = model
+            self.memory = set_chat_memory(model)
+            self.chat_history = []
+            self.chat_engine = None
+
+    # Clears the chat history and the memory so the user gets a fresh chat
+    def reset(self):
+        self.chat_history = []
+        if self.memory is not None:
+            self.memory.reset()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+
+"""
+Session keyed registry of ChatSessions. Sessions that have been idle for longer than the timeout are evicted whenever
+the registry is used, so abandoned tabs don't hold on to their memory forever.
+"""
+class SessionRegistry:
+    def __init__(self, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    # Returns the session for the id, creating it if needed
+    def get(self, session_id):
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = ChatSession(session_id)
+            session.touch()
+            return session
+
+    def remove(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    """
+    Drops every sessions chat engine so none of them keep the old model alive. Memories and histories are kept, but a
+    summarizing memory lets go of the LLM it writes summaries with until the next engine hands it the new one.
+    """
+    def drop_engines(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.chat_engine = None
+                if isinstance(session.memory, SummaryChatMemory):
+                    session.memory.llm = None
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for session_id in [s_id for s_id, s in self._sessions.items() if now - s.last_active > self.idle_timeout]:
+            del self._sessions[session_id]
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,50 @@
+import re, subprocess, sys, time
+from collections import defaultdict
+
+"""
+Startup profiler used by `python app.py --profile-startup`. It imports the app backend in a fresh interpreter with
+`-X importtime` and reports how much of the import time each package is responsible for, so cold start regressions
+can be tracked. The Gradio layout itself isn't imported because chatrag.py launches the demo at import time.
+"""
+PROFILE_MODULES = ["gradio", "gradio_utils"]
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+# Groups a module under its top level package, keeping the integration name for llama_index packages
+def _module_group(module):
+    parts = module.split(".")
+    if parts[0] == "llama_index" and len(parts) > 2:
+        return ".".join(parts[:3])
+    return parts[0]
+
+
+# Parses the -X importtime output into the total self time in microseconds for each package
+def parse_import_times(output):
+    totals = defaultdict(int)
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            totals[_module_group(match.group(4))] += int(match.group(1))
+    return totals
+
+
+# Imports the app modules in a fresh interpreter and returns the wall time and the per package import times
+def profile_imports(modules=PROFILE_MODULES):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+                            capture_output=True, text=True)
+    wall_time = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {modules} failed:\n{result.stderr[-2000:]}")
+    return wall_time, parse_import_times(result.stderr)
+
+
+# Prints the import time breakdown, slowest packages first
+def profile_startup(top=25):
+    wall_time, totals = profile_imports()
+    total = sum(totals.values())
+    print(f"Startup import profile ({', '.join(PROFILE_MODULES)})")
+    print(f"Interpreter wall time: {wall_time:.2f}s, total import time: {total / 1e6:.2f}s\n")
+    print(f"{'package':<45}{'seconds':>10}{'share':>9}")
+    for group, micros in sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{group:<45}{micros / 1e6:>10.3f}{micros / total:>9.1%}")
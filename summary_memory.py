@@ -0,0 +1,127 @@
+import threading
+from typing import Any, Callable, Optional
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.memory.types import BaseMemory
+from llama_index.core.utils import get_tokenizer
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from config import SUMMARY_MEMORY_RECENT_TURNS, SUMMARY_MEMORY_TOKEN_LIMIT, SUMMARY_MESSAGE_MAX_CHARS
+
+SUMMARY_PROMPT = (
+    "Progressively summarize the conversation between a user and an AI coding assistant, adding the new lines onto the "
+    "previous summary and returning a new summary. Keep code identifiers, file names, decisions that were made and "
+    "open questions. Only return the summary.\n\n"
+    "Previous summary:\n{summary}\n\n"
+    "New lines of conversation:\n{lines}\n\n"
+    "New summary:"
+)
+SUMMARY_MESSAGE = "Summary of the earlier conversation:\n{summary}"
+
+
+"""
+Chat memory that keeps the last few turns word for word and folds older turns into a rolling summary. Summaries are
+written by the LLM in a background thread once a turn falls out of the recent window, so answering is never held up by
+them, and until a summary lands the turns it will replace are still sent as they are. What get returns (the summary and
+the recent turns) is trimmed to the token limit, so the prompt stops growing with the length of the session. The token
+limit only covers the history, the chat engine caps it at the history's share of the prompt budget.
+"""
+class SummaryChatMemory(BaseMemory):
+    token_limit: int = SUMMARY_MEMORY_TOKEN_LIMIT
+    recent_turns: int = SUMMARY_MEMORY_RECENT_TURNS
+    llm: Optional[Any] = None
+    tokenizer_fn: Callable = Field(default_factory=get_tokenizer, exclude=True)
+
+    _messages: list = PrivateAttr(default_factory=list)
+    _summary: str = PrivateAttr(default="")
+    _summarized_upto: int = PrivateAttr(default=0)
+    _summarizing: bool = PrivateAttr(default=False)
+    # Bumped whenever the history is replaced so summaries of the old history are thrown away
+    _generation: int = PrivateAttr(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+
+    @classmethod
+    def class_name(cls):
+        return "SummaryChatMemory"
+
+    @classmethod
+    def from_defaults(cls, chat_history=None, llm=None, token_limit=SUMMARY_MEMORY_TOKEN_LIMIT,
+                      recent_turns=SUMMARY_MEMORY_RECENT_TURNS):
+        memory = cls(token_limit=token_limit, recent_turns=recent_turns, llm=llm)
+        if chat_history:
+            memory.set(chat_history)
+        return memory
+
+    @property
+    def summary(self):
+        return self._summary
+
+    def _count(self, messages):
+        return len(self.tokenizer_fn(" ".join(str(m.content or "") for m in messages)))
+
+    # The summary followed by every turn it doesn't cover yet, trimmed from the oldest turn to fit the token limit
+    def get(self, input=None, **kwargs):
+        with self._lock:
+            summary, messages = self._summary, self._messages[self._summarized_upto:]
+        prefix = []
+        if summary:
+            prefix = [ChatMessage(role=MessageRole.SYSTEM, content=SUMMARY_MESSAGE.format(summary=summary))]
+        while len(messages) > 1 and self._count(prefix + messages) > self.token_limit:
+            messages = messages[1:]
+            # History should start with a user message rather than half of a turn
+            while len(messages) > 1 and messages[0].role != MessageRole.USER:
+                messages = messages[1:]
+        return prefix + messages
+
+    def get_all(self):
+        with self._lock:
+            return list(self._messages)
+
+    def put(self, message):
+        with self._lock:
+            self._messages.append(message)
+        self._maybe_summarize()
+
+    def set(self, messages):
+        with self._lock:
+            self._messages = list(messages)
+            self._summary = ""
+            self._summarized_upto = 0
+            self._generation += 1
+        self._maybe_summarize()
+
+    def reset(self):
+        self.set([])
+
+    # Index of the first message to keep word for word, or None if every unsummarized turn is still recent
+    def _fold_point(self):
+        user_turns = [i for i in range(self._summarized_upto, len(self._messages))
+                      if self._messages[i].role == MessageRole.USER]
+        if len(user_turns) <= self.recent_turns:
+            return None
+        return user_turns[-self.recent_turns] if self.recent_turns else len(self._messages)
+
+    # Starts a background summary of the turns that fell out of the recent window, unless one is already running
+    def _maybe_summarize(self):
+        with self._lock:
+            if self._summarizing or self.llm is None:
+                return
+            cutoff = self._fold_point()
+            if cutoff is None:
+                return
+            self._summarizing = True
+            args = (self.llm, self._summary, self._messages[self._summarized_upto:cutoff], cutoff, self._generation)
+        threading.Thread(target=self._summarize, args=args, name="chat-memory-summary", daemon=True).start()
+
+    def _summarize(self, llm, summary, messages, cutoff, generation):
+        lines = "\n".join(f"{m.role.value}: {str(m.content or '')[:SUMMARY_MESSAGE_MAX_CHARS]}" for m in messages)
+        try:
+            new_summary = llm.complete(SUMMARY_PROMPT.format(summary=summary or "(none)", lines=lines)).text.strip()
+        except Exception as e:
+            print(f"Couldn't summarize the chat history, older turns will be trimmed instead: {e}")
+            new_summary = ""
+        with self._lock:
+            self._summarizing = False
+            if not new_summary or generation != self._generation:
+                return
+            self._summary, self._summarized_upto = new_summary, cutoff
+        # More turns may have fallen out of the recent window while this summary was being written
+        self._maybe_summarize()
@@ -0,0 +1,22 @@
+import os, sys
+import pytest
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+"""
+Runs a test from an empty working directory with one file in the data directory and a mock embedding model, so the
+app's index building (which uses relative Databases/ and data/ paths) can be exercised end to end.
+"""
+@pytest.fixture
+def app_dir(tmp_path, monkeypatch):
+    import chat_utils
+    from llama_index.core.embeddings import MockEmbedding
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "notes.md").write_text("# Notes\nparse_config reads the settings file.\n")
+    embed_model = MockEmbedding(embed_dim=8)
+    monkeypatch.setattr(chat_utils, "get_embed_model", lambda: embed_model)
+    monkeypatch.setattr(chat_utils, "_local_stores", {})
+    return tmp_path
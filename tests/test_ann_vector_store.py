@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+from llama_index.core.vector_stores.types import VectorStoreQuery
+import ann_vector_store
+from ann_vector_store import IVFVectorStore
+from ann_benchmark import clustered_vectors
+from local_vector_store import MemmapVectorStore
+
+
+@pytest.fixture(autouse=True)
+def small_training_size(monkeypatch):
+    monkeypatch.setattr(ann_vector_store, "ANN_MIN_TRAIN_SIZE", 500)
+
+
+@pytest.fixture
+def vectors():
+    return clustered_vectors(2000, 16, 20, np.random.default_rng(0))
+
+
+def nodes(vectors, start=0):
+    return [TextNode(id_=str(start + i), text="", embedding=vector.tolist(),
+                     relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=f"doc-{start + i}")})
+            for i, vector in enumerate(vectors)]
+
+
+def top_ids(store, q, k=10):
+    return store.query(VectorStoreQuery(query_embedding=q.tolist(), similarity_top_k=k)).ids
+
+
+def test_small_stores_use_exact_search(tmp_path, vectors):
+    store = IVFVectorStore(str(tmp_path / "ivf"), nlist=8, nprobe=1)
+    exact = MemmapVectorStore(str(tmp_path / "exact"))
+    store.add(nodes(vectors[:100]))
+    exact.add(nodes(vectors[:100]))
+    assert store._centroids is None
+    assert top_ids(store, vectors[7]) == top_ids(exact, vectors[7])
+
+
+def test_probing_every_cluster_matches_exact_search(tmp_path, vectors):
+    store = IVFVectorStore(str(tmp_path / "ivf"), nlist=16, nprobe=16)
+    exact = MemmapVectorStore(str(tmp_path / "exact"))
+    store.add(nodes(vectors))
+    exact.add(nodes(vectors))
+    assert store._centroids is not None
+    for q in vectors[:20]:
+        assert top_ids(store, q) == top_ids(exact, q)
+
+
+def test_probing_a_few_clusters_keeps_recall_high(tmp_path, vectors):
+    store = IVFVectorStore(str(tmp_path / "ivf"), nlist=16, nprobe=4)
+    exact = MemmapVectorStore(str(tmp_path / "exact"))
+    store.add(nodes(vectors))
+    exact.add(nodes(vectors))
+    queries = vectors[::50]
+    recall = np.mean([len(set(top_ids(store, q)) & set(top_ids(exact, q))) / 10 for q in queries])
+    assert recall >= 0.9
+
+
+def test_rows_added_after_training_are_assigned_to_clusters(tmp_path, vectors):
+    store = IVFVectorStore(str(tmp_path), nlist=16, nprobe=16)
+    store.add(nodes(vectors[:1000]))
+    trained = store._centroids
+    store.add(nodes(vectors[1000:1200], start=1000))
+    # Not enough growth to retrain, so the new rows were assigned to the existing clusters
+    assert store._centroids is trained
+    assert top_ids(store, vectors[1100], k=1) == ["1100"]
+
+
+def test_store_retrains_once_it_has_grown_enough(tmp_path, vectors):
+    store = IVFVectorStore(str(tmp_path), nlist=8, nprobe=8)
+    store.add(nodes(vectors[:500]))
+    trained = store._centroids
+    store.add(nodes(vectors[500:], start=500))
+    assert store._centroids is not trained
+    assert store._trained_count == 2000
+
+
+def test_deletes_keep_cluster_assignments_in_line(tmp_path, vectors):
+    store = IVFVectorStore(str(tmp_path / "ivf"), nlist=16, nprobe=16)
+    exact = MemmapVectorStore(str(tmp_path / "exact"))
+    store.add(nodes(vectors))
+    exact.add(nodes(vectors))
+    for i in range(0, 2000, 7):
+        store.delete(f"doc-{i}")
+        exact.delete(f"doc-{i}")
+    for q in vectors[1:40:3]:
+        assert top_ids(store, q) == top_ids(exact, q)
+
+
+def test_clusters_are_persisted(tmp_path, vectors):
+    store = IVFVectorStore(str(tmp_path), nlist=16, nprobe=4)
+    store.add(nodes(vectors))
+    store.persist()
+    expected = [top_ids(store, q) for q in vectors[:10]]
+    reloaded = IVFVectorStore(str(tmp_path), nlist=16, nprobe=4)
+    assert np.array_equal(reloaded._centroids, store._centroids)
+    assert [top_ids(reloaded, q) for q in vectors[:10]] == expected
+
+
+def test_ann_index_is_built_persisted_and_reloaded(app_dir, monkeypatch):
+    import chat_utils
+    storage_context = chat_utils.setup_vector_store("Local ANN", None, None, None, None)
+    assert isinstance(storage_context.vector_store, IVFVectorStore)
+    index = chat_utils.create_index(None, None, None, "Local ANN", None, None, None, None,
+                                    chat_utils.index_manifest("Local ANN", None))
+    assert isinstance(index.vector_store, IVFVectorStore)
+    store_dir = app_dir / chat_utils.Local_ANN_PATH / chat_utils.DEFAULT_CHROMA_COLLECTION
+    assert (store_dir / "vectors.bin").exists()
+    monkeypatch.setattr(chat_utils, "_local_stores", {})
+    reloaded = chat_utils.create_index(None, None, None, "Local ANN", None, None, None, None,
+                                       chat_utils.index_manifest("Local ANN", None))
+    assert len(reloaded.vector_store) == len(index.vector_store) > 0
+    nodes = reloaded.as_retriever(similarity_top_k=1).retrieve("parse_config")
+    assert "parse_config" in nodes[0].node.get_content()
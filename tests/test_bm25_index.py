@@ -0,0 +1,96 @@
+import asyncio, threading
+import pytest
+from llama_index.core import VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+from bm25_index import (BM25Index, HybridRetriever, tokenize, reciprocal_rank_fusion, attach_sparse_index,
+                        sparse_index, delete_ref_doc)
+
+
+def node(node_id, text, ref_doc_id=None):
+    return TextNode(id_=node_id, text=text,
+                    relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=ref_doc_id or f"doc-{node_id}")})
+
+
+@pytest.fixture
+def bm25():
+    index = BM25Index()
+    index.add_nodes([node("parse", "def parse_config(path): reads the config file"),
+                     node("http", "class HttpClientPool keeps connections alive"),
+                     node("docs", "The configuration guide explains every setting")])
+    return index
+
+
+def test_identifiers_are_split_into_their_parts():
+    assert tokenize("parse_config HttpClientPool x2") == ["parse_config", "parse", "config", "httpclientpool", "http",
+                                                          "client", "pool", "x2", "x", "2"]
+
+
+def test_exact_identifiers_rank_first(bm25):
+    assert bm25.search("HttpClientPool", 3)[0][0] == "http"
+    assert bm25.search("where is parse_config defined", 3)[0][0] == "parse"
+    assert bm25.search("nothing matches", 3) == []
+
+
+def test_deleted_documents_are_not_found(bm25):
+    bm25.delete_ref_doc("doc-http")
+    assert len(bm25) == 2
+    assert bm25.search("HttpClientPool", 3) == []
+
+
+def test_re_adding_a_node_replaces_it(bm25):
+    bm25.add_nodes([node("parse", "completely different text")])
+    assert len(bm25) == 3
+    assert bm25.search("parse_config", 3) == []
+
+
+def test_saved_index_scores_the_same(tmp_path, bm25):
+    path = str(tmp_path / "bm25.json")
+    bm25.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.search("config connections", 3) == bm25.search("config connections", 3)
+    assert BM25Index.load(str(tmp_path / "missing.json")) is None
+
+
+def test_reciprocal_rank_fusion_favours_nodes_both_rankings_found():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], k=60)
+    assert [node_id for node_id, _ in fused] == ["c", "a", "b", "d"]
+
+
+@pytest.fixture
+def index():
+    nodes = [node(f"n{i}", f"generic text about topic {i}") for i in range(5)]
+    nodes.append(node("target", "def frobnicate_widget(): pass"))
+    index = VectorStoreIndex(nodes, embed_model=MockEmbedding(embed_dim=8))
+    bm25 = BM25Index()
+    bm25.add_nodes(nodes)
+    attach_sparse_index(index, bm25)
+    return index
+
+
+def test_hybrid_retrieval_finds_exact_identifiers(index):
+    retriever = HybridRetriever(index, sparse_index(index), similarity_top_k=2)
+    assert retriever.retrieve("frobnicate_widget")[0].node.node_id == "target"
+    assert asyncio.run(retriever.aretrieve("frobnicate_widget"))[0].node.node_id == "target"
+
+
+def test_deleting_a_document_removes_it_from_both_indexes(index):
+    delete_ref_doc(index, "doc-target")
+    retriever = HybridRetriever(index, sparse_index(index), similarity_top_k=6)
+    assert "target" not in [n.node.node_id for n in retriever.retrieve("frobnicate_widget")]
+    assert sparse_index(index).search("frobnicate_widget", 5) == []
+
+
+def test_in_memory_dense_search_stays_off_the_event_loop(index, monkeypatch):
+    from retrieval_cache import CachedRetriever, RetrievalCache
+    store_type = type(index.vector_store)
+    query, threads = store_type.query, []
+
+    def recording_query(self, *args, **kwargs):
+        threads.append(threading.current_thread())
+        return query(self, *args, **kwargs)
+
+    monkeypatch.setattr(store_type, "query", recording_query)
+    asyncio.run(HybridRetriever(index, sparse_index(index), similarity_top_k=2).aretrieve("frobnicate_widget"))
+    asyncio.run(CachedRetriever(index, similarity_top_k=2, cache=RetrievalCache()).aretrieve("frobnicate_widget"))
+    assert len(threads) == 2 and threading.main_thread() not in threads
@@ -0,0 +1,110 @@
+import ast
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import Document
+from code_parser import CodeNodeParser, split_lines, python_segments, brace_segments, pack_segments
+
+PYTHON_SOURCE = '''import os
+
+
+def load(path):
+    return open(path).read()
+
+
+# Handles requests
+@decorator
+class Handler:
+    def get(self):
+        return 1
+
+    def post(self):
+        return 2
+
+
+CONSTANT = 3
+'''
+
+JS_SOURCE = '''import x from "y";
+
+// Adds numbers
+export function add(a, b) {
+  const s = "}";
+  return a + b;
+}
+
+const mul = (a, b) => {
+  return a * b;
+};
+
+class Point {
+  constructor() {}
+}
+'''
+
+
+def text(lines, segment):
+    return "".join(lines[segment.start:segment.end])
+
+
+def test_split_lines_only_splits_on_newlines():
+    assert split_lines("a\fb\nc\n") == ["a\fb\n", "c\n"]
+    assert split_lines("a\nb") == ["a\n", "b"]
+    assert split_lines("") == []
+
+
+def test_python_is_split_on_top_level_definitions():
+    lines = split_lines(PYTHON_SOURCE)
+    segments = python_segments(lines, ast.parse(PYTHON_SOURCE).body, 0, len(lines))
+    named = [s for s in segments if s.symbols]
+    assert [s.symbols for s in named] == [["load"], ["Handler"]]
+    # Comments and decorators above a definition belong to it
+    assert text(lines, named[1]).startswith("# Handles requests\n@decorator\nclass Handler:")
+    # No line is lost or repeated
+    assert "".join(text(lines, s) for s in segments) == PYTHON_SOURCE
+
+
+def test_big_python_classes_are_split_into_their_methods():
+    lines = split_lines(PYTHON_SOURCE)
+    segments = python_segments(lines, ast.parse(PYTHON_SOURCE).body, 0, len(lines), max_chars=40)
+    assert ["Handler.get"] in [s.symbols for s in segments]
+    assert ["Handler.post"] in [s.symbols for s in segments]
+    assert "".join(text(lines, s) for s in segments) == PYTHON_SOURCE
+
+
+def test_brace_languages_are_split_on_top_level_definitions():
+    lines = split_lines(JS_SOURCE)
+    segments = brace_segments(lines)
+    named = [s for s in segments if s.symbols]
+    assert [s.symbols for s in named] == [["add"], ["mul"], ["Point"]]
+    # The brace inside the string doesn't end the function early
+    assert text(lines, named[0]) == ("// Adds numbers\nexport function add(a, b) {\n  const s = \"}\";\n"
+                                     "  return a + b;\n}\n")
+    assert "".join(text(lines, s) for s in segments) == JS_SOURCE
+
+
+def test_packing_merges_small_segments_and_splits_big_ones():
+    lines = [f"line {i}\n" for i in range(100)]
+    segments = brace_segments(lines)
+    chunks = pack_segments(lines, segments, max_chars=100, min_chars=10)
+    assert all(sum(map(len, lines[c.start:c.end])) <= 100 for c in chunks)
+    assert chunks[0].start == 0
+    assert chunks[-1].end == 100
+    assert all(a.end == b.start for a, b in zip(chunks, chunks[1:]))
+
+
+def test_parser_adds_language_symbols_and_line_numbers():
+    parser = CodeNodeParser(text_parser=SentenceSplitter(), max_chars=3000, min_chars=0)
+    nodes = parser.get_nodes_from_documents([Document(text=PYTHON_SOURCE, metadata={"file_path": "app/handler.py"})])
+    assert [n.metadata["symbols"] for n in nodes] == ["", "load", "Handler", ""]
+    assert nodes[1].metadata["language"] == "python"
+    assert (nodes[1].metadata["start_line"], nodes[1].metadata["end_line"]) == (4, 5)
+    # Symbols are embedded with the code but line numbers aren't
+    assert "start_line" in nodes[1].excluded_embed_metadata_keys
+    assert "symbols" not in nodes[1].excluded_embed_metadata_keys
+
+
+def test_other_files_and_broken_code_go_to_the_text_parser():
+    parser = CodeNodeParser(text_parser=SentenceSplitter())
+    for path, source in (("notes.md", "# Notes\nSome text."), ("broken.py", "def broken(:\n")):
+        nodes = parser.get_nodes_from_documents([Document(text=source, metadata={"file_path": path})])
+        assert len(nodes) == 1
+        assert "language" not in nodes[0].metadata
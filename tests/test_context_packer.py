@@ -0,0 +1,68 @@
+from llama_index.core.llms import ChatMessage
+from llama_index.core.schema import NodeWithScore, TextNode
+from context_packer import ContextPacker
+from summary_memory import SummaryChatMemory
+from utils import prompt_token_budget
+
+
+def words(text):
+    return text.split()
+
+
+def scored(node_id, text, score):
+    return NodeWithScore(node=TextNode(id_=node_id, text=text), score=score)
+
+
+def test_max_tokens_only_reserves_part_of_the_window():
+    assert prompt_token_budget("gpt-4", 1000) == 8192 - 1000
+    # A max tokens setting as big as the window used to leave nothing for the prompt
+    assert prompt_token_budget("mistralai/Codestral-22B-v0.1", 2048, context_window=2048) == 1024
+    assert prompt_token_budget("unknown-model", 100) == 32768 - 100
+
+
+def test_hosted_models_use_their_own_context_length():
+    assert prompt_token_budget("gpt-4o", 0) == 128000
+    assert prompt_token_budget("claude-3-haiku-20240307", 0) == 200000
+    assert prompt_token_budget("meta/llama-3.1-8b-instruct", 0) == 128000
+
+
+def test_best_chunks_are_packed_until_the_budget_runs_out():
+    packer = ContextPacker(tokenizer_fn=words, prompt_budget=20, reserved_tokens=4)
+    nodes = [scored("low", "one two three", 0.1), scored("high", "a b c d e f g h", 0.9),
+             scored("mid", "x y z", 0.5), scored("big", " ".join(["w"] * 50), 0.8)]
+    # 16 tokens are left, every chunk costs two extra for the separator and the big one never fits
+    packed = packer.postprocess_nodes(nodes)
+    assert [n.node.node_id for n in packed] == ["high", "mid"]
+
+
+def test_duplicate_chunks_are_packed_once():
+    packer = ContextPacker(tokenizer_fn=words, prompt_budget=100)
+    nodes = [scored("a", "same text", 0.9), scored("b", "same text", 0.8), scored("a", "same text", 0.7)]
+    assert [n.node.node_id for n in packer.postprocess_nodes(nodes)] == ["a"]
+
+
+def test_history_is_capped_at_its_share_of_the_budget():
+    memory = SummaryChatMemory(token_limit=1000, tokenizer_fn=words)
+    memory.put(ChatMessage(role="user", content=" ".join(["q"] * 30)))
+    packer = ContextPacker(tokenizer_fn=words, prompt_budget=100, reserved_tokens=20, memory=memory, memory_share=0.5)
+    assert packer.history_limit() == 40
+    assert packer.context_budget() == 80 - 30
+    memory.token_limit = min(memory.token_limit, packer.history_limit())
+    memory.put(ChatMessage(role="assistant", content=" ".join(["a"] * 20)))
+    memory.put(ChatMessage(role="user", content=" ".join(["q"] * 20)))
+    memory.put(ChatMessage(role="assistant", content=" ".join(["a"] * 10)))
+    # The oldest turn is trimmed from the history, which is counted as it is sent rather than assumed to fit
+    assert packer.context_budget() == 80 - 30
+
+
+def test_the_query_is_reserved_along_with_the_history():
+    memory = SummaryChatMemory(token_limit=40, tokenizer_fn=words)
+    memory.put(ChatMessage(role="user", content=" ".join(["q"] * 30)))
+    packer = ContextPacker(tokenizer_fn=words, prompt_budget=100, reserved_tokens=20, memory=memory)
+    nodes = [scored("a", " ".join(["x"] * 28), 0.9), scored("b", " ".join(["y"] * 10), 0.8)]
+    assert packer.context_budget("what does parse_config do") == 80 - 30 - 4
+    # 46 tokens are left, the first chunk costs 30 and the second 12
+    packed = packer.postprocess_nodes(nodes, query_str="what does parse_config do")
+    assert [n.node.node_id for n in packed] == ["a", "b"]
+    packed = packer.postprocess_nodes(nodes, query_str=" ".join(["w"] * 10))
+    assert [n.node.node_id for n in packed] == ["a"]
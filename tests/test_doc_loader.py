@@ -0,0 +1,44 @@
+import threading
+import pytest
+import doc_loader
+from doc_loader import iter_parsed_files, list_local_files, start_parse_pool
+
+
+@pytest.fixture
+def files(tmp_path):
+    for i in range(4):
+        (tmp_path / f"file{i}.md").write_text(f"# File {i}\nsome text about topic {i}\n")
+    return list_local_files(str(tmp_path))
+
+
+@pytest.fixture
+def parse_pool(monkeypatch):
+    monkeypatch.setattr(doc_loader, "_parse_pool", None)
+    pool = start_parse_pool(2)
+    yield pool
+    pool.terminate()
+    pool.join()
+
+
+def test_small_batches_are_parsed_in_process(files, parse_pool, monkeypatch):
+    monkeypatch.setattr(parse_pool, "imap_unordered", lambda *args: pytest.fail("small batches shouldn't use the pool"))
+    parsed = dict(iter_parsed_files(files, min_files=5))
+    assert sorted(parsed) == files
+
+
+def test_large_batches_share_the_long_lived_pool(files, parse_pool):
+    for _ in range(2):
+        parsed = dict(iter_parsed_files(files, min_files=2))
+        assert sorted(parsed) == files
+        assert all(docs[0].text.startswith("# File") for docs in parsed.values())
+    # Parsing from a stage thread never creates another pool
+    assert start_parse_pool(2) is parse_pool
+    thread = threading.Thread(target=lambda: list(iter_parsed_files(files, min_files=2)))
+    thread.start()
+    thread.join()
+    assert doc_loader._parse_pool is parse_pool
+
+
+def test_without_a_pool_files_are_parsed_in_process(files, monkeypatch):
+    monkeypatch.setattr(doc_loader, "_parse_pool", None)
+    assert sorted(dict(iter_parsed_files(files, min_files=1))) == files
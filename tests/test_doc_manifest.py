@@ -0,0 +1,81 @@
+import os
+import pytest
+from doc_manifest import DocumentManifest
+
+
+def write(path, text, mtime=None):
+    path.write_text(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_new_files_are_added(tmp_path):
+    a = write(tmp_path / "a.txt", "a")
+    changes = DocumentManifest().diff([a])
+    assert changes.added == [a]
+    assert not changes.modified and not changes.removed
+
+
+def test_unchanged_files_are_skipped(tmp_path):
+    a = write(tmp_path / "a.txt", "a")
+    manifest = DocumentManifest()
+    manifest.record(a, ["doc-a"])
+    assert not manifest.diff([a])
+
+
+def test_modified_and_removed_files(tmp_path):
+    a = write(tmp_path / "a.txt", "a", mtime=1000)
+    b = write(tmp_path / "b.txt", "b")
+    manifest = DocumentManifest()
+    manifest.record(a, ["doc-a"])
+    manifest.record(b, ["doc-b"])
+    write(tmp_path / "a.txt", "changed", mtime=2000)
+    changes = manifest.diff([a])
+    assert changes.modified == [a]
+    assert changes.removed == [b]
+    assert manifest.doc_ids(b) == ["doc-b"]
+
+
+def test_touched_file_with_same_contents_is_not_modified(tmp_path):
+    a = write(tmp_path / "a.txt", "a", mtime=1000)
+    manifest = DocumentManifest()
+    manifest.record(a, ["doc-a"])
+    write(tmp_path / "a.txt", "a", mtime=2000)
+    assert not manifest.diff([a])
+    assert manifest.entries[a]["mtime"] == 2000
+
+
+def test_manifest_is_saved_and_loaded(tmp_path):
+    a = write(tmp_path / "a.txt", "a")
+    path = str(tmp_path / "manifests" / "manifest.json")
+    manifest = DocumentManifest(path)
+    assert not manifest.exists()
+    manifest.record(a, ["doc-a"])
+    manifest.meta["github"] = ["owner", "repo", "main"]
+    manifest.save()
+    loaded = DocumentManifest(path)
+    assert loaded.exists()
+    assert loaded.doc_ids(a) == ["doc-a"]
+    assert loaded.meta == {"github": ["owner", "repo", "main"]}
+
+
+def test_files_are_only_recorded_once_their_documents_are_indexed(app_dir, monkeypatch):
+    import chat_utils
+    from llama_index.core import VectorStoreIndex
+    embed_model = chat_utils.get_embed_model()
+    index = VectorStoreIndex(nodes=[], embed_model=embed_model)
+    manifest = DocumentManifest()
+
+    def fail(texts):
+        raise RuntimeError("embedding service unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(type(embed_model), "_get_text_embeddings", lambda self, texts: fail(texts))
+        with pytest.raises(RuntimeError):
+            chat_utils.sync_local_docs(index, manifest)
+    # Nothing was recorded, so the next sync tries the file again instead of thinking it is indexed
+    assert manifest.entries == {}
+    assert chat_utils.sync_local_docs(index, manifest).added == [os.path.join("data", "notes.md")]
+    assert list(manifest.entries) == [os.path.join("data", "notes.md")]
+    assert len(index.docstore.docs) > 0
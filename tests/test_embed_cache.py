@@ -0,0 +1,65 @@
+import itertools
+import pytest
+import embed_cache
+from embed_cache import EmbeddingCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Every put and get happens at a later time so least recently used is well defined
+    ticks = itertools.count(1)
+    monkeypatch.setattr(embed_cache.time, "time", lambda: next(ticks))
+
+
+def test_roundtrip_and_stats(tmp_path, clock):
+    cache = EmbeddingCache("model", cache_dir=str(tmp_path), max_entries=10)
+    assert cache.get_many(["a", "b"]) == [None, None]
+    cache.put_many(["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    assert cache.get_many(["b", "c", "a"]) == [[0.0, 1.0], None, [1.0, 0.0]]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 3
+    assert len(cache) == 2
+
+
+def test_entries_survive_reopening(tmp_path, clock):
+    EmbeddingCache("model", cache_dir=str(tmp_path), max_entries=10).put_many(["a"], [[0.5, 0.5]])
+    assert EmbeddingCache("model", cache_dir=str(tmp_path), max_entries=10).get_many(["a"]) == [[0.5, 0.5]]
+
+
+def test_models_dont_share_vectors(tmp_path, clock):
+    EmbeddingCache("model", cache_dir=str(tmp_path), max_entries=10).put_many(["a"], [[0.5, 0.5]])
+    assert EmbeddingCache("other", cache_dir=str(tmp_path), max_entries=10).get_many(["a"]) == [None]
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    cache = EmbeddingCache("model", cache_dir=str(tmp_path), max_entries=2)
+    cache.put_many(["a", "b"], [[1.0], [2.0]])
+    # Reading "a" makes "b" the least recently used entry
+    cache.get_many(["a"])
+    cache.put_many(["c"], [[3.0]])
+    assert len(cache) == 2
+    assert cache.get_many(["a", "b", "c"]) == [[1.0], None, [3.0]]
+
+
+def test_updating_an_entry_reuses_its_slot(tmp_path, clock):
+    cache = EmbeddingCache("model", cache_dir=str(tmp_path), max_entries=2)
+    cache.put_many(["a", "b"], [[1.0], [2.0]])
+    cache.put_many(["a"], [[4.0]])
+    assert cache.get_many(["a", "b"]) == [[4.0], [2.0]]
+
+
+def test_cached_embedding_only_embeds_misses(tmp_path, clock):
+    from llama_index.core.embeddings import MockEmbedding
+    embedded = []
+
+    class CountingEmbedding(MockEmbedding):
+        def _get_text_embeddings(self, texts):
+            embedded.extend(texts)
+            return super()._get_text_embeddings(texts)
+
+    cached = embed_cache.CachedEmbedding(CountingEmbedding(embed_dim=3),
+                                         cache=EmbeddingCache("model", cache_dir=str(tmp_path), max_entries=10))
+    first = cached.get_text_embedding_batch(["a", "b"])
+    second = cached.get_text_embedding_batch(["b", "a", "c"])
+    assert embedded == ["a", "b", "c"]
+    assert second[:2] == first[::-1]
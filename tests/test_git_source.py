@@ -0,0 +1,93 @@
+import os, shutil, subprocess
+import pytest
+from git_source import LocalGitRepo
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git isn't installed")
+
+
+def git(path, *args):
+    env = {**os.environ, "GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "test@example.com",
+           "GIT_COMMITTER_NAME": "test", "GIT_COMMITTER_EMAIL": "test@example.com"}
+    return subprocess.run(["git", "-C", str(path), *args], check=True, capture_output=True, env=env).stdout.decode()
+
+
+def commit(path, files, message):
+    for name, content in files.items():
+        (path / name).parent.mkdir(parents=True, exist_ok=True)
+        (path / name).write_bytes(content)
+    git(path, "add", "-A")
+    git(path, "commit", "-q", "-m", message)
+    return git(path, "rev-parse", "HEAD").strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    path = tmp_path / "repo"
+    path.mkdir()
+    git(path, "init", "-q")
+    first = commit(path, {"main.py": b"print('v1')\n", "docs/guide.md": b"# Guide\n", "logo.png": b"\x89PNG",
+                          "blob.bin": b"\xff\xfe\x00"}, "first")
+    os.symlink("main.py", path / "link.py")
+    second = commit(path, {"main.py": b"print('v2')\n"}, "second")
+    git(path, "tag", "v1", first)
+    return path, first, second
+
+
+def test_head_resolves_branches_tags_and_commits(repo):
+    path, first, second = repo
+    local = LocalGitRepo(str(path))
+    assert local.head("HEAD") == second
+    assert local.head("v1") == first
+    assert local.head(first[:10]) == first
+
+
+def test_bad_refs_and_directories_raise(repo, tmp_path):
+    path, _, _ = repo
+    with pytest.raises(subprocess.CalledProcessError):
+        LocalGitRepo(str(path)).head("no-such-branch")
+    with pytest.raises(subprocess.CalledProcessError):
+        LocalGitRepo(str(tmp_path)).head("HEAD")
+
+
+def test_tree_skips_symlinks_and_excluded_files(repo):
+    path, _, second = repo
+    files = LocalGitRepo(str(path)).tree(second)
+    assert sorted(files) == ["blob.bin", "docs/guide.md", "main.py"]
+    assert files["main.py"] == git(path, "rev-parse", f"{second}:main.py").strip()
+
+
+def test_documents_are_read_at_the_ref(repo):
+    path, first, _ = repo
+    local = LocalGitRepo(str(path))
+    documents = {doc.doc_id: doc for doc in local.documents("v1", local.tree(first))}
+    # The binary file isn't utf-8 so it doesn't become a document
+    assert sorted(documents) == [f"{local.name}/docs/guide.md", f"{local.name}/main.py"]
+    assert documents[f"{local.name}/main.py"].text == "print('v1')\n"
+    assert documents[f"{local.name}/main.py"].metadata["ref"] == "v1"
+
+
+def test_missing_blobs_keep_their_place(repo):
+    path, _, second = repo
+    local = LocalGitRepo(str(path))
+    sha = local.tree(second)["main.py"]
+    assert list(local.read_blobs([sha, "0" * 40, sha])) == [b"print('v2')\n", None, b"print('v2')\n"]
+
+
+def test_reading_can_stop_early(repo):
+    path, _, second = repo
+    local = LocalGitRepo(str(path))
+    blobs = local.read_blobs(list(local.tree(second).values()) * 200)
+    assert next(blobs) is not None
+    blobs.close()
+
+
+def test_sync_warns_instead_of_raising_for_unreadable_repositories(tmp_path):
+    from llama_index.core import VectorStoreIndex
+    from llama_index.core.embeddings import MockEmbedding
+    from chat_utils import sync_local_repo
+    from doc_manifest import DocumentManifest
+    index = VectorStoreIndex([], embed_model=MockEmbedding(embed_dim=8))
+    # Outside of a request gradio turns gr.Warning into a python warning
+    with pytest.warns(UserWarning, match="Couldn't read the git repository"):
+        sync_local_repo(index, DocumentManifest(), str(tmp_path), "HEAD")
+    assert index.ref_doc_info == {}
@@ -0,0 +1,187 @@
+import base64, hashlib
+import httpx
+import pytest
+from github_sync import GitHubAPI, GitHubRepoSync, repo_doc_id
+
+
+def blob_sha(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+"""
+In memory stand in for the three GitHub REST endpoints a sync uses. Commits map to {path: content} and every request is
+logged so tests can check what was actually downloaded.
+"""
+class FakeGitHub:
+    def __init__(self):
+        self.branches = {}
+        self.commits = {}
+        self.blobs = {}
+        self.requests = []
+        self.offline = False
+        self.truncate = False
+
+    def push(self, branch, commit, files):
+        self.branches[branch] = commit
+        self.commits[commit] = files
+        for content in files.values():
+            self.blobs[blob_sha(content)] = content
+
+    def handler(self, request):
+        if self.offline:
+            raise httpx.ConnectError("offline")
+        path = request.url.path
+        self.requests.append(path)
+        parts = path.strip("/").split("/")
+        if parts[3] == "branches":
+            return httpx.Response(200, json={"commit": {"sha": self.branches[parts[4]]}})
+        if parts[4] == "trees":
+            return httpx.Response(200, json=self._tree(parts[5], "recursive" in request.url.params))
+        if parts[4] == "blobs":
+            return httpx.Response(200, json={"content": base64.b64encode(self.blobs[parts[5]]).decode()})
+        return httpx.Response(404)
+
+    # Trees are keyed by commit, or by "commit:directory" (with ~ for /) for the subtrees of a non recursive walk
+    def _tree(self, sha, recursive):
+        commit, _, directory = sha.partition(":")
+        prefix = f"{directory.replace('~', '/')}/" if directory else ""
+        files = self.commits[commit]
+        if recursive:
+            entries = [{"path": p, "type": "blob", "sha": blob_sha(c)} for p, c in files.items()]
+            return {"tree": entries[:1] if self.truncate else entries, "truncated": self.truncate}
+        entries = {}
+        for path, content in files.items():
+            if not path.startswith(prefix):
+                continue
+            name, _, rest = path[len(prefix):].partition("/")
+            if rest:
+                entries[name] = {"path": name, "type": "tree", "sha": f"{commit}:{(prefix + name).replace('/', '~')}"}
+            else:
+                entries[name] = {"path": name, "type": "blob", "sha": blob_sha(content)}
+        return {"tree": list(entries.values()), "truncated": False}
+
+    def blob_requests(self):
+        return [path for path in self.requests if "/git/blobs/" in path]
+
+
+@pytest.fixture
+def github():
+    fake = FakeGitHub()
+    fake.push("main", "c1", {"README.md": b"# Demo", "src/app.py": b"print('hi')\n",
+                             "src/lib/util.py": b"y = 2\n", "logo.png": b"\x89PNG",
+                             "data.bin": b"\xff\xfe\x00"})
+    return fake
+
+
+@pytest.fixture
+def repo_sync(github, tmp_path):
+    api = GitHubAPI(base_url="https://github.test", client=httpx.Client(transport=httpx.MockTransport(github.handler)))
+    return GitHubRepoSync(api, "owner", "repo", cache_dir=str(tmp_path), workers=2)
+
+
+def sync(repo_sync, branch="main"):
+    files = repo_sync.tree(repo_sync.head(branch))
+    return files, {doc.doc_id: doc for doc in repo_sync.documents(branch, files)}
+
+
+def test_first_sync_reads_every_text_file(repo_sync, github):
+    files, documents = sync(repo_sync)
+    # Images are filtered out of the tree and binary files don't become documents
+    assert sorted(files) == ["README.md", "data.bin", "src/app.py", "src/lib/util.py"]
+    assert sorted(documents) == [repo_doc_id("owner/repo", path) for path in ("README.md", "src/app.py",
+                                                                              "src/lib/util.py")]
+    document = documents["owner/repo/src/app.py"]
+    assert document.text == "print('hi')\n"
+    assert document.metadata["file_path"] == "src/app.py"
+    assert document.metadata["url"] == "https://github.com/owner/repo/blob/main/src/app.py"
+
+
+def test_resync_only_downloads_changed_blobs(repo_sync, github):
+    sync(repo_sync)
+    github.requests.clear()
+    github.push("main", "c2", {"README.md": b"# Demo", "src/app.py": b"print('bye')\n", "src/new.py": b"x = 1\n"})
+    commit = repo_sync.head("main")
+    assert commit == "c2"
+    files = repo_sync.tree(commit)
+    assert repo_sync.fetch_blobs(files.values()) == 2
+    assert sorted(github.blob_requests()) == sorted(f"/repos/owner/repo/git/blobs/{blob_sha(c)}"
+                                                     for c in (b"print('bye')\n", b"x = 1\n"))
+
+
+def test_trees_and_blobs_are_cached_across_instances(repo_sync, github, tmp_path):
+    sync(repo_sync)
+    github.requests.clear()
+    api = GitHubAPI(base_url="https://github.test", client=httpx.Client(transport=httpx.MockTransport(github.handler)))
+    _, documents = sync(GitHubRepoSync(api, "owner", "repo", cache_dir=str(tmp_path)))
+    assert len(documents) == 3
+    # Only the branch head is asked for, the tree and blobs of that commit are already on disk
+    assert github.requests == ["/repos/owner/repo/branches/main"]
+
+
+def test_offline_sync_uses_the_last_head(repo_sync, github):
+    sync(repo_sync)
+    github.offline = True
+    files, documents = sync(repo_sync)
+    assert len(documents) == 3
+    with pytest.raises(httpx.ConnectError):
+        repo_sync.head("never-synced")
+
+
+def test_truncated_trees_are_walked_by_directory(repo_sync, github):
+    github.truncate = True
+    files = repo_sync.tree(repo_sync.head("main"))
+    assert sorted(files) == ["README.md", "data.bin", "src/app.py", "src/lib/util.py"]
+    assert files["src/lib/util.py"] == blob_sha(b"y = 2\n")
+
+
+def test_token_is_sent_as_a_bearer_header(github):
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers.get("Authorization"))
+        return github.handler(request)
+    api = GitHubAPI(token="secret", base_url="https://github.test",
+                    client=httpx.Client(transport=httpx.MockTransport(handler)))
+    assert api.branch_head("owner", "repo", "main") == "c1"
+    assert seen == ["Bearer secret"]
+
+
+@pytest.fixture
+def index(monkeypatch):
+    from llama_index.core import VectorStoreIndex
+    from llama_index.core.embeddings import MockEmbedding
+    import chat_utils
+    embed_model = MockEmbedding(embed_dim=8)
+    monkeypatch.setattr(chat_utils, "get_embed_model", lambda: embed_model)
+    return VectorStoreIndex([], embed_model=embed_model)
+
+
+def indexed_text(index):
+    return {ref_doc_id: "".join(index.docstore.get_node(node_id).get_content() for node_id in info.node_ids)
+            for ref_doc_id, info in index.ref_doc_info.items()}
+
+
+def test_index_sync_and_resync(repo_sync, github, index):
+    from chat_utils import sync_repository
+    from doc_manifest import DocumentManifest
+    manifest = DocumentManifest()
+    settings = ["owner", "repo", "main"]
+    sync_repository(index, manifest, "github", settings, lambda: repo_sync)
+    assert sorted(indexed_text(index)) == ["owner/repo/README.md", "owner/repo/src/app.py",
+                                           "owner/repo/src/lib/util.py"]
+    assert manifest.meta["github_commit"] == "c1"
+
+    # Nothing is read again while the branch head stays put
+    github.requests.clear()
+    sync_repository(index, manifest, "github", settings, lambda: repo_sync)
+    assert github.requests == ["/repos/owner/repo/branches/main"]
+
+    github.push("main", "c2", {"README.md": b"# Demo", "src/app.py": b"print('bye')\n", "src/new.py": b"x = 1\n"})
+    sync_repository(index, manifest, "github", settings, lambda: repo_sync)
+    assert indexed_text(index) == {"owner/repo/README.md": "# Demo", "owner/repo/src/app.py": "print('bye')\n",
+                                   "owner/repo/src/new.py": "x = 1\n"}
+    assert manifest.meta["github_commit"] == "c2"
+
+    # Clearing the settings removes every document of the repository
+    sync_repository(index, manifest, "github", None, lambda: repo_sync)
+    assert indexed_text(index) == {}
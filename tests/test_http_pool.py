@@ -0,0 +1,86 @@
+import asyncio
+import httpx
+import pytest
+from http_pool import RetryTransport, AsyncRetryTransport, HTTPClientPool
+
+
+# Mock transport handler that answers with the given status codes (or raises the given errors) in order
+def scripted(*outcomes):
+    calls = []
+
+    def handler(request):
+        outcome = outcomes[len(calls)]
+        calls.append(request)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome, json={"attempt": len(calls)})
+    return handler, calls
+
+
+def client(handler, max_retries=3):
+    return httpx.Client(transport=RetryTransport(httpx.MockTransport(handler), max_retries=max_retries, backoff=0))
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_retryable_statuses_are_retried(status):
+    handler, calls = scripted(status, 200)
+    response = client(handler).get("https://api.test/")
+    assert response.status_code == 200
+    assert len(calls) == 2
+
+
+def test_other_errors_are_returned_straight_away():
+    handler, calls = scripted(404)
+    assert client(handler).get("https://api.test/").status_code == 404
+    assert len(calls) == 1
+
+
+def test_last_response_is_returned_once_retries_run_out():
+    handler, calls = scripted(503, 503, 503)
+    response = client(handler, max_retries=2).get("https://api.test/")
+    assert response.status_code == 503
+    assert response.json() == {"attempt": 3}
+
+
+def test_connection_errors_are_retried():
+    handler, calls = scripted(httpx.ConnectError("refused"), httpx.RemoteProtocolError("closed"), 200)
+    assert client(handler).get("https://api.test/").status_code == 200
+    assert len(calls) == 3
+
+
+def test_connection_error_is_raised_once_retries_run_out():
+    handler, calls = scripted(*[httpx.ConnectError("refused")] * 3)
+    with pytest.raises(httpx.ConnectError):
+        client(handler, max_retries=2).get("https://api.test/")
+    assert len(calls) == 3
+
+
+def test_read_timeouts_are_not_retried():
+    # The request may already have been processed, so only failures to connect are safe to retry
+    handler, calls = scripted(httpx.ReadTimeout("slow"), 200)
+    with pytest.raises(httpx.ReadTimeout):
+        client(handler).get("https://api.test/")
+    assert len(calls) == 1
+
+
+def test_async_transport_retries():
+    handler, calls = scripted(httpx.ConnectError("refused"), 429, 200)
+
+    async def get():
+        transport = AsyncRetryTransport(httpx.MockTransport(handler), max_retries=3, backoff=0)
+        async with httpx.AsyncClient(transport=transport) as async_client:
+            return await async_client.get("https://api.test/")
+    assert asyncio.run(get()).status_code == 200
+    assert len(calls) == 3
+
+
+def test_pool_reuses_clients_per_provider():
+    pool = HTTPClientPool()
+    try:
+        assert pool.http_client("OpenAI") is pool.http_client("OpenAI")
+        assert pool.http_client("OpenAI") is not pool.http_client("Anthropic")
+        built = []
+        assert pool.get_client("sdk", lambda: built.append(1) or object()) is pool.get_client("sdk", object)
+        assert built == [1]
+    finally:
+        pool.close()
@@ -0,0 +1,63 @@
+import threading
+import pytest
+from llama_index.core.schema import Document, TextNode
+from ingest_pipeline import run_ingest_pipeline
+
+
+class OneNodePerDocument:
+    def get_nodes_from_documents(self, documents):
+        return [TextNode(text=doc.text) for doc in documents]
+
+
+class FakeEmbedding:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def get_text_embedding_batch(self, texts):
+        if self.fail:
+            raise RuntimeError("embedding failed")
+        return [[float(len(text))] for text in texts]
+
+
+class FakeIndex:
+    def __init__(self):
+        self.nodes = []
+
+    def insert_nodes(self, nodes):
+        self.nodes.extend(nodes)
+
+
+def documents(count, closed):
+    try:
+        for i in range(count):
+            yield Document(text=f"document {i}")
+    finally:
+        closed.set()
+
+
+def test_every_node_is_embedded_and_inserted():
+    index, closed = FakeIndex(), threading.Event()
+    inserted = run_ingest_pipeline(documents(25, closed), index, FakeEmbedding(), OneNodePerDocument(), batch_size=4,
+                                   queue_size=2)
+    assert inserted == 25
+    assert [node.text for node in index.nodes] == [f"document {i}" for i in range(25)]
+    assert all(node.embedding is not None for node in index.nodes)
+    assert closed.is_set()
+
+
+def test_embedding_errors_stop_the_stages_and_close_the_documents():
+    closed = threading.Event()
+    threads = threading.active_count()
+    with pytest.raises(RuntimeError, match="embedding failed"):
+        run_ingest_pipeline(documents(1000, closed), FakeIndex(), FakeEmbedding(fail=True), OneNodePerDocument(),
+                            batch_size=4, queue_size=2)
+    assert closed.is_set()
+    assert threading.active_count() == threads
+
+
+def test_document_errors_are_raised():
+    def broken_documents():
+        yield Document(text="fine")
+        raise ValueError("couldn't parse")
+    with pytest.raises(ValueError, match="couldn't parse"):
+        run_ingest_pipeline(broken_documents(), FakeIndex(), FakeEmbedding(), OneNodePerDocument())
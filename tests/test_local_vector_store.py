@@ -0,0 +1,124 @@
+import asyncio
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from local_vector_store import MemmapVectorStore, top_k_indices
+
+
+def node(node_id, embedding, ref_doc_id=None):
+    text_node = TextNode(id_=node_id, text=node_id, embedding=list(embedding))
+    if ref_doc_id:
+        text_node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=ref_doc_id)
+    return text_node
+
+
+def query(store, embedding, k=2, **kwargs):
+    return store.query(VectorStoreQuery(query_embedding=list(embedding), similarity_top_k=k, **kwargs))
+
+
+def test_top_k_indices_are_sorted():
+    scores = np.array([0.1, 0.9, 0.5, 0.7])
+    assert top_k_indices(scores, 3).tolist() == [1, 3, 2]
+    assert top_k_indices(scores, 10).tolist() == [1, 3, 2, 0]
+    assert top_k_indices(scores, 0).tolist() == []
+
+
+def test_query_returns_the_closest_nodes_by_cosine(tmp_path):
+    store = MemmapVectorStore(str(tmp_path))
+    store.add([node("x", [1, 0, 0]), node("y", [0, 1, 0]), node("xy", [1, 1, 0])])
+    result = query(store, [2, 0.1, 0])
+    assert result.ids == ["x", "xy"]
+    assert result.similarities[0] == pytest.approx(0.9988, abs=1e-3)
+
+
+def test_empty_store_returns_nothing(tmp_path):
+    assert query(MemmapVectorStore(str(tmp_path)), [1, 0]).ids == []
+
+
+def test_delete_moves_the_last_row_into_the_gap(tmp_path):
+    store = MemmapVectorStore(str(tmp_path))
+    store.add([node("a", [1, 0], "doc-a"), node("b", [0, 1], "doc-b"), node("c", [1, 1], "doc-c")])
+    store.delete("doc-a")
+    assert len(store) == 2
+    # "c" was the last row and now fills the deleted row, and still has its own vector
+    assert query(store, [1, 1], k=1).ids == ["c"]
+    assert query(store, [0, 1], k=1).ids == ["b"]
+    assert sorted(query(store, [1, 0], k=5).ids) == ["b", "c"]
+
+
+def test_delete_removes_every_node_of_the_document(tmp_path):
+    store = MemmapVectorStore(str(tmp_path))
+    store.add([node("a1", [1, 0], "doc-a"), node("b", [0, 1], "doc-b"), node("a2", [1, 1], "doc-a")])
+    store.delete("doc-a")
+    assert query(store, [1, 0], k=5).ids == ["b"]
+
+
+def test_store_grows_past_its_initial_capacity(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(2500, 8))
+    store = MemmapVectorStore(str(tmp_path))
+    for start in range(0, len(vectors), 1000):
+        store.add([node(str(i), vectors[i]) for i in range(start, min(start + 1000, len(vectors)))])
+    assert len(store) == 2500
+    assert query(store, vectors[1234], k=1).ids == ["1234"]
+
+
+def test_query_can_be_restricted_to_node_ids(tmp_path):
+    store = MemmapVectorStore(str(tmp_path))
+    store.add([node("x", [1, 0]), node("y", [0, 1]), node("xy", [1, 1])])
+    assert query(store, [1, 0], node_ids=["y", "xy"]).ids == ["xy", "y"]
+
+
+def test_store_is_persisted_and_reloaded(tmp_path):
+    store = MemmapVectorStore(str(tmp_path))
+    store.add([node("a", [1, 0], "doc-a"), node("b", [0, 1], "doc-b")])
+    store.persist()
+    reloaded = MemmapVectorStore(str(tmp_path))
+    assert len(reloaded) == 2
+    assert query(reloaded, [0, 1], k=1).ids == ["b"]
+    reloaded.delete("doc-b")
+    assert query(reloaded, [0, 1], k=5).ids == ["a"]
+
+
+def test_float16_storage(tmp_path):
+    store = MemmapVectorStore(str(tmp_path), dtype="float16")
+    store.add([node("x", [1, 0]), node("y", [0, 1])])
+    assert query(store, [1, 0.1], k=1).ids == ["x"]
+
+
+def test_mismatched_dimensions_are_rejected(tmp_path):
+    store = MemmapVectorStore(str(tmp_path))
+    store.add([node("x", [1, 0])])
+    with pytest.raises(ValueError):
+        store.add([node("y", [1, 0, 0])])
+
+
+def test_async_query(tmp_path):
+    store = MemmapVectorStore(str(tmp_path))
+    store.add([node("x", [1, 0]), node("y", [0, 1])])
+    result = asyncio.run(store.aquery(VectorStoreQuery(query_embedding=[0, 1], similarity_top_k=1)))
+    assert result.ids == ["y"]
+
+
+def test_empty_store_is_truthy(tmp_path):
+    # StorageContext.from_defaults replaces falsy vector stores with a SimpleVectorStore
+    assert MemmapVectorStore(str(tmp_path))
+
+
+def test_local_index_is_built_persisted_and_reloaded(app_dir, monkeypatch):
+    import chat_utils
+    storage_context = chat_utils.setup_vector_store("Local", None, None, None, None)
+    assert isinstance(storage_context.vector_store, MemmapVectorStore)
+    index = chat_utils.create_index(None, None, None, "Local", None, None, None, None,
+                                    chat_utils.index_manifest("Local", None))
+    assert isinstance(index.vector_store, MemmapVectorStore)
+    store_dir = app_dir / chat_utils.Local_Vector_PATH / chat_utils.DEFAULT_CHROMA_COLLECTION
+    assert (store_dir / "vectors.bin").exists() and (store_dir / "ids.json").exists()
+    # A new process opens the store from disk again
+    monkeypatch.setattr(chat_utils, "_local_stores", {})
+    reloaded = chat_utils.create_index(None, None, None, "Local", None, None, None, None,
+                                       chat_utils.index_manifest("Local", None))
+    assert len(reloaded.vector_store) == len(index.vector_store) > 0
+    nodes = reloaded.as_retriever(similarity_top_k=1).retrieve("parse_config")
+    assert "parse_config" in nodes[0].node.get_content()
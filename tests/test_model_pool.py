@@ -0,0 +1,90 @@
+import threading
+import pytest
+from model_pool import HFModelPool
+
+GB = 1024 ** 3
+
+
+class FakeModel:
+    def __init__(self, size_gb):
+        self.size = int(size_gb * GB)
+
+    def get_memory_footprint(self):
+        return self.size
+
+
+@pytest.fixture
+def pool():
+    return HFModelPool(memory_budget_gb=1)
+
+
+def loader(pool, size_gb, resident):
+    def load():
+        # Records what was resident while the model loaded
+        resident.append(pool.keys())
+        return FakeModel(size_gb), "tokenizer"
+    return load
+
+
+def test_loaded_models_are_reused(pool):
+    resident = []
+    first = pool.get("a", "4 Bit", 2048, loader(pool, 0.3, resident))
+    assert pool.get("a", "4 Bit", 2048, loader(pool, 0.3, resident)) == first
+    assert len(resident) == 1
+
+
+def test_old_models_are_dropped_before_a_new_one_loads(pool):
+    resident = []
+    pool.get("a", "4 Bit", 2048, loader(pool, 0.6, resident))
+    pool.get("a", "8 Bit", 2048, loader(pool, 0.6, resident))
+    # The second model wouldn't fit next to the first, so it was never loaded while the first was resident
+    assert resident == [[], []]
+    assert pool.keys() == [("a", "8 Bit", 2048)]
+
+
+def test_models_that_fit_together_stay_resident(pool):
+    resident = []
+    pool.get("a", "4 Bit", 2048, loader(pool, 0.3, resident))
+    pool.get("b", "4 Bit", 2048, loader(pool, 0.3, resident))
+    pool.get("a", "4 Bit", 2048, loader(pool, 0.3, resident))
+    pool.get("c", "4 Bit", 2048, loader(pool, 0.3, resident))
+    assert resident[-1] == [("b", "4 Bit", 2048), ("a", "4 Bit", 2048)]
+    assert pool.memory_used() <= pool.memory_budget
+
+
+def test_pool_is_trimmed_when_a_model_is_bigger_than_expected(pool):
+    resident = []
+    pool.get("a", "4 Bit", 2048, loader(pool, 0.2, resident))
+    pool.get("b", "4 Bit", 2048, loader(pool, 0.9, resident))
+    assert pool.keys() == [("b", "4 Bit", 2048)]
+
+
+def test_concurrent_requests_load_a_model_once(pool):
+    started, release, loads = threading.Event(), threading.Event(), []
+
+    def slow_load():
+        loads.append(1)
+        started.set()
+        release.wait(5)
+        return FakeModel(0.1), "tokenizer"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.get("a", "4 Bit", 2048, slow_load)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    # Other models can still be fetched while one is loading
+    pool.get("b", "4 Bit", 2048, lambda: (FakeModel(0.1), "tokenizer"))
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(loads) == 1
+    assert len({id(model) for model, _ in results}) == 1
+
+
+def test_failed_loads_can_be_retried(pool):
+    def broken():
+        raise OSError("download failed")
+    with pytest.raises(OSError):
+        pool.get("a", "4 Bit", 2048, broken)
+    assert pool.get("a", "4 Bit", 2048, lambda: (FakeModel(0.1), "tokenizer"))[1] == "tokenizer"
@@ -0,0 +1,63 @@
+import threading, time
+from types import SimpleNamespace
+import pytest
+import model_utils
+from model_utils import ModelManager, reset_gpu_memory
+from session_utils import ChatSession
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    builds = []
+
+    # Building the index is slow, which is what gives concurrent chats the chance to build it twice
+    def create_index(*args):
+        builds.append(args)
+        time.sleep(0.2)
+        return object()
+
+    monkeypatch.setattr(model_utils, "create_index", create_index)
+    monkeypatch.setattr(model_utils, "index_manifest", lambda *args: None)
+    monkeypatch.setattr(model_utils, "create_llm", lambda *args: object())
+    monkeypatch.setattr(model_utils, "create_chat_engine",
+                        lambda index, *args: SimpleNamespace(index=index, memory=None))
+    monkeypatch.setattr(model_utils, "reset_gpu_memory", lambda before=None: None)
+    manager = ModelManager()
+    manager.builds = builds
+    return manager
+
+
+def test_concurrent_first_chats_build_the_index_once(manager):
+    sessions = [ChatSession(str(i)) for i in range(4)]
+    threads = [threading.Thread(target=manager.session_chat_engine, args=(session,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(manager.builds) == 1
+    assert {session.chat_engine.index for session in sessions} == {manager.index}
+
+
+def test_chat_during_a_reset_uses_the_new_index(manager):
+    session = ChatSession("a")
+    manager.session_chat_engine(session)
+    reset = threading.Thread(target=manager.reset_chat_engine)
+    reset.start()
+    time.sleep(0.05)
+    # The chat waits for the reset instead of building a third index next to it
+    manager.session_chat_engine(session)
+    reset.join()
+    assert len(manager.builds) == 2
+    assert session.chat_engine.index is manager.index
+
+
+def test_teardown_measures_memory_from_before_the_references_are_dropped(manager, monkeypatch):
+    snapshots = []
+    monkeypatch.setattr(model_utils, "reset_gpu_memory", reset_gpu_memory)
+    monkeypatch.setattr(model_utils, "clear_gpu_memory", lambda: None)
+    monkeypatch.setattr(model_utils, "memory_snapshot", lambda: snapshots.append(manager.llm is not None) or
+                        {"rss": 0, "cuda_allocated": 0, "cuda_reserved": 0})
+    manager.session_chat_engine(ChatSession("a"))
+    manager.teardown_chat_engine()
+    # The first snapshot still sees the model, so the report includes what dropping it released
+    assert snapshots == [True, False]
@@ -0,0 +1,94 @@
+import threading, time
+from types import SimpleNamespace
+from llama_index.core.llms import ChatMessage, MessageRole
+from summary_memory import SummaryChatMemory
+
+
+def words(text):
+    return text.split()
+
+
+def turn(memory, i, size=5):
+    memory.put(ChatMessage(role="user", content=f"question{i} " + "q " * size))
+    memory.put(ChatMessage(role="assistant", content=f"answer{i} " + "a " * size))
+
+
+class FakeLLM:
+    def __init__(self):
+        self.prompts = []
+        self.done = threading.Event()
+
+    def complete(self, prompt):
+        self.prompts.append(prompt)
+        self.done.set()
+        return SimpleNamespace(text=f"summary {len(self.prompts)}")
+
+
+def contents(messages):
+    return [m.content.split()[0] for m in messages]
+
+
+def test_history_is_kept_word_for_word_without_an_llm():
+    memory = SummaryChatMemory(token_limit=1000, recent_turns=2, tokenizer_fn=words)
+    for i in range(4):
+        turn(memory, i)
+    assert contents(memory.get()) == [f"{kind}{i}" for i in range(4) for kind in ("question", "answer")]
+
+
+def test_history_is_trimmed_from_the_oldest_turn():
+    memory = SummaryChatMemory(token_limit=20, recent_turns=10, tokenizer_fn=words)
+    for i in range(4):
+        turn(memory, i)
+    # Each turn is 12 words, so only the last one fits and the history still starts with a user message
+    assert contents(memory.get()) == ["question3", "answer3"]
+
+
+def test_token_limit_only_counts_the_history():
+    memory = SummaryChatMemory(token_limit=30, recent_turns=10, tokenizer_fn=words)
+    for i in range(2):
+        turn(memory, i)
+    # The system prompt and context passed in don't eat into the history limit
+    assert len(memory.get(initial_token_count=500)) == 4
+
+
+def test_chat_engine_caps_the_limit_at_the_packers_history_share():
+    from llama_index.core import VectorStoreIndex
+    from llama_index.core.embeddings import MockEmbedding
+    from llama_index.core.llms import MockLLM
+    from chat_utils import create_chat_engine
+    from utils import chat_memory_limit
+    index = VectorStoreIndex(nodes=[], embed_model=MockEmbedding(embed_dim=8))
+    memory = SummaryChatMemory(token_limit=1, tokenizer_fn=words)
+    engine = create_chat_engine(index, MockLLM(), "gpt-4", None, memory=memory, prompt_budget=1000)
+    packer = engine._node_postprocessors[-1]
+    assert memory.token_limit == packer.history_limit() < 1000
+    # Rebuilding with a bigger budget starts again from the model's limit rather than the last cap
+    engine = create_chat_engine(index, MockLLM(), "gpt-4", None, memory=memory, prompt_budget=10 ** 6)
+    assert memory.token_limit == chat_memory_limit("gpt-4")
+
+
+def test_old_turns_are_folded_into_a_summary():
+    llm = FakeLLM()
+    memory = SummaryChatMemory(token_limit=1000, recent_turns=2, tokenizer_fn=words, llm=llm)
+    for i in range(3):
+        turn(memory, i)
+    assert llm.done.wait(5)
+    for _ in range(100):
+        if memory.summary:
+            break
+        time.sleep(0.01)
+    assert memory.summary == "summary 1"
+    assert "question0" in llm.prompts[0]
+    messages = memory.get()
+    assert messages[0].role == MessageRole.SYSTEM
+    assert "summary 1" in messages[0].content
+    assert contents(messages[1:]) == ["question1", "answer1", "question2", "answer2"]
+    # The full history is still there for the chat window
+    assert len(memory.get_all()) == 6
+
+
+def test_reset_drops_the_summary_and_history():
+    memory = SummaryChatMemory(token_limit=1000, tokenizer_fn=words)
+    turn(memory, 0)
+    memory.reset()
+    assert memory.get() == [] and memory.summary == ""
@@ -1,156 +1,304 @@
-from llama_index.core.chat_engine.types import ChatMode
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.llms.anthropic import Anthropic
-from llama_index.llms.ollama import Ollama
-from llama_index.llms.huggingface import HuggingFaceLLM
-from llama_index.llms.nvidia import NVIDIA
-from llama_index.llms.openai import OpenAI
+from llama_index.core.chat_engine import SimpleChatEngine, ContextChatEngine
 from llama_index.core import VectorStoreIndex
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.llms import ChatMessage
-from transformers import BitsAndBytesConfig
-import torch, dotenv, os, gc
-from huggingface_hub import login
+from ingest_pipeline import run_ingest_pipeline
+from retrieval_cache import CachedRetriever
+from context_packer import ContextPacker, model_tokenizer
+from summary_memory import SummaryChatMemory
+from config import (HTTP_TIMEOUT, OLLAMA_BASE_URL, CONTEXT_CANDIDATES, CHAT_MEMORY_MODE, SUMMARY_MEMORY_TOKEN_LIMIT,
+                    SUMMARY_MEMORY_MODEL_LIMITS, MAX_OUTPUT_SHARE)
+import gradio as gr
+import ctypes, dotenv, os, gc, sys
 
 dotenv.load_dotenv()
 
+"""
+Provider integrations, torch and transformers are imported inside the functions that use them. Most sessions only use
+one provider, so this keeps the others (and their dependencies) from slowing down startup.
+"""
+
 # Used to determine what devices are available and set different gpus to different purposes
 def set_device(gpu: int = None) -> str:
+    import torch
     return f"cuda:{gpu}" if torch.cuda.is_available() and gpu is not None else "cpu"
 
+"""
+Frees memory that is no longer referenced. The garbage collector runs first so freed tensors go back to torch's caching
+allocator before the cache is emptied, then glibc is asked to hand free heap pages back to the os so process RSS
+actually drops on CPU only hosts. Torch is only touched if something already loaded it.
+"""
+def clear_gpu_memory():
+    gc.collect()
+    if "torch" in sys.modules and sys.modules["torch"].cuda.is_available():
+        sys.modules["torch"].cuda.empty_cache()
+    trim_process_memory()
+
+# Returns freed heap memory to the os. malloc_trim only exists in glibc so this does nothing anywhere else.
+def trim_process_memory():
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+# Current process RSS and torch device memory in bytes, used to check that swapping models really frees memory
+def memory_snapshot():
+    snapshot = {"rss": 0, "cuda_allocated": 0, "cuda_reserved": 0}
+    try:
+        with open("/proc/self/statm") as f:
+            snapshot["rss"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        snapshot["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    if "torch" in sys.modules and sys.modules["torch"].cuda.is_available():
+        torch = sys.modules["torch"]
+        snapshot["cuda_allocated"] = sum(torch.cuda.memory_allocated(d) for d in range(torch.cuda.device_count()))
+        snapshot["cuda_reserved"] = sum(torch.cuda.memory_reserved(d) for d in range(torch.cuda.device_count()))
+    return snapshot
+
 # Sets embedding model using a hugging face embedding model for local embeddings.
 def set_embedding_model():
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
     embed_model = HuggingFaceEmbedding(model_name="/home/jake/Programming/Models/embedding/stella_en_400M_v5",
                                        device=set_device(0), trust_remote_code=True)
     return embed_model
 
 # Function that configures Ollama models and sets some of the initial parameters
 def set_ollama_llm(model, temperature, max_tokens):
+    from llama_index.llms.ollama import Ollama
+    import ollama
+    from http_pool import HTTP_CLIENT_POOL, retry_transport, async_retry_transport, pool_timeout
     llm_models = {
-        "codestral:latest": {"model": "codestral:latest", "device": set_device(1)},
-        "mistral-nemo:latest": {"model": "mistral-nemo:latest", "device": set_device(1)},
-        "llama3.1:latest": {"model": "llama3.1:latest", "device": set_device(1)},
-        "deepseek-coder-v2:latest": {"model": "deepseek-coder-v2:latest", "device": set_device(1)},
-        "gemma2:latest": {"model": "gemma2:latest", "device": set_device(1)},
-        "codegemma:latest": {"model": "codegemma:latest", "device": set_device(1)}
+        "codestral:latest": {"model": "codestral:latest"},
+        "mistral-nemo:latest": {"model": "mistral-nemo:latest"},
+        "llama3.1:latest": {"model": "llama3.1:latest"},
+        "deepseek-coder-v2:latest": {"model": "deepseek-coder-v2:latest"},
+        "gemma2:latest": {"model": "gemma2:latest"},
+        "codegemma:latest": {"model": "codegemma:latest"}
     }
     llm_config = llm_models.get(model, llm_models["codestral:latest"])
-    return Ollama(model=llm_config["model"], request_timeout=30.0, device=llm_config["device"],
-                  temperature=temperature, additional_kwargs={"num_predict": max_tokens})
+    # The Ollama server picks the device itself, so torch isn't imported just to name one
+    llm = Ollama(model=llm_config["model"], base_url=OLLAMA_BASE_URL, request_timeout=HTTP_TIMEOUT,
+                 temperature=temperature, additional_kwargs={"num_predict": max_tokens})
+    # Share one keep alive Ollama client between every Ollama LLM instead of opening new connections per engine reset
+    llm._client = HTTP_CLIENT_POOL.get_client(("ollama", OLLAMA_BASE_URL), lambda: ollama.Client(
+        host=OLLAMA_BASE_URL, timeout=pool_timeout(), transport=retry_transport()))
+    llm._async_client = HTTP_CLIENT_POOL.get_client(("ollama_async", OLLAMA_BASE_URL), lambda: ollama.AsyncClient(
+        host=OLLAMA_BASE_URL, timeout=pool_timeout(), transport=async_retry_transport()))
+    return llm
+
+# Builds the BitsAndBytes quantization config for the users quantization selection
+def set_quantization_config(quantization):
+    import torch
+    from transformers import BitsAndBytesConfig
+    if quantization == "2 Bit":
+        return BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_use_double_quant=True
+        )
+    elif quantization == "4 Bit":
+        return BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_quant_type="nf4"
+        )
+    elif quantization == "8 Bit":
+        return BitsAndBytesConfig(
+            load_in_8bit=True,
+            bnb_8bit_compute_dtype=torch.bfloat16,
+        )
+    return None
 
-# Sets huggingface model and quantization based off of users input
+# Loads the weights and tokenizer for a huggingface model. Only called by the model pool when they aren't loaded yet.
+def load_huggingface_model(model, context_window, quantization):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from huggingface_hub import login
+    clear_gpu_memory()
+    login(token=os.getenv("HUGGINGFACE_HUB_TOKEN"))
+    hf_model = AutoModelForCausalLM.from_pretrained(model,
+                                                    quantization_config=set_quantization_config(quantization),
+                                                    trust_remote_code=True,
+                                                    device_map="cuda:0")
+    tokenizer = AutoTokenizer.from_pretrained(model, max_length=context_window)
+    return hf_model, tokenizer
+
+"""
+Sets huggingface model and quantization based off of users input. The weights come from the model pool so only a new
+model, quantization or context window loads anything, the generation parameters are applied on the lightweight
+HuggingFaceLLM wrapper that gets rebuilt around the pooled model.
+"""
 def set_huggingface_llm(model, temperature, max_tokens, top_p, context_window, quantization):
-    torch.cuda.empty_cache()
-    gc.collect()
+    from llama_index.llms.huggingface import HuggingFaceLLM
+    from model_pool import HF_MODEL_POOL
     if model == "":
-        torch.cuda.empty_cache()
-        gc.collect()
-        pass
-    else:
-        if quantization == "2 Bit":
-            quantization_config = BitsAndBytesConfig(
-                load_in_4bit=True,
-                bnb_4bit_compute_dtype=torch.bfloat16,
-                bnb_4bit_quant_type="nf4",
-                bnb_4bit_use_double_quant=True
-            )
-        elif quantization == "4 Bit":
-            quantization_config = BitsAndBytesConfig(
-                load_in_4bit=True,
-                bnb_4bit_compute_dtype=torch.bfloat16,
-                bnb_4bit_quant_type="nf4"
-            )
-        elif quantization == "8 Bit":
-            quantization_config = BitsAndBytesConfig(
-                load_in_8bit=True,
-                bnb_8bit_compute_dtype=torch.bfloat16,
-            )
-        elif quantization == "No Quantization":
-            quantization_config = None
-        else:
-            quantization_config = None
-
-        model_kwargs = {"quantization_config": quantization_config,
-                        "trust_remote_code": True}
-        torch.cuda.empty_cache()
-        gc.collect()
-        login(token=os.getenv("HUGGINGFACE_HUB_TOKEN"))
-        return HuggingFaceLLM(
-            model_name=model,
-            tokenizer_name=model,
-            context_window=context_window,
-            max_new_tokens=max_tokens,
-            model_kwargs=model_kwargs,
-            is_chat_model=True,
-            device_map="cuda:0",
-            generate_kwargs={
-                "temperature": temperature,
-                "top_p": top_p,
-                "do_sample": True,
-            },
-        )
+        return None
+    hf_model, tokenizer = HF_MODEL_POOL.get(model, quantization, context_window,
+                                            lambda: load_huggingface_model(model, context_window, quantization))
+    return HuggingFaceLLM(
+        model_name=model,
+        tokenizer_name=model,
+        model=hf_model,
+        tokenizer=tokenizer,
+        context_window=context_window,
+        max_new_tokens=max_tokens,
+        is_chat_model=True,
+        generate_kwargs={
+            "temperature": temperature,
+            "top_p": top_p,
+            "do_sample": True,
+        },
+    )
 
 # Sets NVIDIA NIM model and parameters based off of users input
 def set_nvidia_model(model, temperature, max_tokens, top_p):
+    from llama_index.llms.nvidia import NVIDIA
+    from http_pool import HTTP_CLIENT_POOL
     return NVIDIA(
         model=model,
         max_tokens=max_tokens,
         temperature=temperature,
         top_p=top_p,
-        nvidia_api_key=os.getenv("NVIDIA_API_KEY")
+        nvidia_api_key=os.getenv("NVIDIA_API_KEY"),
+        http_client=HTTP_CLIENT_POOL.http_client("NVIDIA NIM"),
+        async_http_client=HTTP_CLIENT_POOL.async_http_client("NVIDIA NIM"),
+        # Retries are handled by the pooled transport
+        max_retries=0,
+        timeout=HTTP_TIMEOUT,
     )
 
 # Sets OpenAI model and parameters based off of users input
 def set_openai_model(model, temperature, max_tokens, top_p):
+    from llama_index.llms.openai import OpenAI
+    from http_pool import HTTP_CLIENT_POOL
     return OpenAI(
         model=model,
         max_tokens=max_tokens,
         temperature=temperature,
         top_p=top_p,
         api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=HTTP_CLIENT_POOL.http_client("OpenAI"),
+        async_http_client=HTTP_CLIENT_POOL.async_http_client("OpenAI"),
+        # Retries are handled by the pooled transport
+        max_retries=0,
+        timeout=HTTP_TIMEOUT,
     )
 
 # Sets Anthropic model and parameters based off of users input
 def set_anth_model(model, temperature, max_tokens):
-    return Anthropic(
+    from llama_index.llms.anthropic import Anthropic
+    import anthropic
+    from http_pool import HTTP_CLIENT_POOL
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    llm = Anthropic(
         model=model,
         max_tokens=max_tokens,
         temperature=temperature,
-        api_key=os.getenv("ANTHROPIC_API_KEY"),
-
+        api_key=api_key,
+        max_retries=0,
+        timeout=HTTP_TIMEOUT,
     )
+    # The Anthropic LLM builds its own SDK clients, so swap in shared ones that sit on the pooled http clients
+    llm._client = HTTP_CLIENT_POOL.get_client(("anthropic", api_key), lambda: anthropic.Anthropic(
+        api_key=api_key, max_retries=0, http_client=HTTP_CLIENT_POOL.http_client("Anthropic")))
+    llm._aclient = HTTP_CLIENT_POOL.get_client(("anthropic_async", api_key), lambda: anthropic.AsyncAnthropic(
+        api_key=api_key, max_retries=0, http_client=HTTP_CLIENT_POOL.async_http_client("Anthropic")))
+    return llm
 
-# Sets chat memory limits based off of models default context length to ensure users don't exceed models limits
+# Chat memory limits based off of each models default context length
+MODEL_MEMORY_LIMITS = {
+    "codestral:latest": 30000,
+    "mistralai/Codestral-22B-v0.1": 30000,
+    "mistral-nemo:latest": 124000,
+    "mistralai/Mistral-Nemo-Instruct-2407": 124000,
+    "llama3.1:latest": 124000,
+    "meta-llama/Meta-Llama-3.1-8B-Instruct": 124000,
+    "deepseek-coder-v2:latest": 124000,
+    "deepseek-ai/DeepSeek-Coder-V2-Lite-Instruct": 124000,
+    "gemma2:latest": 6000,
+    "google/gemma-2-9b-it": 6000,
+    "codegemma:latest": 6000,
+    "google/codegemma-7b": 6000,
+}
+DEFAULT_MEMORY_LIMIT = 30000
+
+# Full context lengths of the models, used to budget the prompt so the answer still fits
+MODEL_CONTEXT_LENGTHS = {
+    "codestral:latest": 32768,
+    "mistralai/Codestral-22B-v0.1": 32768,
+    "mistral-nemo:latest": 128000,
+    "mistralai/Mistral-Nemo-Instruct-2407": 128000,
+    "llama3.1:latest": 128000,
+    "meta-llama/Meta-Llama-3.1-8B-Instruct": 128000,
+    "deepseek-coder-v2:latest": 128000,
+    "deepseek-ai/DeepSeek-Coder-V2-Lite-Instruct": 128000,
+    "gemma2:latest": 8192,
+    "google/gemma-2-9b-it": 8192,
+    "codegemma:latest": 8192,
+    "google/codegemma-7b": 8192,
+    "google/codegemma-7b-it": 8192,
+    "mistralai/codestral-22b-instruct-v0.1": 32768,
+    "nv-mistralai/mistral-nemo-12b-instruct": 128000,
+    "meta/llama-3.1-8b-instruct": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4": 8192,
+    "claude-3-5-sonnet-20240620": 200000,
+    "claude-3-opus-20240229": 200000,
+    "claude-3-sonnet-20240229": 200000,
+    "claude-3-haiku-20240307": 200000,
+}
+DEFAULT_CONTEXT_LENGTH = 32768
+
+
+"""
+Tokens the prompt can use: the models context length, or the context window it was loaded with, minus the tokens kept
+for the answer. max_tokens can only reserve up to MAX_OUTPUT_SHARE of the window, so the prompt is never squeezed to
+nothing when max tokens is as big as the context window.
+"""
+def prompt_token_budget(model, max_tokens, context_window=None):
+    context_length = MODEL_CONTEXT_LENGTHS.get(model, DEFAULT_CONTEXT_LENGTH)
+    if context_window:
+        context_length = min(context_length, context_window)
+    return context_length - min(max_tokens, int(context_length * MAX_OUTPUT_SHARE))
+
+# Token budget for the chat history of a model. The summarizing memory has a much smaller budget than the raw buffer.
+def chat_memory_limit(model):
+    if CHAT_MEMORY_MODE == "summary":
+        return SUMMARY_MEMORY_MODEL_LIMITS.get(model, SUMMARY_MEMORY_TOKEN_LIMIT)
+    return MODEL_MEMORY_LIMITS.get(model, DEFAULT_MEMORY_LIMIT)
+
+"""
+Sets chat memory limits based off of the model to ensure users don't exceed models limits. The summarizing memory gets
+its LLM when the chat engine is built, since the memory outlives engine rebuilds for parameter changes.
+"""
 def set_chat_memory(model):
-    memory_limits = {
-        "codestral:latest": 30000,
-        "mistralai/Codestral-22B-v0.1": 30000,
-        "mistral-nemo:latest": 124000,
-        "mistralai/Mistral-Nemo-Instruct-2407": 124000,
-        "llama3.1:latest": 124000,
-        "meta-llama/Meta-Llama-3.1-8B-Instruct": 124000,
-        "deepseek-coder-v2:latest": 124000,
-        "deepseek-ai/DeepSeek-Coder-V2-Lite-Instruct": 124000,
-        "gemma2:latest": 6000,
-        "google/gemma-2-9b-it": 6000,
-        "codegemma:latest": 6000,
-        "google/codegemma-7b": 6000,
-    }
-    token_limit = memory_limits.get(model, 30000)
-    return ChatMemoryBuffer.from_defaults(token_limit=token_limit)
+    if CHAT_MEMORY_MODE == "summary":
+        return SummaryChatMemory.from_defaults(token_limit=chat_memory_limit(model))
+    return ChatMemoryBuffer.from_defaults(token_limit=chat_memory_limit(model))
 
 
 # TODO Finish neo4j implementation
 """
-Sets up the initial chat engine. Loads documents, model, embedding model, memory, prompt or custom prompt,
-and storage context. This pulls from defaults set above and gets updated by create chat engine as users input new 
-parameters and data.
+Builds the vector index from the loaded documents, embedding model and optional storage context. Documents can be any
+iterable and are streamed through the ingest pipeline in batches. This is the expensive part of the pipeline so it is
+only called when the knowledge base itself changes.
+"""
+def setup_index(docs, embed_model, storage_context):
+    index = VectorStoreIndex(nodes=[], storage_context=storage_context, embed_model=embed_model)
+    run_ingest_pipeline(docs, index, embed_model)
+    return index
+
+
+"""
+Sets up the chat engine on top of an already built index. Loads the model, memory and prompt or custom prompt. This is
+cheap and gets called every time users update model parameters, so the index never has to be rebuilt for them. If there
+is no index a plain chat engine without retrieval is used. Given a prompt token budget, the chat history is capped at its
+share of it and retrieved context is packed into whatever the system prompt, history and query leave, counted with the
+models tokenizer.
 """
-def setup_index_and_chat_engine(docs, embed_model, llm, memory, custom_prompt, storage_context):
-    if storage_context:
-        index = VectorStoreIndex.from_documents(docs, storage_context=storage_context, embed_model=embed_model)
-    else:
-        index = VectorStoreIndex.from_documents(docs, embed_model=embed_model)
+def setup_chat_engine(index, llm, memory, custom_prompt, prompt_budget=None):
     chat_prompt = (
         "You are an AI coding assistant, your primary function is to help users with coding-related questions \n"
         "and tasks. You have access to a knowledge base of programming documentation and best practices. \n"
@@ -163,20 +311,44 @@ def setup_index_and_chat_engine(docs, embed_model, llm, memory, custom_prompt, s
         "Response:"
     )
     system_message = ChatMessage(role="system", content=chat_prompt if custom_prompt is None else custom_prompt)
-    chat_engine = index.as_chat_engine(
-        chat_mode=ChatMode.CONTEXT,
-        memory=memory,
-        stream=True,
-        system_prompt=system_message,
-        llm=llm,
-        verbose=True,
-        context_prompt=("Context information is below.\n"
+    tokenizer_fn = model_tokenizer(llm)
+    if prompt_budget is not None:
+        memory.tokenizer_fn = tokenizer_fn
+        system_tokens = len(tokenizer_fn(system_message.content))
+        if system_tokens >= prompt_budget:
+            gr.Warning(f"The system prompt is {system_tokens} tokens but the model only has room for {prompt_budget} "
+                       f"prompt tokens. Shorten the prompt, lower the max output tokens or raise the context window.",
+                       duration=15)
+    if index is None:
+        # The buffer memory leaves room for the system prompt it is given, the summarizing memory only counts history
+        if prompt_budget is not None:
+            history_limit = prompt_budget - system_tokens if isinstance(memory, SummaryChatMemory) else prompt_budget
+            memory.token_limit = min(memory.token_limit, max(0, history_limit))
+        return SimpleChatEngine.from_defaults(llm=llm, memory=memory, prefix_messages=[system_message])
+    # The context template is added to the system prompt. The query is sent as the user message so it isn't repeated.
+    context_template = ("Context information is below.\n"
                         "---------------------\n"
                         "{context_str}\n"
                         "---------------------\n"
                         "Given the context information above I want you to think step by step to answer \n"
-                        "the query in a crisp manner, incase case you don't know the answer say 'I don't know!'. \n"
-                        "Query: {query_str} \n"
-                        "Answer: ")
+                        "the query in a crisp manner, incase case you don't know the answer say 'I don't know!'. \n")
+    node_postprocessors = []
+    if prompt_budget is not None:
+        reserved = len(tokenizer_fn(system_message.content.strip() + "\n" + context_template.format(context_str="")))
+        packer = ContextPacker(tokenizer_fn=tokenizer_fn, prompt_budget=prompt_budget, reserved_tokens=reserved,
+                               memory=memory)
+        # Otherwise the history could grow into the tokens the packer sets aside for context
+        memory.token_limit = min(memory.token_limit, packer.history_limit())
+        node_postprocessors.append(packer)
+    # CONTEXT chat mode, built directly so retrieval goes through the retrieval cache
+    chat_engine = ContextChatEngine.from_defaults(
+        retriever=CachedRetriever(index, similarity_top_k=CONTEXT_CANDIDATES),
+        memory=memory,
+        stream=True,
+        prefix_messages=[system_message],
+        llm=llm,
+        verbose=True,
+        node_postprocessors=node_postprocessors,
+        context_template=context_template
     )
     return chat_engine